@@ -8,6 +8,9 @@ import AdminDashboard from "./pages/AdminDashboard";
 import HomeInternetPanel from "./pages/admin/HomeInternetPanel";
 import "./index.css";
 
+// Unread-count polling interval when no notification stream is available
+const NOTIFICATION_POLL_MS = 30000;
+
 function App() {
   const [user, setUser] = useState(null);
   const [currentPage, setCurrentPage] = useState('login');
@@ -67,6 +70,11 @@ function App() {
   };
 
   const handleLogout = () => {
+    // Revoke the token server-side; logging out locally does not depend on it
+    const token = localStorage.getItem('accessToken');
+    if (token) {
+      api.post('/logout', null, { headers: { Authorization: `Bearer ${token}` } }).catch(() => {});
+    }
     setUser(null);
     // Clear all user data from localStorage
     localStorage.removeItem('user');
@@ -74,6 +82,7 @@ function App() {
     localStorage.removeItem('username');
     localStorage.removeItem('userEmail');
     localStorage.removeItem('isAdmin');
+    localStorage.removeItem('accessToken');
     setCurrentPage('login');
   };
 
@@ -93,22 +102,39 @@ function App() {
     }
   };
 
-  // Fetch notifications for non-admin users
+  // Fetch the unread count once, then listen for new notifications over SSE.
+  // If the server has no stream slot free (503) the EventSource gives up,
+  // and we poll the unread count instead.
   useEffect(() => {
     if (user && !user.isAdmin) {
       fetchNotifications();
-      // Poll for new notifications every 30 seconds
-      const interval = setInterval(fetchNotifications, 30000);
-      return () => clearInterval(interval);
+      let poller = null;
+      const stream = new EventSource(
+        `${api.defaults.baseURL}/notifications/stream?user_id=${user.id}`
+      );
+      stream.addEventListener('notification', (event) => {
+        const notification = JSON.parse(event.data);
+        if (notification.status === 'unread') {
+          setUnreadCount(count => count + 1);
+        }
+      });
+      stream.onerror = () => {
+        if (stream.readyState === EventSource.CLOSED && !poller) {
+          poller = setInterval(fetchNotifications, NOTIFICATION_POLL_MS);
+        }
+      };
+      return () => {
+        stream.close();
+        clearInterval(poller);
+      };
     }
   }, [user]);
 
   const fetchNotifications = async () => {
     if (!user || user.isAdmin) return;
     try {
-      const res = await api.get(`/notifications?user_id=${user.id}`);
-      const unread = res.data.filter(n => n.status === 'unread').length;
-      setUnreadCount(unread);
+      const res = await api.get(`/notifications/unread-count?user_id=${user.id}`);
+      setUnreadCount(res.data.unread);
     } catch (err) {
       console.error("Error fetching notifications:", err);
     }
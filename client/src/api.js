@@ -12,6 +12,15 @@ const api = axios.create({
   },
 });
 
+// Attach the access token issued at login to every request
+api.interceptors.request.use((config) => {
+  const token = localStorage.getItem('accessToken');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
 // Log the API URL in development for debugging
 if (import.meta.env.DEV) {
   console.log('API URL:', API_URL);
@@ -23,6 +23,7 @@ export const LoginPage = ({ onLogin, onGoToRegister }) => {
 
       if (response.status === 200) {
         const userData = response.data.user;
+        localStorage.setItem('accessToken', response.data.access_token);
 
         // Extract first name from full name
         const firstName = userData.name ? userData.name.split(' ')[0] : 'User';
@@ -32,6 +32,7 @@ export default function Register({ onGoToLogin, onRegisterSuccess }) {
       if (registerRes.status === 201) {
         // Registration successful - now log them in automatically
         alert("Registration successful! Logging you in...");
+        localStorage.setItem('accessToken', registerRes.data.access_token);
 
         // Extract first name from full name
         const firstName = form.name ? form.name.split(' ')[0] : 'User';
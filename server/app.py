@@ -1,13 +1,45 @@
-from flask import Flask, jsonify,request
+from flask import Flask, jsonify,request, Response, stream_with_context
 from flask_migrate import Migrate
 from flask_cors import CORS
-from models import db, bcrypt, User, SubscriptionTier, Subscription, Feedback, Complaint, LoyaltyPoint, Notification
+from flask_jwt_extended import jwt_required
+from models import db, bcrypt, User, SubscriptionTier, Subscription, Feedback, Complaint, Notification, CommunicationJob, Redemption
 from config import Config
+import auth
+from auth import admin_required, current_user_id, issue_token, revoke_current_token
+from expiry import expiry_scheduler, expire_active_of_type
+from db_helpers import parse_naive_utc, utc_naive_now
+from hashing import password_hasher, HashingBusy
+import idempotency
+import db_pool
+from db_pool import statement_timeout
+import exports
+import http_cache
+import metrics
+import usage_ingest
+import payments
+from payments import payment_worker
+from usage_rollups import usage_rollup_worker
+import usage_rollups
+import loyalty
+from fanout import fanout, recipient_filter
+from notification_bus import notification_bus, stream_slots
+import retention
+import revenue
+import rollups
+from pagination import parse_limit, page_response, encode_cursor, decode_cursor
+from tier_cache import tier_cache
+from serializers import Projection, FastJSONProvider
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import aliased
 from datetime import datetime, timedelta, timezone
+import hmac
+import json
 import os
+import time
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = FastJSONProvider(app)
 
 # Configure CORS to allow requests from frontend
 # In production, Vercel URL
@@ -22,12 +54,21 @@ allowed_origins = [
 if os.environ.get('FRONTEND_URL'):
     allowed_origins.append(os.environ.get('FRONTEND_URL'))
 
-CORS(app, origins=allowed_origins, supports_credentials=True)
+CORS(app, origins=allowed_origins, supports_credentials=True, expose_headers=['X-Next-Cursor', 'ETag'])
 
+db_pool.init_app(app)
 db.init_app(app)
 bcrypt.init_app(app)
+password_hasher.init_app(app)
+auth.init_app(app)
 migrate = Migrate(app, db)
 
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(e):
+    response = jsonify({"error": "Server busy, please try again shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # Initialize database tables and create admin user on startup
 def init_db():
     """Initialize database tables and create default admin user if not exists"""
@@ -54,6 +95,20 @@ def init_db():
 # Run initialization when app starts
 init_db()
 
+# Subscriptions are expired by a background scheduler, not on read
+expiry_scheduler.init_app(app)
+rollups.init_app(app)
+retention.init_app(app)
+idempotency.init_app(app)
+usage_rollup_worker.init_app(app)
+payment_worker.init_app(app)
+revenue.init_app(app)
+loyalty.ledger_compactor.init_app(app)
+fanout.init_app(app)
+# Before http_cache, so metrics see the final status (e.g. 304)
+metrics.init_app(app)
+http_cache.init_app(app)
+
 @app.route('/')
 def home():
     return jsonify({"message": "Welcome to WiFi Portal"}), 200
@@ -84,6 +139,7 @@ def register():
     return jsonify({
         "message": "User registered successfully",
         "user_id": user.id,
+        "access_token": issue_token(user),
         "user": {
             "id": user.id,
             "name": user.name,
@@ -109,8 +165,14 @@ def login():
     if not user or not user.check_password(password):
         return jsonify({"error": "Invalid credentials"}), 401
 
+    # Upgrade hashes made with an older cost factor
+    if password_hasher.needs_rehash(user.password_hash):
+        user.set_password(password)
+        db.session.commit()
+
     return jsonify({
         "message": "Login successful",
+        "access_token": issue_token(user),
         "user": {
             "id": user.id,
             "name": user.name,
@@ -119,36 +181,69 @@ def login():
         }
     }), 200
 
+@app.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """Revoke the caller's access token."""
+    revoke_current_token()
+    return jsonify({"message": "Logged out"}), 200
+
+@app.route('/auth/hashing-stats', methods=['GET'])
+@admin_required
+def get_hashing_stats():
+    """Password hashing throughput for this worker (admin only)."""
+    return jsonify(password_hasher.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for all workers of this instance."""
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({"error": "Unauthorized"}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@app.route('/db/pool-stats', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    """Connection pool checkouts, wait times and saturation for this worker (admin only)."""
+    return jsonify(db_pool.pool_stats(db.engine)), 200
+
+TIER_FIELDS = Projection({
+    "id": SubscriptionTier.id,
+    "name": SubscriptionTier.name,
+    "price": SubscriptionTier.price,
+    "duration_days": SubscriptionTier.duration_days,
+    "speed_limit": SubscriptionTier.speed_limit,
+    "data_limit": SubscriptionTier.data_limit,
+    "description": SubscriptionTier.description,
+    "tier_type": SubscriptionTier.tier_type
+})
+
 @app.route('/tiers', methods=['GET'])
 def get_tiers():
+    """List tiers, served from the in-process tier cache.
+
+    Responses carry an ETag; clients sending If-None-Match get a 304.
+    """
     tier_type = request.args.get('type')  # Optional filter: 'hotspot' or 'home_internet'
 
-    if tier_type:
-        tiers = SubscriptionTier.query.filter_by(tier_type=tier_type).all()
-    else:
-        tiers = SubscriptionTier.query.all()
+    def build():
+        query = TIER_FIELDS.query().order_by(SubscriptionTier.id)
+        if tier_type:
+            query = query.filter(SubscriptionTier.tier_type == tier_type)
+        return TIER_FIELDS.serialize_all(query.all())
 
-    result = [{
-        "id": t.id,
-        "name": t.name,
-        "price": float(t.price),
-        "duration_days": t.duration_days,
-        "speed_limit": t.speed_limit,
-        "data_limit": t.data_limit,
-        "description": t.description,
-        "tier_type": t.tier_type
-    } for t in tiers]
-    return jsonify(result), 200
+    body, etag = tier_cache.get(tier_type, build)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/tiers', methods=['POST'])
+@admin_required
 def create_tier():
     data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != 'admin':
-        return jsonify({"error": "Admins only"}), 403
-
     tier = SubscriptionTier(
         name=data.get('name'),
         price=data.get('price'),
@@ -160,38 +255,45 @@ def create_tier():
     )
     db.session.add(tier)
     db.session.commit()
+    tier_cache.invalidate()
     return jsonify({"message": "Tier created successfully"}), 201
 
 @app.route('/tiers/<int:id>', methods=['PATCH'])
+@admin_required
 def update_tier(id):
     data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != 'admin':
-        return jsonify({"error": "Admins only"}), 403
-
     tier = SubscriptionTier.query.get_or_404(id)
     for key, value in data.items():
         setattr(tier, key, value)
     db.session.commit()
+    tier_cache.invalidate()
     return jsonify({"message": "Tier updated"}), 200
 
 @app.route('/tiers/<int:id>', methods=['DELETE'])
+@admin_required
 def delete_tier(id):
-    data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != 'admin':
-        return jsonify({"error": "Admins only"}), 403
-
     tier = SubscriptionTier.query.get_or_404(id)
+    rollups.forget_tier(tier.id)
     db.session.delete(tier)
     db.session.commit()
+    tier_cache.invalidate()
     return jsonify({"message": "Tier deleted"}), 200
 #here an admin deletes a subscription tier
 
+FEEDBACK_FIELDS = Projection({
+    "id": Feedback.id,
+    "user_id": Feedback.user_id,
+    "type": Feedback.type,
+    "subscription_type": Feedback.subscription_type,
+    "subject": Feedback.subject,
+    "rating": Feedback.rating,
+    "comment": Feedback.comment,
+    "status": Feedback.status,
+    "admin_response": Feedback.admin_response,
+    "created_at": Feedback.created_at,
+    "updated_at": Feedback.updated_at
+})
+
 @app.route('/feedbacks', methods=['GET'])
 def get_feedbacks():
     """Fetch feedbacks/complaints (admin sees all, user sees own)."""
@@ -202,29 +304,17 @@ def get_feedbacks():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
+    query = FEEDBACK_FIELDS.query().order_by(Feedback.id)
     if user.role == 'admin':
         # Admin can filter by subscription_type
         if subscription_type:
-            feedbacks = Feedback.query.filter_by(subscription_type=subscription_type).all()
-        else:
-            feedbacks = Feedback.query.all()
+            query = query.filter(Feedback.subscription_type == subscription_type)
     else:
-        feedbacks = Feedback.query.filter_by(user_id=user.id).all()
+        query = query.filter(Feedback.user_id == user.id)
 
-    result = [{
-        "id": f.id,
-        "user_id": f.user_id,
-        "type": f.type,
-        "subscription_type": f.subscription_type,
-        "subject": f.subject,
-        "rating": f.rating,
-        "comment": f.comment,
-        "status": f.status,
-        "admin_response": f.admin_response,
-        "created_at": f.created_at.isoformat() if f.created_at else None,
-        "updated_at": f.updated_at.isoformat() if f.updated_at else None
-    } for f in feedbacks]
-    return jsonify(result), 200
+    feedbacks = query.all()
+    http_cache.last_modified(feedbacks, 'updated_at', 'created_at')
+    return jsonify(FEEDBACK_FIELDS.serialize_all(feedbacks)), 200
 
 @app.route('/feedbacks', methods=['POST'])
 def add_feedback():
@@ -290,15 +380,10 @@ def add_complaint():
 
 
 @app.route('/complaints/<int:id>/reply', methods=['PATCH'])
+@admin_required
 def reply_complaint(id):
     """Admin responds to a complaint."""
     data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != "admin":
-        return jsonify({"error": "Admins only"}), 403
-
     complaint = Complaint.query.get_or_404(id)
     complaint.admin_response = data.get('admin_response')
     complaint.status = data.get('status', 'resolved')
@@ -314,6 +399,7 @@ def reply_complaint(id):
     db.session.add(notification)
 
     db.session.commit()
+    notification_bus.publish(complaint.user_id)
     return jsonify({"message": "Complaint updated successfully"}), 200
 
 
@@ -322,7 +408,7 @@ def reply_complaint(id):
 def get_loyalty_points():
     """View loyalty points for a user."""
     user_id = request.args.get('user_id')
-    points = LoyaltyPoint.query.filter_by(user_id=user_id).first()
+    points = loyalty.get_summary(user_id)
 
     if not points:
         return jsonify({"points": 0, "balance": 0}), 200
@@ -334,22 +420,46 @@ def get_loyalty_points():
     }), 200
 
 
+NOTIFICATION_FIELDS = Projection({
+    "id": Notification.id,
+    "message": Notification.message,
+    "channel": Notification.channel,
+    "type": Notification.type,
+    "status": Notification.status,
+    "created_at": Notification.created_at
+})
+
 @app.route('/notifications', methods=['GET'])
 def get_notifications():
-    """Fetch user notifications."""
+    """Fetch user notifications, newest first.
+
+    Optional query params: status, limit, cursor (from X-Next-Cursor).
+    """
     user_id = request.args.get('user_id')
-    notes = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
+    query = NOTIFICATION_FIELDS.query().filter(Notification.user_id == user_id)
+
+    status = request.args.get('status')
+    if status:
+        query = query.filter(Notification.status == status)
+
+    # Keyset pagination on (created_at, id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            created_at, notification_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(
+            tuple_(Notification.created_at, Notification.id) < tuple_(created_at, notification_id)
+        )
+    query = query.order_by(Notification.created_at.desc(), Notification.id.desc())
 
-    result = [{
-        "id": n.id,
-        "message": n.message,
-        "channel": n.channel,
-        "type": n.type,
-        "status": n.status,
-        "created_at": n.created_at.isoformat() if n.created_at else None
-    } for n in notes]
+    limit = parse_limit()
+    if limit is not None:
+        query = query.limit(limit + 1)
 
-    return jsonify(result), 200
+    return page_response(query.all(), limit, NOTIFICATION_FIELDS.serialize,
+                         lambda n: encode_cursor(n.created_at, n.id)), 200
 
 @app.route('/notifications/<int:notification_id>/read', methods=['PATCH'])
 def mark_notification_read(notification_id):
@@ -370,46 +480,148 @@ def mark_all_notifications_read():
     db.session.commit()
     return jsonify({"message": "All notifications marked as read"}), 200
 
+@app.route('/notifications/unread-count', methods=['GET'])
+def get_unread_notification_count():
+    """Number of unread notifications for a user."""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({"error": "user_id required"}), 400
+
+    unread = Notification.query.filter_by(user_id=user_id, status='unread').count()
+    return jsonify({"unread": unread}), 200
+
+@app.route('/notifications/stream', methods=['GET'])
+def stream_notifications():
+    """Server-Sent Events stream of new notifications for a user.
+
+    Only rows with an id greater than the cursor are sent. The cursor comes
+    from the Last-Event-ID header on reconnect, or ?since= on first connect;
+    without either the stream starts from the user's latest notification.
+
+    Every frame, keepalives included, carries the cursor as its SSE id, so
+    the browser sends it back as Last-Event-ID and nothing created while
+    it was reconnecting is skipped.
+
+    Each open stream holds a worker thread, so this is a long-poll: the
+    stream closes after NOTIFICATION_STREAM_TIMEOUT seconds and the browser
+    reconnects NOTIFICATION_STREAM_POLL_SECONDS later. At most
+    NOTIFICATION_STREAMS_PER_WORKER streams are open at once; beyond that
+    the request gets a 503 and the client falls back to polling
+    /notifications/unread-count.
+    """
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({"error": "user_id required"}), 400
+
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        since = db.session.query(func.coalesce(func.max(Notification.id), 0)) \
+            .filter(Notification.user_id == user_id).scalar()
+    db.session.close()
+
+    if not stream_slots.acquire(app.config['NOTIFICATION_STREAMS_PER_WORKER']):
+        response = jsonify({"error": "Too many open notification streams",
+                            "poll": f"/notifications/unread-count?user_id={user_id}"})
+        response.headers['Retry-After'] = str(app.config['NOTIFICATION_STREAM_TIMEOUT'])
+        return response, 503
+
+    timeout = app.config['NOTIFICATION_STREAM_TIMEOUT']
+    poll = app.config['NOTIFICATION_STREAM_POLL_SECONDS']
+
+    def events():
+        cursor = since
+        deadline = time.monotonic() + timeout
+        yield f"retry: {poll * 1000}\nid: {cursor}\n\n"
+        while time.monotonic() < deadline:
+            token = notification_bus.token(user_id)
+            new_rows = db.session.query(
+                Notification.id, Notification.message, Notification.channel,
+                Notification.type, Notification.status, Notification.created_at
+            ).filter(Notification.user_id == user_id, Notification.id > cursor) \
+             .order_by(Notification.id).all()
+            # Give the connection back to the pool while we wait
+            db.session.close()
+
+            for n in new_rows:
+                payload = json.dumps({
+                    "id": n.id,
+                    "message": n.message,
+                    "channel": n.channel,
+                    "type": n.type,
+                    "status": n.status,
+                    "created_at": n.created_at.isoformat() if n.created_at else None
+                })
+                yield f"id: {n.id}\nevent: notification\ndata: {payload}\n\n"
+                cursor = n.id
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not notification_bus.wait(user_id, token, min(poll, remaining)):
+                yield f": keepalive\nid: {cursor}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Runs when the server closes the response, even if it was never iterated
+    response.call_on_close(stream_slots.release)
+    return response
+
+USER_LIST_FIELDS = Projection({
+    "id": User.id,
+    "name": User.name,
+    "email": User.email,
+    "phone_number": User.phone_number,
+    "subscription_tier": SubscriptionTier.name,
+    "activated_at": Subscription.start_date,
+    "status": User.status,
+    "created_at": User.created_at
+}, constants={"device_id": None, "usage_mb": 0})
+
 @app.route('/users', methods=['GET'])
 def get_users():
-    """Get all users with their subscription info (admin only)."""
-    # Auto-expire subscriptions before fetching user data
-    now = datetime.now(timezone.utc)
-    active_subscriptions = Subscription.query.filter_by(status='active').all()
-    for s in active_subscriptions:
-        if s.end_date:
-            # Handle both timezone-aware and naive datetimes
-            end_date = s.end_date
-            if end_date.tzinfo is None:
-                # If naive, assume it's UTC and make it aware
-                end_date = end_date.replace(tzinfo=timezone.utc)
-            if end_date < now:
-                s.status = 'expired'
-    db.session.commit()
+    """Get all users with their subscription info (admin only).
 
-    users = User.query.all()
-    result = []
-    for u in users:
-        # Get user's active subscription
-        subscription = db.session.query(Subscription).filter_by(user_id=u.id, status='active').first()
-        tier_name = None
-        if subscription:
-            tier = SubscriptionTier.query.get(subscription.tier_id)
-            tier_name = tier.name if tier else None
-
-        result.append({
-            "id": u.id,
-            "name": u.name,
-            "email": u.email,
-            "phone_number": u.phone_number,
-            "device_id": getattr(u, 'device_id', None),
-            "subscription_tier": tier_name,
-            "activated_at": subscription.start_date.isoformat() if subscription else None,
-            "status": u.status,
-            "usage_mb": getattr(u, 'usage_mb', 0),
-            "created_at": u.created_at.isoformat() if u.created_at else None
-        })
-    return jsonify(result), 200
+    Optional query params: status, tier_id, after_id, limit.
+    """
+    # One row per user: pick a single active subscription per user (the
+    # lowest id, matching the old `.first()`), then join its tier.
+    active_sub = db.session.query(
+        Subscription.user_id,
+        func.min(Subscription.id).label('subscription_id')
+    ).filter(Subscription.status == 'active').group_by(Subscription.user_id).subquery()
+
+    query = USER_LIST_FIELDS.query().select_from(User) \
+     .outerjoin(active_sub, active_sub.c.user_id == User.id) \
+     .outerjoin(Subscription, Subscription.id == active_sub.c.subscription_id) \
+     .outerjoin(SubscriptionTier, SubscriptionTier.id == Subscription.tier_id)
+
+    # Optional filters
+    status = request.args.get('status')
+    if status:
+        query = query.filter(User.status == status)
+    tier_id = request.args.get('tier_id', type=int)
+    if tier_id:
+        tier_sub = aliased(Subscription)
+        query = query.filter(db.session.query(tier_sub.id).filter(
+            tier_sub.user_id == User.id,
+            tier_sub.status == 'active',
+            tier_sub.tier_id == tier_id
+        ).exists())
+
+    # Keyset pagination on users.id (?after_id=&limit=)
+    after_id = request.args.get('after_id', type=int)
+    if after_id:
+        query = query.filter(User.id > after_id)
+    query = query.order_by(User.id)
+
+    limit = parse_limit()
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    return page_response(query.all(), limit, USER_LIST_FIELDS.serialize, lambda row: row.id), 200
 
 @app.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
@@ -428,15 +640,9 @@ def get_user(user_id):
     }), 200
 
 @app.route('/users/<int:user_id>/disconnect', methods=['POST'])
+@admin_required
 def disconnect_user(user_id):
     """Disconnect a user from the network (admin only)."""
-    data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != 'admin':
-        return jsonify({"error": "Admins only"}), 403
-
     user = User.query.get_or_404(user_id)
     user.status = 'inactive'
     db.session.commit()
@@ -444,60 +650,166 @@ def disconnect_user(user_id):
 
 @app.route('/loyalty/all', methods=['GET'])
 def get_all_loyalty():
-    """Get all loyalty records (admin only)."""
-    loyalty_records = LoyaltyPoint.query.all()
-    result = []
-    for lp in loyalty_records:
-        user = User.query.get(lp.user_id)
-        result.append({
-            "id": lp.id,
-            "user_id": lp.user_id,
-            "user_name": user.name if user else None,
-            "user_email": user.email if user else None,
-            "phone_number": user.phone_number if user else None,
-            "device_id": getattr(user, 'device_id', None) if user else None,
-            "points_earned": lp.points_earned,
-            "points_redeemed": lp.points_redeemed,
-            "balance": lp.balance
-        })
-    return jsonify(result), 200
+    """Get all loyalty records (admin only).
+
+    Optional query params: sort ('user' or 'balance' for a leaderboard,
+    highest first), min_balance, limit, cursor (from X-Next-Cursor).
+    Sorting and min_balance use the balance as of the last ledger
+    compaction (every LOYALTY_COMPACTION_SECONDS); the balances returned
+    are always current.
+    """
+    lp = loyalty.loyalty_points
+    sort = request.args.get('sort', 'user')
+    if sort not in ('user', 'balance'):
+        return jsonify({"error": "Invalid sort. Use 'user' or 'balance'"}), 400
+
+    page = select(lp.c.user_id)
+    min_balance = request.args.get('min_balance', type=int)
+    if min_balance is not None:
+        page = page.where(lp.c.balance >= min_balance)
+
+    # Keyset pagination on (balance, user_id) for the leaderboard, user_id otherwise
+    cursor = request.args.get('cursor')
+    try:
+        if sort == 'balance':
+            if cursor:
+                balance, _, user_id = cursor.rpartition('|')
+                page = page.where(tuple_(lp.c.balance, lp.c.user_id) < tuple_(int(balance), int(user_id)))
+            order = (lp.c.balance.desc(), lp.c.user_id.desc())
+        else:
+            if cursor:
+                page = page.where(lp.c.user_id > int(cursor))
+            order = (lp.c.user_id,)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    page = page.order_by(*order)
+
+    limit = parse_limit()
+    if limit is not None:
+        page = page.limit(limit + 1)
+
+    # One joined projection for the page instead of a User lookup per record
+    rows = db.session.execute(loyalty.ranked_query(page).order_by(*order)).all()
+
+    def serialize(record):
+        return {
+            "id": record.id,
+            "user_id": record.user_id,
+            "user_name": record.user_name,
+            "user_email": record.user_email,
+            "phone_number": record.phone_number,
+            "device_id": None,  # users have no device_id column
+            "points_earned": record.points_earned,
+            "points_redeemed": record.points_redeemed,
+            "balance": record.balance
+        }
+
+    def cursor_for(record):
+        return f"{record.ranked_balance}|{record.user_id}" if sort == 'balance' else record.user_id
+
+    return page_response(rows, limit, serialize, cursor_for), 200
 
 @app.route('/analytics/tier-subscriptions', methods=['GET'])
 def get_tier_subscription_analytics():
     """Get subscription count by tier for analytics (admin only)."""
     tier_type = request.args.get('type', 'hotspot')  # Default to hotspot
 
-    # Get all tiers of the specified type
-    tiers = SubscriptionTier.query.filter_by(tier_type=tier_type).all()
-
-    result = []
-    for tier in tiers:
-        # Count active subscriptions for this tier
-        active_count = Subscription.query.filter_by(tier_id=tier.id, status='active').count()
-        # Count all subscriptions (including expired) for this tier
-        total_count = Subscription.query.filter_by(tier_id=tier.id).count()
-
-        result.append({
-            "tier_id": tier.id,
-            "tier_name": tier.name,
-            "price": float(tier.price),
-            "active_subscribers": active_count,
-            "total_subscribers": total_count,
-            "duration_hours": tier.duration_days
-        })
+    # Read precomputed counters when the rollup is enabled, otherwise one GROUP BY
+    if rollups.enabled():
+        rows = rollups.rollup_counts_query(tier_type).all()
+    else:
+        rows = rollups.tier_counts_query(tier_type).all()
+
+    result = [{
+        "tier_id": row.id,
+        "tier_name": row.name,
+        "price": float(row.price),
+        "active_subscribers": row.active_count,
+        "total_subscribers": row.total_count,
+        "duration_hours": row.duration_days
+    } for row in rows]
 
     return jsonify(result), 200
 
+@app.route('/analytics/usage', methods=['GET'])
+@admin_required
+def get_usage_analytics():
+    """Usage time series from the hourly/daily rollups (admin only).
+
+    Optional query params: granularity ('hour' or 'day', default day),
+    start and end (ISO UTC; default the last 7 days, or 24 hours for
+    hourly), group_by ('location', 'tier_id' or 'user_id'), and filters
+    user_id, location, tier_id.
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('hour', 'day'):
+        return jsonify({"error": "Invalid granularity. Use 'hour' or 'day'"}), 400
+    group_by = request.args.get('group_by')
+    if group_by not in (None, 'location', 'tier_id', 'user_id'):
+        return jsonify({"error": "Invalid group_by. Use 'location', 'tier_id' or 'user_id'"}), 400
+
+    try:
+        end = parse_naive_utc(request.args.get('end')) or utc_naive_now()
+        start = parse_naive_utc(request.args.get('start')) or \
+            end - (timedelta(hours=24) if granularity == 'hour' else timedelta(days=7))
+    except ValueError:
+        return jsonify({"error": "Invalid start or end. Use ISO 8601"}), 400
+
+    return jsonify(usage_rollups.series(
+        granularity, start, end, group_by=group_by,
+        user_id=request.args.get('user_id', type=int),
+        location=request.args.get('location'),
+        tier_id=request.args.get('tier_id', type=int)
+    )), 200
+
+@app.route('/analytics/revenue', methods=['GET'])
+@admin_required
+def get_revenue_analytics():
+    """Revenue time series from the precomputed buckets (admin only).
+
+    Optional query params: granularity ('day' or 'month', default day),
+    start and end (local dates YYYY-MM-DD, end exclusive; default the last
+    30 days, or 12 months for monthly), group_by (comma-separated
+    tier_type and/or payment_method), and filters tier_type, payment_method.
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in revenue.GRANULARITIES:
+        return jsonify({"error": "Invalid granularity. Use 'day' or 'month'"}), 400
+    group_by = tuple(g for g in request.args.get('group_by', '').split(',') if g)
+    if any(g not in revenue.DIMENSIONS for g in group_by):
+        return jsonify({"error": "Invalid group_by. Use tier_type and/or payment_method"}), 400
+
+    try:
+        today = revenue.local_day(utc_naive_now())
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') if 'end' in request.args else today + timedelta(days=1)
+        if 'start' in request.args:
+            start = datetime.strptime(request.args['start'], '%Y-%m-%d')
+        elif granularity == 'month':
+            start = datetime(end.year - 1, end.month, 1)
+        else:
+            start = end - timedelta(days=30)
+    except ValueError:
+        return jsonify({"error": "Invalid start or end. Use YYYY-MM-DD"}), 400
+
+    filters = dict(tier_type=request.args.get('tier_type'), payment_method=request.args.get('payment_method'))
+    rows = revenue.series(granularity, start, end, group_by=group_by, **filters)
+    amount, count = revenue.total(start, end, **filters)
+
+    return jsonify({
+        "series": [dict(
+            {"bucket_start": row.bucket_start.date().isoformat(),
+             "amount": float(row.amount or 0),
+             "payments": row.payments},
+            **{g: getattr(row, g) for g in group_by}
+        ) for row in rows],
+        "total": {"amount": float(amount), "payments": count}
+    }), 200
+
 @app.route('/feedbacks/<int:feedback_id>/reply', methods=['PATCH'])
+@admin_required
 def reply_to_feedback(feedback_id):
     """Admin responds to feedback or complaint."""
     data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != 'admin':
-        return jsonify({"error": "Admins only"}), 403
-
     feedback = Feedback.query.get_or_404(feedback_id)
     feedback.admin_response = data.get('admin_response')
     feedback.status = data.get('status', 'resolved')
@@ -515,28 +827,35 @@ def reply_to_feedback(feedback_id):
     db.session.add(notification)
 
     db.session.commit()
+    notification_bus.publish(feedback.user_id)
     return jsonify({"message": "Response sent successfully"}), 200
 
 @app.route('/subscriptions', methods=['POST'])
 def create_subscription():
-    """User subscribes to a tier."""
+    """User subscribes to a tier.
+
+    Send an Idempotency-Key header to make retries safe: a repeated key
+    returns the original response without creating another subscription
+    or awarding points twice.
+    """
     data = request.get_json()
     user_id = data.get('user_id')
     tier_id = data.get('tier_id')
 
+    key = idempotency.request_key('subscriptions', user_id)
+    if key:
+        replay = idempotency.stored_response(key)
+        if replay:
+            return jsonify(replay[0]), replay[1]
+
     tier = SubscriptionTier.query.get_or_404(tier_id)
 
     # Get current time for subscription start and old subscription termination
     current_time = datetime.now(timezone.utc)
 
-    # Mark all existing active subscriptions for this user and tier type as expired
-    # and update their end_date to the current time (when they were terminated)
-    existing_subscriptions = Subscription.query.filter_by(user_id=user_id, status='active').all()
-    for sub in existing_subscriptions:
-        existing_tier = SubscriptionTier.query.get(sub.tier_id)
-        if existing_tier and existing_tier.tier_type == tier.tier_type:
-            sub.status = 'expired'
-            sub.end_date = current_time  # Set end_date to when it was actually terminated
+    # Expire the user's active subscriptions of this tier type in one UPDATE,
+    # setting end_date to when they were actually terminated
+    expire_active_of_type(user_id, tier.tier_type, current_time)
 
     # Calculate end date based on duration_days (using timezone-aware datetime)
     start_date = current_time
@@ -550,64 +869,88 @@ def create_subscription():
         status='active'
     )
     db.session.add(subscription)
+    db.session.flush()
+    subscription_id = subscription.id
+    rollups.record_subscription_started(tier.id)
 
     # Award loyalty points: 10 points per shilling spent
     # e.g., 10 KSH package = 100 points, 50 KSH = 500 points
     points_to_award = int(tier.price * 10)
-
-    loyalty = LoyaltyPoint.query.filter_by(user_id=user_id).first()
-    if not loyalty:
-        loyalty = LoyaltyPoint(user_id=user_id, points_earned=points_to_award, points_redeemed=0, balance=points_to_award)
-        db.session.add(loyalty)
+    loyalty.award_points(user_id, points_to_award, reference=f"subscription:{subscription_id}")
+
+    body = {"message": "Subscription created successfully", "subscription_id": subscription_id}
+    if key:
+        idempotency.remember(key, body, 201)
+        replay = idempotency.commit(key)
+        if replay:
+            return jsonify(replay[0]), replay[1]
     else:
-        loyalty.points_earned += points_to_award
-        loyalty.balance += points_to_award
-
-    db.session.commit()
-    return jsonify({"message": "Subscription created successfully"}), 201
+        db.session.commit()
+
+    expiry_scheduler.schedule(subscription_id, user_id, end_date)
+    return jsonify(body), 201
+
+SUBSCRIPTION_FIELDS = Projection({
+    "id": Subscription.id,
+    "tier_id": Subscription.tier_id,
+    "tier_name": SubscriptionTier.name,
+    "tier_type": SubscriptionTier.tier_type,
+    "price": SubscriptionTier.price,
+    "duration_days": SubscriptionTier.duration_days,
+    "speed_limit": SubscriptionTier.speed_limit,
+    "status": Subscription.status,
+    "start_date": Subscription.start_date,
+    "end_date": Subscription.end_date
+})
 
 @app.route('/subscriptions', methods=['GET'])
 def get_subscriptions():
-    """Get user subscriptions."""
+    """Get user subscriptions, newest first.
+
+    Optional query params: type ('hotspot' or 'home_internet'), limit,
+    cursor (from X-Next-Cursor), and current=1 to return only the active
+    subscription for each tier type.
+    """
     user_id = request.args.get('user_id')
     tier_type = request.args.get('type')  # Optional filter: 'hotspot' or 'home_internet'
 
-    subscriptions = Subscription.query.filter_by(user_id=user_id).order_by(Subscription.start_date.desc()).all()
-
-    # Auto-update expired subscriptions (using timezone-aware datetime)
-    now = datetime.now(timezone.utc)
-    for s in subscriptions:
-        if s.status == 'active' and s.end_date:
-            # Handle both timezone-aware and naive datetimes
-            end_date = s.end_date
-            if end_date.tzinfo is None:
-                # If naive, assume it's UTC and make it aware
-                end_date = end_date.replace(tzinfo=timezone.utc)
-            if end_date < now:
-                s.status = 'expired'
-    db.session.commit()
+    # One joined projection instead of a tier lookup per subscription
+    query = SUBSCRIPTION_FIELDS.query().select_from(Subscription) \
+     .outerjoin(SubscriptionTier, SubscriptionTier.id == Subscription.tier_id) \
+     .filter(Subscription.user_id == user_id)
 
-    result = []
-    for s in subscriptions:
-        tier = SubscriptionTier.query.get(s.tier_id)
-
-        # Filter by tier_type if specified
-        if tier_type and tier and tier.tier_type != tier_type:
-            continue
-
-        result.append({
-            "id": s.id,
-            "tier_id": s.tier_id,
-            "tier_name": tier.name if tier else None,
-            "tier_type": tier.tier_type if tier else None,
-            "price": float(tier.price) if tier else None,
-            "duration_days": tier.duration_days if tier else None,
-            "speed_limit": tier.speed_limit if tier else None,
-            "status": s.status,
-            "start_date": s.start_date.isoformat() if s.start_date else None,
-            "end_date": s.end_date.isoformat() if s.end_date else None
-        })
-    return jsonify(result), 200
+    if tier_type:
+        query = query.filter(SubscriptionTier.tier_type == tier_type)
+
+    serialize = SUBSCRIPTION_FIELDS.serialize
+
+    if request.args.get('current') in ('1', 'true'):
+        # Only a handful of active rows per user, served by the (user_id, status) index
+        rows = query.filter(Subscription.status == 'active') \
+            .order_by(Subscription.start_date.desc(), Subscription.id.desc()).all()
+        latest = {}
+        for row in rows:
+            latest.setdefault(row.tier_type, row)
+        return jsonify([serialize(r) for r in latest.values()]), 200
+
+    # Keyset pagination on (start_date, id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            start_date, subscription_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(
+            tuple_(Subscription.start_date, Subscription.id) < tuple_(start_date, subscription_id)
+        )
+    query = query.order_by(Subscription.start_date.desc(), Subscription.id.desc())
+
+    limit = parse_limit()
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    return page_response(query.all(), limit, serialize,
+                         lambda s: encode_cursor(s.start_date, s.id)), 200
 
 @app.route('/loyalty/redeem', methods=['POST'])
 def redeem_loyalty_points():
@@ -624,6 +967,12 @@ def redeem_loyalty_points():
     if not tier_id:
         return jsonify({"error": "Tier ID is required"}), 400
 
+    key = idempotency.request_key('loyalty-redeem', user_id)
+    if key:
+        replay = idempotency.stored_response(key)
+        if replay:
+            return jsonify(replay[0]), replay[1]
+
     # Get the tier
     tier = SubscriptionTier.query.get(tier_id)
     if not tier:
@@ -632,25 +981,23 @@ def redeem_loyalty_points():
     # Calculate points required: 70 points per shilling
     points_required = int(tier.price * 70)
 
-    # Check user's loyalty balance
-    loyalty = LoyaltyPoint.query.filter_by(user_id=user_id).first()
-    if not loyalty or loyalty.balance < points_required:
+    # Deduct points first with a conditional UPDATE so concurrent
+    # redemptions cannot spend the same balance twice
+    remaining_balance = loyalty.spend_points(user_id, points_required, reference=f"tier:{tier.id}")
+    if remaining_balance is None:
+        available = loyalty.current_balance(user_id)
+        db.session.rollback()
         return jsonify({
             "error": "Insufficient points",
             "required": points_required,
-            "available": loyalty.balance if loyalty else 0
+            "available": available
         }), 400
 
     # Get current time for subscription
     current_time = datetime.now(timezone.utc)
 
-    # Mark all existing active subscriptions for this user and tier type as expired
-    existing_subscriptions = Subscription.query.filter_by(user_id=user_id, status='active').all()
-    for sub in existing_subscriptions:
-        existing_tier = SubscriptionTier.query.get(sub.tier_id)
-        if existing_tier and existing_tier.tier_type == tier.tier_type:
-            sub.status = 'expired'
-            sub.end_date = current_time
+    # Expire the user's active subscriptions of this tier type in one UPDATE
+    expire_active_of_type(user_id, tier.tier_type, current_time)
 
     # Create the subscription
     start_date = current_time
@@ -664,13 +1011,9 @@ def redeem_loyalty_points():
         status='active'
     )
     db.session.add(subscription)
-
-    # Deduct points
-    loyalty.points_redeemed += points_required
-    loyalty.balance -= points_required
+    rollups.record_subscription_started(tier.id)
 
     # Create redemption record
-    from models import Redemption
     redemption = Redemption(
         user_id=user_id,
         points_used=points_required,
@@ -678,52 +1021,139 @@ def redeem_loyalty_points():
         details=f"Redeemed {tier.name} subscription for {points_required} points"
     )
     db.session.add(redemption)
+    db.session.flush()
+    subscription_id = subscription.id
 
-    db.session.commit()
-    return jsonify({
+    body = {
         "message": "Subscription redeemed successfully!",
         "points_used": points_required,
-        "remaining_balance": loyalty.balance
-    }), 200
+        "remaining_balance": remaining_balance
+    }
+    if key:
+        idempotency.remember(key, body, 200)
+        replay = idempotency.commit(key)
+        if replay:
+            return jsonify(replay[0]), replay[1]
+    else:
+        db.session.commit()
+
+    expiry_scheduler.schedule(subscription_id, user_id, end_date)
+    return jsonify(body), 200
 
 @app.route('/communications/send', methods=['POST'])
+@admin_required
 def send_communication():
     """Send mass communication (admin only)."""
     data = request.get_json()
-    admin_id = data.get('admin_id')
-    admin = User.query.get(admin_id)
-
-    if not admin or admin.role != 'admin':
-        return jsonify({"error": "Admins only"}), 403
-
     message = data.get('message')
     channel = data.get('channel')  # email, sms, or both
     recipients = data.get('recipients')  # all, active, or specific
     specific_users = data.get('specificUsers', [])
 
-    # Determine which users to send to
-    if recipients == 'all':
-        users = User.query.filter(User.role != 'admin').all()  # Exclude admins
-    elif recipients == 'active':
-        users = User.query.filter_by(status='active').filter(User.role != 'admin').all()  # Exclude admins
-    elif recipients == 'specific':
-        users = User.query.filter(User.id.in_(specific_users)).filter(User.role != 'admin').all()  # Exclude admins
-    else:
+    if recipient_filter(recipients, specific_users) is None:
         return jsonify({"error": "Invalid recipients"}), 400
 
-    # Create notifications for each user
-    for user in users:
-        notification = Notification(
-            user_id=user.id,
-            message=message,
-            channel=channel,
-            type='promo',
-            status='unread'  # Changed from 'sent' to 'unread' to trigger bell notification
-        )
-        db.session.add(notification)
-
+    # Notifications are inserted in chunks by a background job
+    job = CommunicationJob(
+        admin_id=current_user_id(),
+        message=message,
+        channel=channel,
+        recipients=recipients,
+        specific_users=json.dumps(specific_users) if recipients == 'specific' else None,
+        status='queued'
+    )
+    db.session.add(job)
     db.session.commit()
-    return jsonify({"message": f"Message sent to {len(users)} users"}), 200
+    fanout.submit(job.id)
+
+    return jsonify({"message": "Message queued for delivery", "job_id": job.id}), 202
+
+@app.route('/communications/jobs/<int:job_id>', methods=['GET'])
+@admin_required
+def get_communication_job(job_id):
+    """Progress of a mass communication job (admin only)."""
+    job = CommunicationJob.query.get_or_404(job_id)
+    return jsonify({
+        "id": job.id,
+        "status": job.status,
+        "recipients": job.recipients,
+        "total_recipients": job.total_recipients,
+        "sent_count": job.sent_count,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }), 200
+
+@app.route('/usage/batch', methods=['POST'])
+@usage_ingest.ingest_auth
+def ingest_usage():
+    """Bulk ingest of router session records into usage_patterns.
+
+    Body: NDJSON (default) or CSV with a header row, one record per line
+    with user_id, data_used_mb, session_duration, most_used_hours,
+    location and timestamp. Pick the format with ?format= or the
+    Content-Type. Invalid rows are skipped and reported per batch.
+    """
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "Invalid format. Use 'csv' or 'ndjson'"}), 400
+
+    report = usage_ingest.ingest(fmt)
+    return jsonify({
+        "received": sum(b['received'] for b in report),
+        "inserted": sum(b['inserted'] for b in report),
+        "rejected": sum(b['rejected'] for b in report),
+        "batches": report
+    }), 200
+
+@app.route('/payments/mpesa/callback', methods=['POST'])
+def mpesa_callback():
+    """M-Pesa C2B confirmation callback.
+
+    Stores the callback and acknowledges immediately; the payment worker
+    records the payment and activates the subscription in the background.
+    """
+    token = app.config['MPESA_CALLBACK_TOKEN']
+    if not token:
+        # Without a token anyone could post a confirmation; fail closed
+        app.logger.error('MPESA_CALLBACK_TOKEN is not set; rejecting M-Pesa callback')
+        return jsonify({"ResultCode": 1, "ResultDesc": "Rejected"}), 403
+    if not hmac.compare_digest(request.args.get('token', ''), token):
+        return jsonify({"ResultCode": 1, "ResultDesc": "Rejected"}), 403
+
+    data = request.get_json(silent=True) or {}
+    reference = str(data.get('TransID') or '').strip()
+    if not reference:
+        return jsonify({"ResultCode": 1, "ResultDesc": "Rejected: missing TransID"}), 400
+
+    if payments.enqueue(reference, request.get_data(as_text=True)):
+        payment_worker.wake()
+    return jsonify({"ResultCode": 0, "ResultDesc": "Accepted"}), 200
+
+@app.route('/exports/<dataset>', methods=['GET'])
+@admin_required
+@statement_timeout(120000)  # the first fetch of a full-table export can take a while
+def export_dataset(dataset):
+    """Stream a full dataset export (admin only).
+
+    dataset: users, loyalty, feedback or subscriptions.
+    Optional query params: format ('csv' or 'ndjson', default csv),
+    gzip=1 to compress the download.
+    """
+    if dataset not in exports.DATASETS:
+        return jsonify({"error": f"Unknown dataset. Choose from: {', '.join(exports.DATASETS)}"}), 404
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return jsonify({"error": "Invalid format. Use 'csv' or 'ndjson'"}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    response = Response(
+        stream_with_context(exports.stream(dataset, fmt, compress)),
+        mimetype='application/gzip' if compress else exports.FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{exports.filename(dataset, fmt, compress)}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 if __name__ == '__main__':
     with app.app_context():
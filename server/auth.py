@@ -0,0 +1,90 @@
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import jsonify
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt, get_jwt_identity, verify_jwt_in_request
+
+from db_helpers import to_naive_utc, utc_naive_now
+from models import db, RevokedToken
+
+jwt = JWTManager()
+revoked_tokens = RevokedToken.__table__
+
+
+class Denylist:
+    """TTL cache of revoked token ids.
+
+    The full set of unexpired revoked jtis is reloaded at most once every
+    JWT_DENYLIST_TTL_SECONDS, so checking a token is a set lookup rather
+    than a query. A token revoked through another worker stops working
+    within one TTL.
+    """
+
+    def __init__(self):
+        self._jtis = frozenset()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.ttl = 30
+
+    def _refresh(self):
+        now = utc_naive_now()
+        rows = db.session.execute(
+            revoked_tokens.select().with_only_columns(revoked_tokens.c.jti)
+            .where(revoked_tokens.c.expires_at > now)
+        ).scalars().all()
+        with self._lock:
+            self._jtis = frozenset(rows)
+            self._loaded_at = time.monotonic()
+
+    def contains(self, jti):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+            self._refresh()
+        return jti in self._jtis
+
+    def revoke(self, jti, expires_at):
+        now = utc_naive_now()
+        # Expired tokens are rejected by their signature check anyway
+        db.session.execute(revoked_tokens.delete().where(revoked_tokens.c.expires_at <= now))
+        db.session.execute(revoked_tokens.insert().values(jti=jti, expires_at=expires_at, created_at=now))
+        db.session.commit()
+        with self._lock:
+            self._jtis = self._jtis | {jti}
+
+
+denylist = Denylist()
+
+
+def init_app(app):
+    jwt.init_app(app)
+    denylist.ttl = app.config['JWT_DENYLIST_TTL_SECONDS']
+
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return denylist.contains(jwt_payload['jti'])
+
+
+def issue_token(user):
+    """Signed access token carrying the user's role, so admin checks need no DB lookup."""
+    return create_access_token(identity=str(user.id), additional_claims={'role': user.role})
+
+
+def current_user_id():
+    return int(get_jwt_identity())
+
+
+def revoke_current_token():
+    claims = get_jwt()
+    denylist.revoke(claims['jti'], to_naive_utc(datetime.fromtimestamp(claims['exp'], timezone.utc)))
+
+
+def admin_required(fn):
+    """Allow the request only with a valid token whose role claim is 'admin'."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        verify_jwt_in_request()
+        if get_jwt().get('role') != 'admin':
+            return jsonify({"error": "Admins only"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
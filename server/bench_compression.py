@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Bytes on the wire and CPU per request for the large GET endpoints.
+
+Seeds --rows feedbacks, users and subscriptions, then requests each
+endpoint --requests times in three ways:
+
+    identity     no Accept-Encoding: plain JSON
+    gzip         Accept-Encoding: gzip, at GZIP_LEVEL
+    revalidate   If-None-Match with the ETag from the first response (304)
+
+and reports response bytes and CPU time per request (process time, so the
+figures hold for a worker that is busy with nothing else). A second table
+shows what each gzip level would cost on the same bodies, to help pick
+GZIP_LEVEL.
+
+Uses a throwaway SQLite database unless --database-url is given:
+
+    python bench_compression.py --rows 2000 --requests 50
+"""
+import argparse
+import gzip
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from script_support import script_env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--database-url', help='Run against this database instead of a temporary SQLite file')
+    return parser.parse_args()
+
+
+def seed(db, rows):
+    from models import User, SubscriptionTier, Subscription, Feedback
+
+    tiers = [SubscriptionTier(name=f'Bench {p} KSH', price=p, duration_days=24, tier_type=t, speed_limit='10 Mbps')
+             for p, t in [(10, 'hotspot'), (50, 'hotspot'), (1500, 'home_internet')]]
+    owner = User(name='bench owner', email=f'bench-{time.time_ns()}@example.com', phone_number='0700000000',
+                 role='admin', status='active')
+    db.session.add_all(tiers + [owner])
+    db.session.commit()
+
+    start = datetime(2026, 1, 1)
+    db.session.execute(User.__table__.insert(), [
+        dict(name=f'Customer {i}', email=f'customer-{i}-{owner.id}@example.com', phone_number=f'07{i:08d}',
+             role='user', status='active', created_at=start + timedelta(minutes=i))
+        for i in range(rows)
+    ])
+    db.session.execute(Subscription.__table__.insert(), [
+        dict(user_id=owner.id, tier_id=random.choice(tiers).id, status='expired',
+             start_date=start + timedelta(hours=i), end_date=start + timedelta(hours=i + 24))
+        for i in range(rows)
+    ])
+    db.session.execute(Feedback.__table__.insert(), [
+        dict(user_id=owner.id, type=random.choice(['complaint', 'suggestion']), subscription_type='hotspot',
+             subject=f'Connection drops in the evening ({i})', rating=random.randint(1, 5),
+             comment='Speed falls off after 8pm and pages time out until midnight.', status='open',
+             created_at=start + timedelta(minutes=i), updated_at=start + timedelta(minutes=i))
+        for i in range(rows)
+    ])
+    db.session.commit()
+    return owner.id
+
+
+def main():
+    args = parse_args()
+    script_env('bench_compression.db', args.database_url)
+
+    from app import app
+    from models import db
+
+    with app.app_context():
+        owner_id = seed(db, args.rows)
+    print(f"seeded {args.rows:,} feedbacks, users and subscriptions; GZIP_LEVEL={app.config['GZIP_LEVEL']}, "
+          f"GZIP_MIN_BYTES={app.config['GZIP_MIN_BYTES']}")
+
+    client = app.test_client()
+    endpoints = [f'/feedbacks?user_id={owner_id}', '/users', f'/subscriptions?user_id={owner_id}']
+    failures = []
+    bodies = {}
+
+    print(f"\n{'endpoint':<28}{'mode':<12}{'status':>7}{'bytes':>10}{'cpu ms/req':>12}")
+    for path in endpoints:
+        plain = client.get(path)
+        bodies[path] = plain.get_data()
+        etag = plain.headers.get('ETag')
+        modes = [
+            ('identity', {}, 200),
+            ('gzip', {'Accept-Encoding': 'gzip'}, 200),
+            ('revalidate', {'If-None-Match': etag, 'Accept-Encoding': 'gzip'}, 304),
+        ]
+        for mode, headers, expect in modes:
+            began = time.process_time()
+            for _ in range(args.requests):
+                response = client.get(path, headers=headers)
+            cpu = (time.process_time() - began) / args.requests
+            size = len(response.get_data())
+            print(f"{path.split('?')[0]:<28}{mode:<12}{response.status_code:>7}{size:>10,}{cpu * 1000:>12.2f}")
+            if response.status_code != expect:
+                failures.append(f"{path} {mode}: status {response.status_code}, expected {expect}")
+            if mode == 'gzip' and app.config['GZIP_LEVEL'] and gzip.decompress(response.get_data()) != bodies[path]:
+                failures.append(f"{path}: gzipped body does not match the plain body")
+
+    print(f"\n{'endpoint':<28}{'level':>6}{'bytes':>10}{'ratio':>8}{'cpu ms':>9}")
+    for path, body in bodies.items():
+        for level in (1, 3, 6, 9):
+            began = time.process_time()
+            for _ in range(args.requests):
+                compressed = gzip.compress(body, compresslevel=level, mtime=0)
+            cpu = (time.process_time() - began) / args.requests
+            print(f"{path.split('?')[0]:<28}{level:>6}{len(compressed):>10,}"
+                  f"{len(body) / len(compressed):>7.1f}x{cpu * 1000:>9.2f}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""Latency and throughput of every API endpoint under concurrent load.
+
+Each scenario sends --requests requests to one route from --concurrency
+threads and reports p50/p95/p99 latency, throughput and status codes.
+Every route in app.py must have a scenario or a reason in SKIPPED; a new
+route without either fails the run before anything is sent.
+
+Two ways to run it:
+
+    in-process   seeds a throwaway SQLite database with seed_data.py (or
+                 the one at --database-url) and drives the app through the
+                 Flask test client. No network, so the figures are the
+                 app's own cost; good for comparing code changes.
+    --url        drives a running server (e.g. local gunicorn) over HTTP,
+                 using the ids and credentials in a seed_data.py manifest.
+
+    python bench_endpoints.py --users 1000 --out before.json
+    python seed_data.py --users 5000 --manifest seed.json
+    gunicorn app:app --worker-class gthread --threads 8 --workers 2
+    python bench_endpoints.py --url http://127.0.0.1:8000 --manifest seed.json --concurrency 16
+
+Results are saved as JSON with --out. --compare prints the change against
+an earlier results file and exits 1 when an endpoint's p95 rose, or its
+throughput fell, by more than --threshold percent. --load compares two
+saved files without running anything:
+
+    python bench_endpoints.py --load after.json --compare before.json
+
+Setup work a request needs (tokens, a tier to delete) happens before the
+timed requests start. Write endpoints leave their rows behind.
+"""
+import argparse
+import gzip
+import http.client
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from urllib.parse import urlsplit
+
+from script_support import script_env
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (method, rule) -> why it isn't benchmarked
+SKIPPED = {
+    ('GET', '/notifications/stream'): 'Server-Sent Events; each response stays open for NOTIFICATION_STREAM_TIMEOUT',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per scenario first')
+    parser.add_argument('--only', help='Only scenarios whose name matches this regex')
+    parser.add_argument('--identity', action='store_true', help="Don't send Accept-Encoding: gzip")
+    parser.add_argument('--url', help='Benchmark a running server instead of the app in-process')
+    parser.add_argument('--manifest', help='seed_data.py manifest; required with --url')
+    parser.add_argument('--mpesa-token', help='MPESA_CALLBACK_TOKEN of the server at --url')
+    parser.add_argument('--database-url', help='In-process: use this database instead of a temporary SQLite file')
+    parser.add_argument('--users', type=int, default=1000, help='In-process: users to seed')
+    parser.add_argument('--out', help='Save results as JSON here')
+    parser.add_argument('--compare', help='Compare with this earlier results file')
+    parser.add_argument('--load', help="Compare this results file instead of running")
+    parser.add_argument('--threshold', type=float, default=20, help='Regression threshold, percent')
+    return parser.parse_args()
+
+
+def app_routes():
+    """(method, rule) for every @app.route in app.py."""
+    with open(os.path.join(HERE, 'app.py')) as f:
+        source = f.read()
+    routes = set()
+    for rule, methods in re.findall(r"@app\.route\('([^']+)'(?:,\s*methods=\[([^\]]*)\])?", source):
+        for method in re.findall(r"'(\w+)'", methods) or ['GET']:
+            routes.add((method, rule))
+    return routes
+
+
+def percentile(ordered, p):
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class InProcess:
+    """Sends requests through the Flask test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, headers=headers or {})
+        try:
+            return response.status_code, response.headers, response.get_data()
+        finally:
+            response.close()
+
+
+class Remote:
+    """Sends requests over keep-alive HTTP connections, one per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in (1, 2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = self.connection_class(self.netloc, timeout=60)
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; reconnect once
+                conn.close()
+                self.local.conn = None
+                if attempt == 2:
+                    raise
+
+
+class Context:
+    """What scenarios need: untimed calls, tokens and the seeded ids."""
+
+    def __init__(self, target, manifest, accept_gzip, mint_token=None, mpesa_token=None):
+        self.target = target
+        self.manifest = manifest
+        self.accept_gzip = accept_gzip
+        self.mint_token = mint_token
+        self.mpesa_token = mpesa_token
+        self.rng = random.Random(manifest['seed'])
+        self.admin_id = manifest['admin']['id']
+        self.user_ids = manifest['user_ids']
+        self.admin = self.auth(self.admin_id)
+
+    def call(self, method, path, json_body=None, headers=None):
+        """Untimed request; returns (status, parsed JSON or None)."""
+        body, headers = encode(json_body, headers)
+        status, response_headers, data = self.target.request(method, path, body, headers)
+        if response_headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+    def token(self, user_id):
+        if self.mint_token:
+            return self.mint_token(user_id, 'admin' if user_id == self.admin_id else 'user')
+        if user_id == self.admin_id:
+            email = self.manifest['admin']['email']
+        else:
+            email = self.manifest['user_email'].format(i=self.user_ids.index(user_id))
+        status, body = self.call('POST', '/login', {'identifier': email, 'password': self.manifest['password']})
+        if status != 200:
+            raise SystemExit(f"FAIL logging in as {email}: {status} {body}")
+        return body['access_token']
+
+    def auth(self, user_id):
+        return {'Authorization': f'Bearer {self.token(user_id)}'}
+
+    def user(self):
+        return self.rng.choice(self.user_ids)
+
+    def pick(self, key):
+        return self.rng.choice(self.manifest[key])
+
+
+def encode(json_body, headers):
+    headers = dict(headers or {})
+    if json_body is None:
+        return None, headers
+    headers.setdefault('Content-Type', 'application/json')
+    return json.dumps(json_body).encode(), headers
+
+
+def scenarios(ctx):
+    """[(name, method, rule, build, max requests)]; build(i) returns the
+    request as a dict with path and optionally json, body and headers."""
+    admin = ctx.admin
+    tiers = ctx.manifest['tier_ids']
+    run = ctx.manifest['run']
+    datasets = ['users', 'loyalty', 'feedback', 'subscriptions']
+
+    # Users rich enough to redeem the cheapest tier more than once
+    status, leaders = ctx.call('GET', '/loyalty/all?sort=balance&limit=200', headers=admin)
+    redeemers = [row['user_id'] for row in leaders or [] if row['balance'] >= 1400] or ctx.user_ids
+
+    def tier_to_delete(i):
+        name = f'bench delete {run} {i} {time.time_ns()}'
+        ctx.call('POST', '/tiers', {'name': name, 'price': 1, 'duration_days': 1, 'tier_type': 'hotspot'},
+                 headers=admin)
+        status, listed = ctx.call('GET', '/tiers?type=hotspot')
+        return next(tier['id'] for tier in listed if tier['name'] == name)
+
+    def communication_job():
+        status, body = ctx.call('POST', '/communications/send', {
+            'message': 'Benchmark job', 'channel': 'notification', 'recipients': 'specific',
+            'specificUsers': ctx.user_ids[:5]
+        }, headers=admin)
+        return body['job_id']
+
+    job_id = communication_job()
+
+    def usage_batch(i):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        records = [
+            {'user_id': ctx.user(), 'data_used_mb': round(ctx.rng.uniform(1, 500), 2),
+             'session_duration': ctx.rng.randint(30, 7200), 'most_used_hours': '20-21', 'location': 'Westlands',
+             'timestamp': now.isoformat()}
+            for _ in range(200)
+        ]
+        return '\n'.join(json.dumps(record) for record in records).encode()
+
+    callback = f'?token={ctx.mpesa_token}' if ctx.mpesa_token else ''
+
+    return [
+        ('GET /', 'GET', '/', lambda i: {'path': '/'}, None),
+        ('POST /register', 'POST', '/register', lambda i: {'path': '/register', 'json': {
+            'email': f'bench-{run}-{i}-{time.time_ns()}@example.com', 'password': 'bench-pass-1', 'name': 'Bench'}},
+         None),
+        ('POST /login', 'POST', '/login', lambda i: {'path': '/login', 'json': {
+            'identifier': ctx.manifest['user_email'].format(i=ctx.rng.randrange(len(ctx.user_ids))),
+            'password': ctx.manifest['password']}}, None),
+        ('POST /logout', 'POST', '/logout', lambda i: {'path': '/logout', 'headers': ctx.auth(ctx.user())}, 20),
+        ('GET /auth/hashing-stats', 'GET', '/auth/hashing-stats',
+         lambda i: {'path': '/auth/hashing-stats', 'headers': admin}, None),
+        ('GET /metrics', 'GET', '/metrics', lambda i: {'path': '/metrics'}, None),
+        ('GET /db/pool-stats', 'GET', '/db/pool-stats', lambda i: {'path': '/db/pool-stats', 'headers': admin}, None),
+        ('GET /tiers', 'GET', '/tiers', lambda i: {'path': '/tiers'}, None),
+        ('GET /tiers?type', 'GET', '/tiers', lambda i: {'path': '/tiers?type=hotspot'}, None),
+        ('POST /tiers', 'POST', '/tiers', lambda i: {'path': '/tiers', 'headers': admin, 'json': {
+            'name': f'bench {run} {i}', 'price': 20, 'duration_days': 2, 'tier_type': 'hotspot'}}, None),
+        ('PATCH /tiers/<id>', 'PATCH', '/tiers/<int:id>', lambda i: {
+            'path': f'/tiers/{ctx.rng.choice(tiers)}', 'headers': admin, 'json': {'description': f'Edited {i}'}},
+         None),
+        ('DELETE /tiers/<id>', 'DELETE', '/tiers/<int:id>', lambda i: {
+            'path': f'/tiers/{tier_to_delete(i)}', 'headers': admin}, 50),
+        ('GET /feedbacks (admin)', 'GET', '/feedbacks', lambda i: {'path': f'/feedbacks?user_id={ctx.admin_id}'},
+         None),
+        ('GET /feedbacks (user)', 'GET', '/feedbacks', lambda i: {'path': f'/feedbacks?user_id={ctx.user()}'}, None),
+        ('POST /feedbacks', 'POST', '/feedbacks', lambda i: {'path': '/feedbacks', 'json': {
+            'user_id': ctx.user(), 'type': 'feedback', 'subscription_type': 'hotspot', 'subject': f'Bench {i}',
+            'rating': 4, 'comment': 'Fine most days.'}}, None),
+        ('GET /complaints (admin)', 'GET', '/complaints',
+         lambda i: {'path': f'/complaints?user_id={ctx.admin_id}'}, None),
+        ('GET /complaints (user)', 'GET', '/complaints', lambda i: {'path': f'/complaints?user_id={ctx.user()}'},
+         None),
+        ('POST /complaints', 'POST', '/complaints', lambda i: {'path': '/complaints', 'json': {
+            'user_id': ctx.user(), 'subject': f'Bench {i}', 'description': 'Slow in the evening.'}}, None),
+        ('PATCH /complaints/<id>/reply', 'PATCH', '/complaints/<int:id>/reply', lambda i: {
+            'path': f"/complaints/{ctx.pick('complaint_ids')}/reply", 'headers': admin,
+            'json': {'admin_response': 'Looking into it.', 'status': 'in_progress'}}, None),
+        ('PATCH /feedbacks/<id>/reply', 'PATCH', '/feedbacks/<int:feedback_id>/reply', lambda i: {
+            'path': f"/feedbacks/{ctx.pick('feedback_ids')}/reply", 'headers': admin,
+            'json': {'admin_response': 'Thanks!', 'status': 'resolved'}}, None),
+        ('GET /loyalty', 'GET', '/loyalty', lambda i: {'path': f'/loyalty?user_id={ctx.user()}'}, None),
+        ('GET /loyalty/all?sort=balance', 'GET', '/loyalty/all',
+         lambda i: {'path': '/loyalty/all?limit=100&sort=balance'}, None),
+        ('POST /loyalty/redeem', 'POST', '/loyalty/redeem', lambda i: {'path': '/loyalty/redeem', 'json': {
+            'user_id': ctx.rng.choice(redeemers), 'tier_id': tiers[0]}}, None),
+        ('GET /notifications', 'GET', '/notifications',
+         lambda i: {'path': f'/notifications?user_id={ctx.user()}&limit=50'}, None),
+        ('PATCH /notifications/<id>/read', 'PATCH', '/notifications/<int:notification_id>/read',
+         lambda i: {'path': f"/notifications/{ctx.pick('notification_ids')}/read"}, None),
+        ('PATCH /notifications/mark-all-read', 'PATCH', '/notifications/mark-all-read',
+         lambda i: {'path': f'/notifications/mark-all-read?user_id={ctx.user()}'}, None),
+        ('GET /notifications/unread-count', 'GET', '/notifications/unread-count',
+         lambda i: {'path': f'/notifications/unread-count?user_id={ctx.user()}'}, None),
+        ('GET /users', 'GET', '/users', lambda i: {'path': '/users?limit=100'}, None),
+        ('GET /users/<id>', 'GET', '/users/<int:user_id>', lambda i: {'path': f'/users/{ctx.user()}'}, None),
+        ('POST /users/<id>/disconnect', 'POST', '/users/<int:user_id>/disconnect',
+         lambda i: {'path': f'/users/{ctx.user()}/disconnect', 'headers': admin}, None),
+        ('GET /analytics/tier-subscriptions', 'GET', '/analytics/tier-subscriptions',
+         lambda i: {'path': '/analytics/tier-subscriptions?type=hotspot'}, None),
+        ('GET /analytics/usage', 'GET', '/analytics/usage',
+         lambda i: {'path': '/analytics/usage?granularity=day', 'headers': admin}, None),
+        ('GET /analytics/revenue', 'GET', '/analytics/revenue',
+         lambda i: {'path': '/analytics/revenue?granularity=day', 'headers': admin}, None),
+        ('POST /subscriptions', 'POST', '/subscriptions', lambda i: {'path': '/subscriptions', 'json': {
+            'user_id': ctx.user(), 'tier_id': ctx.rng.choice(tiers)}}, None),
+        ('GET /subscriptions', 'GET', '/subscriptions',
+         lambda i: {'path': f'/subscriptions?user_id={ctx.user()}'}, None),
+        ('POST /communications/send', 'POST', '/communications/send', lambda i: {
+            'path': '/communications/send', 'headers': admin, 'json': {
+                'message': f'Benchmark {i}', 'channel': 'notification', 'recipients': 'specific',
+                'specificUsers': ctx.rng.sample(ctx.user_ids, min(5, len(ctx.user_ids)))}}, None),
+        ('GET /communications/jobs/<id>', 'GET', '/communications/jobs/<int:job_id>',
+         lambda i: {'path': f'/communications/jobs/{job_id}', 'headers': admin}, None),
+        ('POST /usage/batch (200 records)', 'POST', '/usage/batch', lambda i: {
+            'path': '/usage/batch', 'body': usage_batch(i),
+            'headers': dict(admin, **{'Content-Type': 'application/x-ndjson'})}, None),
+        ('POST /payments/mpesa/callback', 'POST', '/payments/mpesa/callback', lambda i: {
+            'path': f'/payments/mpesa/callback{callback}', 'json': {
+                'TransID': f'BENCH{run}{i}{time.time_ns() % 10 ** 6}', 'TransAmount': '50',
+                'MSISDN': '254700000000', 'BillRefNumber': str(ctx.user())}}, None),
+        ('GET /exports/<dataset>', 'GET', '/exports/<dataset>', lambda i: {
+            'path': f'/exports/{datasets[i % len(datasets)]}', 'headers': admin}, 8),
+    ]
+
+
+def check_coverage(defined):
+    covered = {(method, rule) for _, method, rule, _, _ in defined}
+    missing = sorted(app_routes() - covered - set(SKIPPED))
+    for method, rule in missing:
+        print(f"FAIL no scenario for {method} {rule}; add one, or a reason to SKIPPED")
+    if missing:
+        sys.exit(1)
+
+
+def prepare(build, method, count, accept_gzip):
+    """Build count requests up front, so setup work isn't timed."""
+    requests = []
+    for i in range(count):
+        spec = build(i)
+        body, headers = encode(spec.get('json'), spec.get('headers'))
+        if spec.get('body') is not None:
+            body = spec['body']
+        if accept_gzip:
+            headers.setdefault('Accept-Encoding', 'gzip')
+        requests.append((method, spec['path'], body, headers))
+    return requests
+
+
+def timed_send(target, request):
+    """(seconds, status); status is the exception name if the request failed."""
+    began = time.perf_counter()
+    try:
+        status = target.request(*request)[0]
+    except Exception as e:
+        status = type(e).__name__
+    return time.perf_counter() - began, status
+
+
+def summarize(timings, wall):
+    latencies = sorted(seconds * 1000 for seconds, _ in timings)
+    statuses = {}
+    for _, status in timings:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(timings),
+        'statuses': statuses,
+        'ok': sum(n for status, n in statuses.items() if status.isdigit() and int(status) < 400),
+        'client_errors': sum(n for status, n in statuses.items() if status.isdigit() and 400 <= int(status) < 500),
+        'server_errors': sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'max_ms': round(latencies[-1], 2),
+        'throughput_rps': round(len(timings) / wall, 1) if wall else None,
+        'wall_seconds': round(wall, 3),
+    }
+
+
+def benchmark(args, ctx, meta):
+    defined = scenarios(ctx)
+    check_coverage(defined)
+    if args.only:
+        defined = [scenario for scenario in defined if re.search(args.only, scenario[0])]
+
+    results = {'meta': meta, 'endpoints': {}, 'skipped': {f'{m} {r}': why for (m, r), why in SKIPPED.items()}}
+    print(f"\n{'endpoint':<40}{'n':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}  statuses")
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for name, method, rule, build, limit in defined:
+            count = min(args.requests, limit) if limit else args.requests
+            requests = prepare(build, method, min(args.warmup, count) + count, ctx.accept_gzip)
+            send = partial(timed_send, ctx.target)
+            list(pool.map(send, requests[:-count]))
+            began = time.perf_counter()
+            timings = list(pool.map(send, requests[-count:]))
+            summary = summarize(timings, time.perf_counter() - began)
+            results['endpoints'][name] = summary
+            statuses = ' '.join(f'{status}x{n}' for status, n in sorted(summary['statuses'].items()))
+            print(f"{name:<40}{summary['requests']:>6}{summary['p50_ms']:>9.1f}{summary['p95_ms']:>9.1f}"
+                  f"{summary['p99_ms']:>9.1f}{summary['throughput_rps']:>9.1f}  {statuses}")
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Print per-endpoint changes; returns the names that regressed."""
+    def change(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    regressed = []
+    print(f"\nvs {baseline['meta'].get('git_commit') or '?'} ({baseline['meta'].get('started_at', '?')}), "
+          f"threshold {threshold:g}%")
+    print(f"{'endpoint':<40}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}")
+    for name, new in current['endpoints'].items():
+        old = baseline['endpoints'].get(name)
+        if old is None:
+            print(f"{name:<40}  new")
+            continue
+        deltas = [change(new[key], old[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        rps = change(new['throughput_rps'] or 0, old['throughput_rps'] or 0)
+        flag = ''
+        if deltas[1] > threshold or rps < -threshold:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<40}" + ''.join(f"{delta:>+8.0f}%" for delta in deltas + [rps]) + flag)
+    missing = baseline['endpoints'].keys() - current['endpoints'].keys()
+    if missing:
+        print(f"{len(missing)} endpoints in the baseline weren't run")
+    return regressed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_in_process(args):
+    script_env('bench_endpoints.db', args.database_url)
+    os.environ.setdefault('MPESA_CALLBACK_TOKEN', 'bench-callback-token')
+
+    from types import SimpleNamespace
+    from app import app
+    from auth import issue_token
+    from models import db
+    import seed_data
+
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    else:
+        print(f"seeding {args.users:,} users")
+        with app.app_context():
+            manifest = seed_data.seed(users=args.users, log=print)
+
+    def mint_token(user_id, role):
+        with app.app_context():
+            return issue_token(SimpleNamespace(id=user_id, role=role))
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    ctx = Context(InProcess(app), manifest, not args.identity, mint_token, app.config['MPESA_CALLBACK_TOKEN'])
+    return ctx, {'mode': 'in-process', 'database': dialect}
+
+
+def main():
+    args = parse_args()
+    if args.load:
+        with open(args.load) as f:
+            results = json.load(f)
+    else:
+        if args.url:
+            if not args.manifest:
+                print("FAIL --url needs --manifest from seed_data.py for the ids and credentials to use")
+                sys.exit(1)
+            with open(args.manifest) as f:
+                manifest = json.load(f)
+            ctx = Context(Remote(args.url), manifest, not args.identity, mpesa_token=args.mpesa_token)
+            mode = {'mode': 'http', 'url': args.url}
+        else:
+            ctx, mode = prepare_in_process(args)
+        meta = dict(mode, started_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    git_commit=git_commit(), concurrency=args.concurrency, requests=args.requests,
+                    gzip=not args.identity, seeded=ctx.manifest['counts'], python=sys.version.split()[0])
+        results = benchmark(args, ctx, meta)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults: {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.threshold)
+        for name in regressed:
+            print(f"FAIL {name} regressed by more than {args.threshold:g}%")
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for the list-endpoint serializers.
+
+Seeds --rows notifications and times three ways of turning them into a
+JSON body, as GET /notifications would:
+
+    orm         Notification.query.all(), a hand-built dict per object, json
+    projection  NOTIFICATION_FIELDS rows and serialize_all(), json
+    orjson      NOTIFICATION_FIELDS rows and serialize_all(), orjson
+
+Each variant is timed over --repeat runs (best run reported, per row) and
+then run once more under tracemalloc for its peak allocation. The bodies
+are compared byte for byte after decoding, so a faster variant can't win
+by returning something different.
+
+Uses a throwaway SQLite database unless --database-url is given:
+
+    python bench_serializers.py --rows 100000
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from script_support import script_env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database-url', help='Run against this database instead of a temporary SQLite file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    script_env('bench_serializers.db', args.database_url)
+
+    from app import app, NOTIFICATION_FIELDS
+    from models import db, User, Notification
+    import serializers
+
+    with app.app_context():
+        user = User(name='bench', email=f'bench-{time.time_ns()}@example.com', phone_number='0700000000',
+                    role='user', status='active')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        start = datetime(2026, 1, 1)
+        for offset in range(0, args.rows, 10000):
+            db.session.execute(Notification.__table__.insert(), [
+                dict(user_id=user_id, message=f'Your subscription {i} expires soon', channel='notification',
+                     type='expiry', status='unread' if i % 3 else 'read', created_at=start + timedelta(seconds=i))
+                for i in range(offset, min(offset + 10000, args.rows))
+            ])
+        db.session.commit()
+        print(f"seeded {args.rows:,} notifications")
+
+        def orm():
+            rows = Notification.query.filter_by(user_id=user_id).order_by(Notification.id).all()
+            return json.dumps([{
+                "id": n.id,
+                "message": n.message,
+                "channel": n.channel,
+                "type": n.type,
+                "status": n.status,
+                "created_at": n.created_at.isoformat() if n.created_at else None
+            } for n in rows])
+
+        def projected(dumps):
+            def run():
+                rows = NOTIFICATION_FIELDS.query().filter(Notification.user_id == user_id) \
+                    .order_by(Notification.id).all()
+                return dumps(NOTIFICATION_FIELDS.serialize_all(rows))
+            return run
+
+        variants = [('orm', orm), ('projection', projected(json.dumps))]
+        if serializers.orjson is not None:
+            variants.append(('orjson', projected(serializers.orjson.dumps)))
+        else:
+            print("orjson is not installed; skipping the orjson variant")
+
+        results = {}
+        for name, run in variants:
+            timings = []
+            for _ in range(args.repeat):
+                db.session.expunge_all()
+                gc.collect()
+                began = time.perf_counter()
+                body = run()
+                timings.append(time.perf_counter() - began)
+            db.session.expunge_all()
+            gc.collect()
+            tracemalloc.start()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = (min(timings), peak, json.loads(body))
+
+        baseline = results['orm']
+        failures = []
+        print(f"{'variant':<12}{'us/row':>10}{'total s':>10}{'peak MB':>10}{'bytes/row':>11}{'vs orm':>9}")
+        for name, (elapsed, peak, decoded) in results.items():
+            print(f"{name:<12}{elapsed / args.rows * 1e6:>10.2f}{elapsed:>10.2f}{peak / 1e6:>10.1f}"
+                  f"{peak / args.rows:>11.0f}{baseline[0] / elapsed:>8.2f}x")
+            if decoded != baseline[2]:
+                failures.append(f"{name} output differs from the ORM output")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Check connection pool limits, pool metrics and statement timeouts.
+
+Starts the app with a deliberately small pool (--pool-size, --max-overflow,
+--pool-timeout) and then:
+
+    saturates the pool from threads holding connections and checks that
+    /db/pool-stats reports the waits, full saturation and no timeouts
+    overruns it and checks the extra checkout times out, is counted, and
+    that a request arriving meanwhile gets a 503 with Retry-After
+    on Postgres: runs pg_sleep past DB_STATEMENT_TIMEOUT_MS in a request
+    (expects a 503), in a view with @statement_timeout(0) (expects 200),
+    and checks the timeout doesn't stick to the pooled connection
+
+Uses a throwaway SQLite database as a stand-in unless --database-url is
+given; SQLite has no statement timeout, so that part is skipped there.
+
+    python check_db_pool.py
+    python check_db_pool.py --database-url postgresql://localhost/mnet_check
+"""
+import argparse
+import sys
+import threading
+import time
+
+from script_support import script_env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--max-overflow', type=int, default=1)
+    parser.add_argument('--pool-timeout', type=int, default=1, help='Whole seconds')
+    parser.add_argument('--hold', type=float, default=0.4, help='Seconds each thread holds its connection')
+    parser.add_argument('--statement-timeout-ms', type=int, default=300)
+    parser.add_argument('--database-url', help='Run against this database instead of a temporary SQLite file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    script_env('check_db_pool.db', args.database_url,
+               DB_POOL_SIZE=args.pool_size, DB_MAX_OVERFLOW=args.max_overflow,
+               DB_POOL_TIMEOUT_SECONDS=args.pool_timeout,
+               DB_STATEMENT_TIMEOUT_MS=args.statement_timeout_ms, DB_PGBOUNCER='false')
+
+    from types import SimpleNamespace
+    from sqlalchemy import text
+    from sqlalchemy.exc import TimeoutError as PoolTimeout
+    from app import app
+    from models import db
+    from db_pool import MeteredQueuePool, statement_timeout
+    from auth import issue_token
+
+    sleep_seconds = args.statement_timeout_ms / 1000 * 3
+
+    def sleep():
+        db.session.execute(text('SELECT pg_sleep(:s)'), {'s': sleep_seconds})
+        return {'slept': sleep_seconds}
+
+    app.add_url_rule('/check/sleep', 'check_sleep', sleep)
+    app.add_url_rule('/check/sleep-unlimited', 'check_sleep_unlimited', statement_timeout(0)(sleep))
+
+    client = app.test_client()
+    capacity = args.pool_size + args.max_overflow
+    failures = []
+
+    with app.app_context():
+        engine = db.engine
+        pool = engine.pool
+        admin = {'Authorization': f"Bearer {issue_token(SimpleNamespace(id=0, role='admin'))}"}
+    if not isinstance(pool, MeteredQueuePool):
+        print(f"FAIL pool is {type(pool).__name__}, expected MeteredQueuePool")
+        sys.exit(1)
+    print(f"{engine.dialect.name}: pool size {pool.size()}, overflow {args.max_overflow}, "
+          f"timeout {args.pool_timeout}s, pre-ping {pool._pre_ping}, recycle {pool._recycle}s")
+
+    def hold(seconds, errors):
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql('SELECT 1')
+                time.sleep(seconds)
+        except PoolTimeout:
+            errors.append('timeout')
+
+    def run(threads, seconds):
+        errors = []
+        workers = [threading.Thread(target=hold, args=(seconds, errors)) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        return workers, errors
+
+    def stats():
+        return client.get('/db/pool-stats', headers=admin).get_json()
+
+    # 1. Twice the capacity, each held for less than the pool timeout: the
+    # second wave waits for the first but nobody times out
+    before = stats()
+    workers, errors = run(capacity * 2, args.hold)
+    for worker in workers:
+        worker.join()
+    after = stats()
+    waited = after['max_wait_ms']
+    print(f"saturate: {capacity * 2} holders, peak saturation {after['peak_saturation']:.2f}, "
+          f"max wait {waited:.0f} ms, avg wait {after['avg_wait_ms']:.1f} ms, timeouts {after['timeouts']}")
+    if after['peak_saturation'] < 1:
+        failures.append(f"peak saturation {after['peak_saturation']:.2f}, expected 1.0")
+    if waited < args.hold * 1000 * 0.5:
+        failures.append(f"max checkout wait {waited:.0f} ms; the second wave should have waited ~{args.hold * 1000:.0f} ms")
+    if errors or after['timeouts'] != before['timeouts']:
+        failures.append(f"{len(errors)} checkouts timed out while saturating within the pool timeout")
+    if after['checked_out'] != 0:
+        failures.append(f"{after['checked_out']} connections still checked out after all holders returned")
+
+    # 2. Capacity holders for longer than the timeout, then one more checkout
+    # and one request: both must give up after the pool timeout
+    workers, errors = run(capacity, args.pool_timeout * 3)
+    time.sleep(0.1)
+    overrun = []
+    hold(0, overrun)
+    response = client.get('/tiers')
+    for worker in workers:
+        worker.join()
+    after = stats()
+    print(f"overrun: extra checkout {'timed out' if overrun else 'succeeded'}, request got {response.status_code} "
+          f"(Retry-After {response.headers.get('Retry-After')}), timeouts {after['timeouts']}")
+    if not overrun:
+        failures.append('checkout beyond capacity did not time out')
+    if response.status_code != 503 or not response.headers.get('Retry-After'):
+        failures.append(f"request on an exhausted pool got {response.status_code}, expected 503 with Retry-After")
+    if after['timeouts'] < 2:
+        failures.append(f"{after['timeouts']} timeouts counted, expected at least 2")
+
+    # 3. Statement timeouts (Postgres only)
+    if engine.dialect.name != 'postgresql':
+        print("statement timeout: skipped, SQLite has none")
+    else:
+        limited = client.get('/check/sleep')
+        unlimited = client.get('/check/sleep-unlimited')
+        with app.app_context():
+            leftover = db.session.execute(text('SHOW statement_timeout')).scalar()
+        print(f"statement timeout: limited request {limited.status_code}, unlimited request {unlimited.status_code}, "
+              f"outside requests {leftover}")
+        if limited.status_code != 503:
+            failures.append(f"pg_sleep past the statement timeout returned {limited.status_code}, expected 503")
+        if unlimited.status_code != 200:
+            failures.append(f"@statement_timeout(0) view returned {unlimited.status_code}, expected 200")
+        if leftover != '0':
+            failures.append(f"statement_timeout is {leftover} outside a request; SET LOCAL leaked")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: pool limits, metrics and timeouts behave")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Check that purchase and redeem run a bounded number of SQL statements.
+
+Counts every statement sent to the database during POST /subscriptions and
+POST /loyalty/redeem, with and without an Idempotency-Key, and exits
+non-zero if any request goes over its budget. The count must not depend on
+how many subscriptions the user already has, so the user is given a pile
+of active ones first. Also checks that retrying with the same key replays
+the first response without creating a subscription or awarding points.
+
+Uses a throwaway SQLite database unless --database-url is given:
+
+    python check_query_counts.py
+"""
+import argparse
+import random
+import sys
+
+from script_support import script_env
+
+# Statements allowed per request, counted at the DBAPI cursor
+PURCHASE_BUDGET = 8
+REDEEM_BUDGET = 11
+REPLAY_BUDGET = 2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--existing', type=int, default=50, help='Active subscriptions to give the user first')
+    parser.add_argument('--database-url', help='Run against this database instead of a temporary SQLite file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    script_env('check_query_counts.db', args.database_url)
+
+    from sqlalchemy import event
+    from app import app
+    from models import db, User, SubscriptionTier, Subscription
+    import loyalty
+
+    with app.app_context():
+        tier = SubscriptionTier(name='Check 10 KSH', price=10, duration_days=1, tier_type='hotspot')
+        cheap = SubscriptionTier(name='Check 1 KSH', price=1, duration_days=1, tier_type='hotspot')
+        user = User(name='querycount', email=f'querycount-{random.random()}@example.com', role='user')
+        user.password_hash = 'x'  # never logs in
+        db.session.add_all([tier, cheap, user])
+        db.session.commit()
+        tier_id, cheap_id, user_id = tier.id, cheap.id, user.id
+        points_per_purchase = int(tier.price * 10)
+        # Bypass the endpoint so the user really has many active rows
+        db.session.add_all([
+            Subscription(user_id=user_id, tier_id=tier_id, status='active') for _ in range(args.existing)
+        ])
+        db.session.commit()
+        engine = db.engine
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    client = app.test_client()
+    failures = []
+
+    def measure(label, budget, path, payload, headers=None, expect=200):
+        statements.clear()
+        response = client.post(path, json=payload, headers=headers or {})
+        used = len(statements)
+        print(f"{label}: {used} statements (budget {budget}), status {response.status_code}")
+        if response.status_code != expect:
+            failures.append(f"{label}: expected status {expect}, got {response.status_code}")
+        if used > budget:
+            failures.append(f"{label}: {used} statements exceeds budget {budget}")
+            for statement in statements:
+                print('   ', ' '.join(statement.split())[:120])
+        return response
+
+    purchase = {'user_id': user_id, 'tier_id': tier_id}
+    measure('POST /subscriptions', PURCHASE_BUDGET, '/subscriptions', purchase, expect=201)
+    key = {'Idempotency-Key': f'check-{random.random()}'}
+    first = measure('POST /subscriptions (new key)', PURCHASE_BUDGET, '/subscriptions', purchase, key, 201)
+    retry = measure('POST /subscriptions (retried key)', REPLAY_BUDGET, '/subscriptions', purchase, key, 201)
+    if retry.get_json() != first.get_json():
+        failures.append('retried purchase did not replay the first response')
+
+    redeem = {'user_id': user_id, 'tier_id': cheap_id}
+    measure('POST /loyalty/redeem', REDEEM_BUDGET, '/loyalty/redeem', redeem)
+    key = {'Idempotency-Key': f'check-{random.random()}'}
+    first = measure('POST /loyalty/redeem (new key)', REDEEM_BUDGET, '/loyalty/redeem', redeem, key)
+    retry = measure('POST /loyalty/redeem (retried key)', REPLAY_BUDGET, '/loyalty/redeem', redeem, key)
+    if retry.get_json() != first.get_json():
+        failures.append('retried redemption did not replay the first response')
+
+    event.remove(engine, 'before_cursor_execute', count)
+    with app.app_context():
+        active = Subscription.query.filter_by(user_id=user_id, status='active').count()
+        earned = loyalty.get_summary(user_id).points_earned
+    if active != 1:
+        failures.append(f'{active} active hotspot subscriptions, expected 1')
+    if earned != 2 * points_per_purchase:
+        failures.append(f'points_earned is {earned}, expected two purchases worth')
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: statement counts within budget")
+
+
+if __name__ == '__main__':
+    main()
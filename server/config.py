@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 
 class Config:
     # Use environment variables for production, fallback to development defaults
@@ -16,5 +17,115 @@ class Config:
     SQLALCHEMY_DATABASE_URI = database_url or 'sqlite:///wifi_portal.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Connection pool per worker process (see db_pool.py). DB_PGBOUNCER=true
+    # when DATABASE_URL points at PgBouncer in transaction mode.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    # (whole seconds: Flask-SQLAlchemy coerces pool_timeout to int)
+    DB_POOL_TIMEOUT_SECONDS = int(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 10))
+    DB_POOL_RECYCLE_SECONDS = int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+    # Per-statement limit for queries run by requests (0 disables; Postgres only)
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 15000))
+
+    # Upper bound for ?limit= on paginated list endpoints
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
+    # Subscription expiry runs in a background thread instead of on every read
+    EXPIRY_SCHEDULER_ENABLED = os.environ.get('EXPIRY_SCHEDULER_ENABLED', 'true').lower() == 'true'
+    EXPIRY_RELOAD_SECONDS = int(os.environ.get('EXPIRY_RELOAD_SECONDS', 60))
+    # Send "expiring soon" / "expired" notifications to users
+    EXPIRY_NOTIFICATIONS = os.environ.get('EXPIRY_NOTIFICATIONS', 'false').lower() == 'true'
+    EXPIRY_WARNING_MINUTES = int(os.environ.get('EXPIRY_WARNING_MINUTES', 30))
+
+    # How often (seconds) a worker re-checks the tier catalog version in the DB
+    TIER_CACHE_CHECK_SECONDS = float(os.environ.get('TIER_CACHE_CHECK_SECONDS', 5))
+
+    # Serve tier analytics from the tier_subscription_counts rollup table.
+    # Run `flask rebuild-tier-rollups` once after turning this on.
+    TIER_ROLLUP_ENABLED = os.environ.get('TIER_ROLLUP_ENABLED', 'false').lower() == 'true'
+
+    # Mass communications are delivered by background jobs in chunks
+    FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 2))
+    FANOUT_CHUNK_SIZE = int(os.environ.get('FANOUT_CHUNK_SIZE', 5000))
+    # Jobs left running or queued by a worker that died are picked up again
+    # from their last chunk once idle for FANOUT_STALE_SECONDS, checked at
+    # startup and then every FANOUT_RECOVERY_SECONDS (0 turns this off); a
+    # job that has been claimed FANOUT_MAX_ATTEMPTS times is marked failed
+    FANOUT_RECOVERY_SECONDS = int(os.environ.get('FANOUT_RECOVERY_SECONDS', 60))
+    FANOUT_STALE_SECONDS = int(os.environ.get('FANOUT_STALE_SECONDS', 300))
+    FANOUT_MAX_ATTEMPTS = int(os.environ.get('FANOUT_MAX_ATTEMPTS', 3))
+
+    # Notification SSE stream: max connection length and DB re-check interval,
+    # which is also how long the browser waits before reconnecting. Every open
+    # stream holds a gunicorn thread, so cap them well below --threads (8 on
+    # Render); 0 makes every client poll
+    NOTIFICATION_STREAM_TIMEOUT = int(os.environ.get('NOTIFICATION_STREAM_TIMEOUT', 30))
+    NOTIFICATION_STREAM_POLL_SECONDS = int(os.environ.get('NOTIFICATION_STREAM_POLL_SECONDS', 30))
+    NOTIFICATION_STREAMS_PER_WORKER = int(os.environ.get('NOTIFICATION_STREAMS_PER_WORKER', 3))
+
+    # Read notifications older than this are moved to the
+    # archived_notifications table by `flask archive-notifications`
+    NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+    NOTIFICATION_ARCHIVE_BATCH_SIZE = int(os.environ.get('NOTIFICATION_ARCHIVE_BATCH_SIZE', 1000))
+
+    # Password hashing: bcrypt cost factor and the per-worker process pool.
+    # Excess concurrent logins get a 503 instead of queueing.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', 2))
+    HASH_MAX_PENDING = int(os.environ.get('HASH_MAX_PENDING', 8))
+    HASH_TIMEOUT_SECONDS = float(os.environ.get('HASH_TIMEOUT_SECONDS', 5))
+
+    # JWT access tokens issued by /login carry the user's role claim
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or SECRET_KEY
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=int(os.environ.get('JWT_ACCESS_TOKEN_HOURS', 12)))
+    # How long a worker may serve a cached copy of the revoked-token list
+    JWT_DENYLIST_TTL_SECONDS = int(os.environ.get('JWT_DENYLIST_TTL_SECONDS', 30))
+
+    # Loyalty ledger compaction: how often to fold events into snapshots
+    # (0 disables the background thread) and how old an event must be first
+    LOYALTY_COMPACTION_SECONDS = int(os.environ.get('LOYALTY_COMPACTION_SECONDS', 300))
+    LOYALTY_COMPACTION_LAG_SECONDS = int(os.environ.get('LOYALTY_COMPACTION_LAG_SECONDS', 60))
+
+    # How long a stored Idempotency-Key response is replayed for
+    IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+
+    # Router usage ingest: shared token for X-Ingest-Token, rows per
+    # insert batch, and rejected lines reported per batch
+    USAGE_INGEST_TOKEN = os.environ.get('USAGE_INGEST_TOKEN')
+    USAGE_INGEST_BATCH_SIZE = int(os.environ.get('USAGE_INGEST_BATCH_SIZE', 5000))
+    USAGE_INGEST_MAX_ERRORS = int(os.environ.get('USAGE_INGEST_MAX_ERRORS', 20))
+
+    # Usage rollups: how often queued buckets are recomputed, and how many
+    # (user, hour) buckets per transaction
+    USAGE_ROLLUP_SECONDS = int(os.environ.get('USAGE_ROLLUP_SECONDS', 60))
+    USAGE_ROLLUP_BATCH_SIZE = int(os.environ.get('USAGE_ROLLUP_BATCH_SIZE', 500))
+
+    # M-Pesa callbacks: the ?token= registered with the callback URL (every
+    # callback is rejected while it is unset), and the background worker
+    # that turns them into payments and subscriptions
+    MPESA_CALLBACK_TOKEN = os.environ.get('MPESA_CALLBACK_TOKEN')
+    PAYMENT_WORKER_ENABLED = os.environ.get('PAYMENT_WORKER_ENABLED', 'true').lower() == 'true'
+    PAYMENT_WORKER_POLL_SECONDS = float(os.environ.get('PAYMENT_WORKER_POLL_SECONDS', 5))
+    PAYMENT_BATCH_SIZE = int(os.environ.get('PAYMENT_BATCH_SIZE', 100))
+    PAYMENT_CLAIM_TIMEOUT_SECONDS = int(os.environ.get('PAYMENT_CLAIM_TIMEOUT_SECONDS', 300))
+
+    # Revenue buckets follow the business day in this UTC offset (Nairobi is +3)
+    REVENUE_UTC_OFFSET_HOURS = int(os.environ.get('REVENUE_UTC_OFFSET_HOURS', 3))
+    REVENUE_BACKFILL_BATCH_SIZE = int(os.environ.get('REVENUE_BACKFILL_BATCH_SIZE', 5000))
+
+    # JSON encoder for responses: 'auto' (orjson when installed), 'orjson' or 'json'
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+    # gzip responses of at least GZIP_MIN_BYTES at GZIP_LEVEL (1-9; 0 turns compression off)
+    GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+    GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+
+    # /metrics: optional bearer token for the scraper, and the per-request
+    # SQL statement count above which a request is flagged as likely N+1
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 20))
+
     # CORS configuration - will be set in app.py based on environment
     FRONTEND_URL = os.environ.get('FRONTEND_URL') or 'http://localhost:5173'
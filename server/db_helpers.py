@@ -0,0 +1,91 @@
+"""Small helpers shared by the modules that write through SQLAlchemy core.
+
+DateTime columns hold naive UTC, so timestamps compared with or written to
+them go through utc_naive_now() / to_naive_utc() / parse_naive_utc().
+
+The upsert helpers use INSERT ... ON CONFLICT on Postgres and SQLite. On
+other databases they UPDATE first and INSERT in a savepoint if no row was
+there, retrying when another worker inserts the same key first. Both run
+in the caller's transaction.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+
+_UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def utc_naive_now():
+    """Current UTC time without tzinfo, matching how DateTime columns are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_naive_utc(value):
+    """An aware datetime converted to naive UTC; naive values and None pass through."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_naive_utc(value):
+    """Parse an ISO 8601 timestamp (a trailing Z is allowed) into naive UTC,
+    or None if value is empty. Raises ValueError if it doesn't parse."""
+    if not value:
+        return None
+    return to_naive_utc(datetime.fromisoformat(str(value).replace('Z', '+00:00')))
+
+
+def dialect_insert():
+    """The dialect's insert() with ON CONFLICT support, or None."""
+    return _UPSERT_DIALECTS.get(db.engine.dialect.name)
+
+
+def insert_ignore(table, values, conflict):
+    """Insert a row unless one with the same `conflict` columns (a unique
+    key) exists. Returns True if the row was inserted."""
+    insert = dialect_insert()
+    if insert is not None:
+        result = db.session.execute(insert(table).values(**values).on_conflict_do_nothing(
+            index_elements=[table.c[column] for column in conflict]
+        ))
+        return result.rowcount == 1
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(**values))
+    except IntegrityError:
+        return False
+    return True
+
+
+def upsert_add(table, key, increments, values=None):
+    """Add `increments` ({column: amount}) to the row identified by `key`
+    ({column: value} over a unique key), creating it from key + increments
+    if it doesn't exist yet. `values` are further columns set either way,
+    such as updated_at."""
+    values = values or {}
+    insert = dialect_insert()
+    if insert is not None:
+        stmt = insert(table).values(**key, **increments, **values)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c[column] for column in key],
+            set_={**{column: table.c[column] + stmt.excluded[column] for column in increments},
+                  **{column: stmt.excluded[column] for column in values}}
+        ))
+        return
+
+    result = db.session.execute(
+        table.update()
+        .where(*[table.c[column] == value for column, value in key.items()])
+        .values(**{column: table.c[column] + amount for column, amount in increments.items()}, **values)
+    )
+    if result.rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(**key, **increments, **values))
+    except IntegrityError:
+        # Another worker created the row first; add to it
+        upsert_add(table, key, increments, values)
@@ -0,0 +1,170 @@
+"""Database connection pool settings, pool metrics and statement timeouts.
+
+init_app() must run before db.init_app(): it fills in
+SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings (anything already
+set in SQLALCHEMY_ENGINE_OPTIONS wins) and swaps in a pool class that
+records how long each checkout waited.
+
+With DB_PGBOUNCER on, DATABASE_URL points at PgBouncer in transaction
+mode, which does the pooling, so each worker connects per checkout
+(NullPool) instead of holding idle connections of its own.
+
+Statement timeouts are set with SET LOCAL at the start of every
+transaction a request opens, so they never outlive the transaction and
+work the same behind PgBouncer. Views that legitimately run long raise
+their own limit with @statement_timeout(ms); the limit is looked up
+before the request runs, so it also covers queries made by decorators
+such as admin_required, whatever their order. CLI commands, migrations and
+background workers run without a timeout. SQLite has no statement
+timeout; there the setting is ignored.
+"""
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeout
+from sqlalchemy.pool import NullPool, QueuePool
+
+# SQLSTATE for "canceling statement due to statement timeout"
+QUERY_CANCELED = '57014'
+
+
+class _MeteredPool:
+    """Pool mixin counting checkouts, time spent waiting for them and
+    checkout timeouts. Wait time includes opening a new connection when
+    the pool has to grow."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self._metrics = {'checkouts': 0, 'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                         'peak_checked_out': 0}
+        self._in_use = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except PoolTimeout:
+            with self._metrics_lock:
+                self._metrics['timeouts'] += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._metrics_lock:
+            metrics = self._metrics
+            metrics['checkouts'] += 1
+            metrics['wait_seconds'] += waited
+            metrics['max_wait_seconds'] = max(metrics['max_wait_seconds'], waited)
+            self._in_use += 1
+            metrics['peak_checked_out'] = max(metrics['peak_checked_out'], self._in_use)
+        return record
+
+    def _do_return_conn(self, record):
+        with self._metrics_lock:
+            self._in_use -= 1
+        super()._do_return_conn(record)
+
+    def capacity(self):
+        return None
+
+    def stats(self):
+        with self._metrics_lock:
+            stats = dict(self._metrics)
+            stats['checked_out'] = self._in_use
+        stats['pool'] = type(self).__name__
+        stats['capacity'] = self.capacity()
+        stats['avg_wait_ms'] = stats['wait_seconds'] / stats['checkouts'] * 1000 if stats['checkouts'] else 0.0
+        stats['max_wait_ms'] = stats.pop('max_wait_seconds') * 1000
+        if stats['capacity']:
+            stats['saturation'] = stats['checked_out'] / stats['capacity']
+            stats['peak_saturation'] = stats['peak_checked_out'] / stats['capacity']
+        return stats
+
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    def capacity(self):
+        return self.size() + max(self._max_overflow, 0)
+
+
+class MeteredNullPool(_MeteredPool, NullPool):
+    pass
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}  # one shared in-memory connection; nothing to size
+    if config['DB_PGBOUNCER']:
+        # Fresh connections to PgBouncer need neither pinging nor recycling
+        return {'poolclass': MeteredNullPool}
+    return dict(
+        poolclass=MeteredQueuePool,
+        pool_pre_ping=config['DB_POOL_PRE_PING'],
+        pool_recycle=config['DB_POOL_RECYCLE_SECONDS'],
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT_SECONDS'],
+    )
+
+
+def pool_stats(engine):
+    """Checkout metrics of this worker's pool."""
+    pool = engine.pool
+    if isinstance(pool, _MeteredPool):
+        return pool.stats()
+    return {'pool': type(pool).__name__}
+
+
+def statement_timeout(ms):
+    """Give a view its own statement timeout (0 for none).
+
+    Only marks the view; decorators applied on top copy the mark with
+    functools.wraps, and init_app's before_request hook applies it.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapper.statement_timeout_ms = ms
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    default_timeout = app.config['DB_STATEMENT_TIMEOUT_MS']
+
+    @app.before_request
+    def resolve_statement_timeout():
+        view = app.view_functions.get(request.endpoint)
+        ms = getattr(view, 'statement_timeout_ms', None)
+        if ms is not None:
+            g.statement_timeout_ms = ms
+
+    @event.listens_for(Engine, 'begin')
+    def set_statement_timeout(conn):
+        if conn.dialect.name != 'postgresql' or not has_request_context():
+            return
+        ms = g.get('statement_timeout_ms', default_timeout)
+        if ms:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(ms)}")
+
+    @app.errorhandler(PoolTimeout)
+    def handle_pool_timeout(e):
+        app.logger.warning('Database pool exhausted: %s', e)
+        response = jsonify({"error": "Server busy, please try again shortly"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    @app.errorhandler(OperationalError)
+    def handle_operational_error(e):
+        if getattr(e.orig, 'pgcode', None) != QUERY_CANCELED:
+            raise e
+        app.logger.warning('Statement timeout: %s', e.statement)
+        return jsonify({"error": "The request took too long, please narrow it down or try again"}), 503
@@ -0,0 +1,258 @@
+import heapq
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from db_helpers import utc_naive_now, to_naive_utc
+from models import db, Subscription, SubscriptionTier, Notification
+import rollups
+from notification_bus import notification_bus
+
+subscriptions = Subscription.__table__
+notifications = Notification.__table__
+
+
+def expire_active_of_type(user_id, tier_type, ended_at):
+    """Expire a user's active subscriptions of one tier type in a single
+    UPDATE, ending them at ended_at. Runs in the caller's transaction."""
+    tiers = SubscriptionTier.__table__
+    stmt = subscriptions.update().where(
+        subscriptions.c.user_id == user_id,
+        subscriptions.c.status == 'active',
+        subscriptions.c.tier_id.in_(
+            select(tiers.c.id).where(tiers.c.tier_type == tier_type)
+        )
+    ).values(status='expired', end_date=to_naive_utc(ended_at))
+
+    if not rollups.enabled():
+        db.session.execute(stmt)
+        return
+
+    if db.engine.dialect.update_returning:
+        tier_ids = db.session.execute(stmt.returning(subscriptions.c.tier_id)).scalars().all()
+    else:
+        tier_ids = db.session.execute(
+            subscriptions.select().with_only_columns(subscriptions.c.tier_id)
+            .where(stmt.whereclause)
+        ).scalars().all()
+        db.session.execute(stmt)
+    rollups.record_subscriptions_ended(tier_ids)
+
+
+class ExpiryScheduler:
+    """Flips subscriptions to 'expired' at their end_date, off the request path.
+
+    Upcoming end dates are kept in a heap so the worker thread sleeps until
+    exactly the next one is due. Every EXPIRY_RELOAD_SECONDS it also runs a
+    set-based catch-up sweep and reloads the next window of end dates from
+    the database, which picks up subscriptions created by other workers.
+
+    Expiry is a conditional UPDATE, so several gunicorn workers can run a
+    scheduler side by side; only the worker whose UPDATE flipped a row sends
+    its 'expired' notification. 'Expiring soon' warnings are only deduplicated
+    within one process, so enable them on a single worker.
+    """
+
+    EXPIRE = 'expire'
+    WARN = 'warn'
+
+    def __init__(self, app=None):
+        self.app = None
+        self._heap = []
+        self._queued = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['expiry_scheduler'] = self
+
+        @app.cli.command('expire-subscriptions')
+        def expire_subscriptions_command():
+            """Expire every subscription whose end_date has passed."""
+            print(f"Expired {self.sweep()} subscriptions")
+
+        if app.config['EXPIRY_SCHEDULER_ENABLED']:
+            self.start()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, subscription_id, user_id, end_date):
+        """Queue a subscription created in this process for exact-time expiry."""
+        end_date = to_naive_utc(end_date)
+        if end_date is None:
+            return
+        with self._condition:
+            self._push(end_date, self.EXPIRE, subscription_id, user_id)
+            warn_at = self._warn_at(end_date)
+            if warn_at is not None and warn_at > utc_naive_now():
+                self._push(warn_at, self.WARN, subscription_id, user_id)
+            self._condition.notify()
+
+    def sweep(self):
+        """Catch-up pass: expire every active subscription already past end_date."""
+        now = utc_naive_now()
+        condition = (subscriptions.c.status == 'active') & (subscriptions.c.end_date <= now)
+        return self._expire(condition)
+
+    def _push(self, when, kind, subscription_id, user_id):
+        key = (kind, subscription_id)
+        if key in self._queued:
+            return
+        self._queued.add(key)
+        heapq.heappush(self._heap, (when, kind, subscription_id, user_id))
+
+    def _warn_at(self, end_date):
+        if not self.app.config['EXPIRY_NOTIFICATIONS']:
+            return None
+        return end_date - timedelta(minutes=self.app.config['EXPIRY_WARNING_MINUTES'])
+
+    def _expire(self, condition):
+        """Run one conditional UPDATE, then notify the owners of the flipped
+        rows and update the tier rollups for them."""
+        stmt = subscriptions.update().where(condition).values(status='expired')
+        notify = self.app.config['EXPIRY_NOTIFICATIONS']
+
+        if not notify and not rollups.enabled():
+            result = db.session.execute(stmt)
+            db.session.commit()
+            return result.rowcount
+
+        columns = (subscriptions.c.id, subscriptions.c.user_id, subscriptions.c.tier_id)
+        if db.engine.dialect.update_returning:
+            rows = db.session.execute(stmt.returning(*columns)).all()
+        else:
+            rows = db.session.execute(
+                subscriptions.select().with_only_columns(*columns).where(condition)
+            ).all()
+            db.session.execute(stmt)
+
+        if rows and notify:
+            db.session.execute(notifications.insert(), [{
+                'user_id': row.user_id,
+                'message': 'Your subscription has expired. Renew to stay connected.',
+                'channel': 'notification',
+                'type': 'subscription_expired',
+                'status': 'unread',
+                'created_at': utc_naive_now()
+            } for row in rows])
+        rollups.record_subscriptions_ended([row.tier_id for row in rows])
+        db.session.commit()
+        if rows and notify:
+            notification_bus.publish(*{row.user_id for row in rows})
+        return len(rows)
+
+    def _warn(self, entries):
+        # Only warn for subscriptions that are still active
+        ids = [subscription_id for _, _, subscription_id, _ in entries]
+        still_active = db.session.execute(
+            subscriptions.select().with_only_columns(
+                subscriptions.c.id, subscriptions.c.user_id
+            ).where(subscriptions.c.id.in_(ids), subscriptions.c.status == 'active')
+        ).all()
+        if still_active:
+            minutes = self.app.config['EXPIRY_WARNING_MINUTES']
+            db.session.execute(notifications.insert(), [{
+                'user_id': row.user_id,
+                'message': f'Your subscription expires in {minutes} minutes.',
+                'channel': 'notification',
+                'type': 'subscription_expiring',
+                'status': 'unread',
+                'created_at': utc_naive_now()
+            } for row in still_active])
+            db.session.commit()
+            notification_bus.publish(*{row.user_id for row in still_active})
+
+    def _reload(self):
+        """Load end dates falling inside the next reload window into the heap."""
+        now = utc_naive_now()
+        horizon = now + timedelta(seconds=self.app.config['EXPIRY_RELOAD_SECONDS'] * 2)
+        if self.app.config['EXPIRY_NOTIFICATIONS']:
+            horizon += timedelta(minutes=self.app.config['EXPIRY_WARNING_MINUTES'])
+
+        rows = db.session.execute(
+            subscriptions.select().with_only_columns(
+                subscriptions.c.id, subscriptions.c.user_id, subscriptions.c.end_date
+            ).where(
+                subscriptions.c.status == 'active',
+                subscriptions.c.end_date <= horizon
+            )
+        ).all()
+        db.session.commit()
+
+        with self._condition:
+            for row in rows:
+                self._push(row.end_date, self.EXPIRE, row.id, row.user_id)
+                warn_at = self._warn_at(row.end_date)
+                if warn_at is not None and warn_at > now:
+                    self._push(warn_at, self.WARN, row.id, row.user_id)
+
+    def _pop_due(self):
+        now = utc_naive_now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            self._queued.discard((entry[1], entry[2]))
+            due.append(entry)
+        return due
+
+    def _run(self):
+        reload_every = self.app.config['EXPIRY_RELOAD_SECONDS']
+        next_reload = 0
+
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                timeout = max(0, next_reload - time.monotonic())
+                if self._heap:
+                    seconds_to_next = (self._heap[0][0] - utc_naive_now()).total_seconds()
+                    timeout = min(timeout, max(0, seconds_to_next))
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                due = self._pop_due()
+
+            try:
+                with self.app.app_context():
+                    if time.monotonic() >= next_reload:
+                        self.sweep()
+                        self._reload()
+                        next_reload = time.monotonic() + reload_every
+
+                    expire_ids = [e[2] for e in due if e[1] == self.EXPIRE]
+                    if expire_ids:
+                        now = utc_naive_now()
+                        self._expire(
+                            subscriptions.c.id.in_(expire_ids)
+                            & (subscriptions.c.status == 'active')
+                            & (subscriptions.c.end_date <= now)
+                        )
+                    warnings = [e for e in due if e[1] == self.WARN]
+                    if warnings:
+                        self._warn(warnings)
+            except Exception:
+                self.app.logger.exception('Subscription expiry pass failed')
+                next_reload = time.monotonic() + reload_every
+
+
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Print the query plan for each hot endpoint query.
+
+Run against the configured DATABASE_URL (SQLite locally, Postgres on Render)
+to check that the indexes from the hot-query migration are being used:
+
+    python explain_queries.py
+"""
+from sqlalchemy import select, text, func, or_
+
+import loyalty
+import rollups
+from app import app, db
+from models import User, Subscription, SubscriptionTier, Notification, LoyaltyPoint, Feedback
+
+# Representative parameter values; the plan does not depend on them matching rows
+USER_ID = 1
+IDENTIFIER = '0700000000'
+
+
+def endpoint_queries():
+    active_sub = select(
+        Subscription.user_id, func.min(Subscription.id).label('subscription_id')
+    ).where(Subscription.status == 'active').group_by(Subscription.user_id).subquery()
+    leaderboard_order = (LoyaltyPoint.balance.desc(), LoyaltyPoint.user_id.desc())
+    leaderboard = select(LoyaltyPoint.user_id).where(LoyaltyPoint.balance >= 0) \
+        .order_by(*leaderboard_order).limit(101)
+
+    return [
+        ('POST /login', select(User).where(
+            or_(User.email == IDENTIFIER, User.phone_number == IDENTIFIER)
+        ).limit(1)),
+        ('GET /users', select(User.id, Subscription.start_date, SubscriptionTier.name)
+            .outerjoin(active_sub, active_sub.c.user_id == User.id)
+            .outerjoin(Subscription, Subscription.id == active_sub.c.subscription_id)
+            .outerjoin(SubscriptionTier, SubscriptionTier.id == Subscription.tier_id)
+            .order_by(User.id).limit(50)),
+        ('GET /subscriptions', select(Subscription.id, SubscriptionTier.name)
+            .outerjoin(SubscriptionTier, SubscriptionTier.id == Subscription.tier_id)
+            .where(Subscription.user_id == USER_ID)
+            .order_by(Subscription.start_date.desc(), Subscription.id.desc()).limit(50)),
+        ('GET /subscriptions?current=1', select(Subscription.id, SubscriptionTier.tier_type)
+            .outerjoin(SubscriptionTier, SubscriptionTier.id == Subscription.tier_id)
+            .where(Subscription.user_id == USER_ID, Subscription.status == 'active')),
+        ('POST /subscriptions (expire previous)', select(Subscription.id).where(
+            Subscription.user_id == USER_ID, Subscription.status == 'active',
+            Subscription.tier_id.in_(select(SubscriptionTier.id).where(SubscriptionTier.tier_type == 'hotspot'))
+        )),
+        ('GET /notifications', select(Notification).where(
+            Notification.user_id == USER_ID
+        ).order_by(Notification.created_at.desc())),
+        ('PATCH /notifications/mark-all-read', select(Notification.id).where(
+            Notification.user_id == USER_ID, Notification.status == 'unread'
+        )),
+        ('GET /loyalty', loyalty.summary_query().where(loyalty.loyalty_points.c.user_id == USER_ID)),
+        ('GET /loyalty/all?sort=balance', loyalty.ranked_query(leaderboard).order_by(*leaderboard_order)),
+        ('GET /feedbacks (admin)', select(Feedback).where(Feedback.subscription_type == 'hotspot')),
+        ('GET /feedbacks (user)', select(Feedback).where(Feedback.user_id == USER_ID)),
+        ('GET /analytics/tier-subscriptions', rollups.tier_counts_query('hotspot').statement),
+        ('GET /analytics/tier-subscriptions (rollup)', rollups.rollup_counts_query('hotspot').statement),
+        ('expiry sweep', select(Subscription.id).where(
+            Subscription.status == 'active', Subscription.end_date <= func.now()
+        )),
+    ]
+
+
+def explain(stmt):
+    dialect = db.engine.dialect
+    sql = str(stmt.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(text(prefix + sql)).all()
+    if dialect.name == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        print(f"Dialect: {db.engine.dialect.name}\n")
+        for name, stmt in endpoint_queries():
+            print(f"== {name}")
+            for line in explain(stmt):
+                print(f"   {line}")
+            print()
@@ -0,0 +1,122 @@
+"""Streaming exports of admin datasets as CSV or NDJSON.
+
+Rows are read with yield_per (a server-side cursor on Postgres) and
+written out in ~64 KB chunks from a generator, optionally through an
+incremental gzip compressor, so a worker's memory stays flat no matter
+how large the table is.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from models import db, User, Subscription, SubscriptionTier, Feedback
+import loyalty
+
+users = User.__table__
+subscriptions = Subscription.__table__
+tiers = SubscriptionTier.__table__
+feedbacks = Feedback.__table__
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+YIELD_PER = 1000
+CHUNK_BYTES = 64 * 1024
+
+
+def _users():
+    return select(
+        users.c.id, users.c.name, users.c.email, users.c.phone_number,
+        users.c.role, users.c.status, users.c.created_at
+    ).order_by(users.c.id)
+
+
+def _loyalty():
+    summary = loyalty.summary_query().subquery()
+    return select(
+        summary.c.user_id, users.c.name.label('user_name'), users.c.email.label('user_email'),
+        users.c.phone_number, summary.c.points_earned, summary.c.points_redeemed, summary.c.balance
+    ).join(users, users.c.id == summary.c.user_id).order_by(summary.c.user_id)
+
+
+def _feedback():
+    return select(
+        feedbacks.c.id, feedbacks.c.user_id, feedbacks.c.type, feedbacks.c.subscription_type,
+        feedbacks.c.subject, feedbacks.c.rating, feedbacks.c.comment, feedbacks.c.status,
+        feedbacks.c.admin_response, feedbacks.c.created_at, feedbacks.c.updated_at
+    ).order_by(feedbacks.c.id)
+
+
+def _subscriptions():
+    return select(
+        subscriptions.c.id, subscriptions.c.user_id, subscriptions.c.tier_id,
+        tiers.c.name.label('tier_name'), tiers.c.tier_type, tiers.c.price,
+        subscriptions.c.status, subscriptions.c.start_date, subscriptions.c.end_date
+    ).outerjoin(tiers, tiers.c.id == subscriptions.c.tier_id).order_by(subscriptions.c.id)
+
+
+DATASETS = {
+    'users': _users,
+    'loyalty': _loyalty,
+    'feedback': _feedback,
+    'subscriptions': _subscriptions,
+}
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _encode_rows(rows, columns, fmt):
+    """Yield encoded text chunks of roughly CHUNK_BYTES."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+
+    for row in rows:
+        if writer:
+            writer.writerow(['' if v is None else _value(v) for v in row])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, map(_value, row)))))
+            buffer.write('\n')
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(dataset, fmt, compress=False):
+    """Generator of response bytes for one dataset export."""
+    stmt = DATASETS[dataset]()
+    result = db.session.execute(stmt, execution_options={'yield_per': YIELD_PER})
+    columns = list(result.keys())
+    try:
+        chunks = (chunk.encode('utf-8') for chunk in _encode_rows(result, columns, fmt))
+        yield from (_gzip(chunks) if compress else chunks)
+    finally:
+        result.close()
+
+
+def filename(dataset, fmt, compress=False):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    return f"{dataset}-{stamp}.{fmt}" + ('.gz' if compress else '')
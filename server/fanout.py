@@ -0,0 +1,220 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import select, literal, func, or_
+
+from db_helpers import utc_naive_now
+from models import db, User, Notification, CommunicationJob, utc_now
+from notification_bus import notification_bus
+
+users = User.__table__
+notifications = Notification.__table__
+jobs = CommunicationJob.__table__
+
+
+def recipient_filter(recipients, specific_users=None):
+    """WHERE clause over users for a recipients choice, or None if invalid."""
+    not_admin = users.c.role != 'admin'  # Exclude admins
+    if recipients == 'all':
+        return not_admin
+    if recipients == 'active':
+        return not_admin & (users.c.status == 'active')
+    if recipients == 'specific':
+        return not_admin & users.c.id.in_(specific_users or [])
+    return None
+
+
+class FanoutRunner:
+    """Runs mass-communication jobs on a small thread pool.
+
+    Recipients are never loaded as ORM objects: each chunk is a single
+    INSERT ... SELECT over a users.id range, committed on its own, so memory
+    stays flat and progress is visible to GET /communications/jobs/<id>
+    from any worker while the job runs.
+
+    Each chunk commits together with the job's last_user_id and heartbeat,
+    so a job whose worker died (a deploy, an OOM kill) is resumed from the
+    next chunk by recover() without notifying anyone twice. A job is claimed
+    with a conditional UPDATE that bumps attempts, and every later write is
+    conditional on that attempt, so a worker that stalled past
+    FANOUT_STALE_SECONDS and lost its job to another stops at its next chunk.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._submitted = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config['FANOUT_WORKERS'], thread_name_prefix='fanout'
+        )
+        app.extensions['fanout'] = self
+
+        @app.cli.command('recover-fanout')
+        def recover_fanout_command():
+            """Resume communication jobs abandoned by a dead worker."""
+            resumed, failed = self.recover()
+            print(f"Resumed {resumed} communication jobs, marked {failed} failed")
+
+        if app.config['FANOUT_RECOVERY_SECONDS']:
+            self._thread = threading.Thread(target=self._recover_loop, name='fanout-recovery', daemon=True)
+            self._thread.start()
+
+    def submit(self, job_id):
+        with self._lock:
+            if job_id in self._submitted:
+                return None
+            self._submitted.add(job_id)
+        return self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                job = None
+                try:
+                    job = self.claim(job_id)
+                    if job is not None:
+                        self.deliver(job)
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.exception('Communication job %s failed', job_id)
+                    if job is not None:
+                        db.session.execute(_owned(job).values(
+                            status='failed', error=str(e), finished_at=utc_now()
+                        ))
+                        db.session.commit()
+        finally:
+            with self._lock:
+                self._submitted.discard(job_id)
+
+    def claim(self, job_id):
+        """Take the job as a new attempt if it is queued, or running but
+        quiet for FANOUT_STALE_SECONDS; returns its row, or None if it is
+        finished, out of attempts or being delivered elsewhere."""
+        now = utc_naive_now()
+        stale = now - timedelta(seconds=self.app.config['FANOUT_STALE_SECONDS'])
+        claimed = db.session.execute(jobs.update().where(
+            jobs.c.id == job_id,
+            jobs.c.attempts < self.app.config['FANOUT_MAX_ATTEMPTS'],
+            or_(jobs.c.status == 'queued', (jobs.c.status == 'running') & (jobs.c.heartbeat_at < stale))
+        ).values(status='running', attempts=jobs.c.attempts + 1, heartbeat_at=now))
+        db.session.commit()
+        if not claimed.rowcount:
+            return None
+        return db.session.execute(jobs.select().where(jobs.c.id == job_id)).one()
+
+    def deliver(self, job):
+        """Insert one notification per recipient in id-ordered chunks,
+        starting after the job's last_user_id. Returns the number sent, or
+        None if the job was taken over by another worker meanwhile."""
+        specific_users = json.loads(job.specific_users) if job.specific_users else None
+        where = recipient_filter(job.recipients, specific_users)
+        chunk_size = self.app.config['FANOUT_CHUNK_SIZE']
+
+        if job.total_recipients is None:
+            total = db.session.execute(select(func.count()).select_from(users).where(where)).scalar()
+            db.session.execute(_owned(job).values(total_recipients=total))
+            db.session.commit()
+
+        sent = job.sent_count or 0
+        last_id = job.last_user_id
+        while True:
+            # Upper bound of the next chunk of recipient ids
+            upper = db.session.execute(
+                select(func.max(users.c.id)).where(
+                    users.c.id.in_(
+                        select(users.c.id).where(where, users.c.id > last_id)
+                        .order_by(users.c.id).limit(chunk_size)
+                    )
+                )
+            ).scalar()
+            if upper is None:
+                break
+
+            created_at = utc_now()
+            result = db.session.execute(notifications.insert().from_select(
+                ['user_id', 'message', 'channel', 'type', 'status', 'created_at'],
+                select(
+                    users.c.id,
+                    literal(job.message),
+                    literal(job.channel),
+                    literal('promo'),
+                    literal('unread'),  # unread so the bell notification lights up
+                    literal(created_at, Notification.created_at.type)
+                ).where(where, users.c.id > last_id, users.c.id <= upper)
+            ))
+            sent += result.rowcount
+            last_id = upper
+            progress = db.session.execute(_owned(job).values(
+                sent_count=sent, last_user_id=last_id, heartbeat_at=utc_naive_now()
+            ))
+            if not progress.rowcount:
+                # Another worker resumed the job; it sends this chunk instead
+                db.session.rollback()
+                self.app.logger.warning('Communication job %s was taken over, stopping attempt %s',
+                                        job.id, job.attempts)
+                return None
+            db.session.commit()
+            notification_bus.publish_all()
+
+        db.session.execute(_owned(job).values(
+            status='completed', sent_count=sent, finished_at=utc_now()
+        ))
+        db.session.commit()
+        return sent
+
+    def recover(self):
+        """Submit jobs that have made no progress for FANOUT_STALE_SECONDS,
+        and mark failed those that are out of attempts (or were running
+        before progress was recorded, so can't be resumed safely). Returns
+        (resumed, failed)."""
+        with self.app.app_context():
+            stale = utc_naive_now() - timedelta(seconds=self.app.config['FANOUT_STALE_SECONDS'])
+            abandoned = or_(
+                (jobs.c.status == 'queued') & (jobs.c.created_at < stale),
+                (jobs.c.status == 'running') & (func.coalesce(jobs.c.heartbeat_at, jobs.c.created_at) < stale),
+            )
+            failed = db.session.execute(jobs.update().where(abandoned, or_(
+                jobs.c.attempts >= self.app.config['FANOUT_MAX_ATTEMPTS'],
+                (jobs.c.status == 'running') & jobs.c.heartbeat_at.is_(None),
+            )).values(
+                status='failed', finished_at=utc_now(),
+                error='Delivery was interrupted and could not be resumed; sent_count says how many users were notified'
+            )).rowcount
+            db.session.commit()
+            job_ids = db.session.execute(select(jobs.c.id).where(abandoned).order_by(jobs.c.id)).scalars().all()
+        for job_id in job_ids:
+            self.submit(job_id)
+        if job_ids or failed:
+            self.app.logger.warning('Resumed communication jobs %s, marked %d failed', job_ids, failed)
+        return len(job_ids), failed
+
+    def _recover_loop(self):
+        interval = self.app.config['FANOUT_RECOVERY_SECONDS']
+        while True:
+            try:
+                self.recover()
+            except Exception:
+                self.app.logger.exception('Communication job recovery failed')
+            if self._stop.wait(interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+
+
+def _owned(job):
+    """UPDATE of the job, matching only while this attempt still holds it."""
+    return jobs.update().where(jobs.c.id == job.id, jobs.c.attempts == job.attempts)
+
+
+fanout = FanoutRunner()
@@ -0,0 +1,20 @@
+"""Gunicorn hooks; gunicorn reads this file from the directory it starts in.
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR
+(see metrics.py). The master empties the directory on start, before any
+worker imports the app, and drops a worker's live gauges when it exits.
+"""
+import os
+import shutil
+import tempfile
+
+
+def on_starting(server):
+    path = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'mnet-prometheus'))
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
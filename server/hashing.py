@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import multiprocessing
+
+import bcrypt as _bcrypt
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated; the request should be retried."""
+
+
+def _hash(password, rounds):
+    return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password_hash, password):
+    return _bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def _warmup():
+    return True
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded process pool instead of on request threads.
+
+    At most HASH_MAX_PENDING hash/check calls may be queued or running per
+    worker; beyond that HashingBusy is raised straight away so a login storm
+    gets fast 503s instead of an ever-growing queue. The cost factor comes
+    from BCRYPT_LOG_ROUNDS; hashes made with a different cost are flagged by
+    needs_rehash() so login can upgrade them transparently.
+
+    With HASH_POOL_WORKERS = 0 hashing runs inline, which is what scripts
+    and the app-start admin bootstrap get before init_app() has run.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.timeout = None
+        self._pool = None
+        self._slots = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'hashed': 0, 'checked': 0, 'rejected': 0, 'seconds': 0.0}
+        self._started = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.timeout = app.config['HASH_TIMEOUT_SECONDS']
+        workers = app.config['HASH_POOL_WORKERS']
+        if workers:
+            # Fork the pool now, while this process has no background threads yet
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('fork')
+            )
+            self._pool.submit(_warmup).result()
+            self._slots = threading.BoundedSemaphore(app.config['HASH_MAX_PENDING'])
+        app.extensions['password_hasher'] = self
+
+    def _run(self, fn, *args):
+        start = time.perf_counter()
+        if self._pool is None:
+            result = fn(*args)
+        else:
+            if not self._slots.acquire(blocking=False):
+                with self._stats_lock:
+                    self._stats['rejected'] += 1
+                raise HashingBusy()
+            # The slot is held until the pool finishes the job, even if we stop waiting
+            future = self._pool.submit(fn, *args)
+            future.add_done_callback(lambda _: self._slots.release())
+            try:
+                result = future.result(timeout=self.timeout)
+            except TimeoutError:
+                with self._stats_lock:
+                    self._stats['rejected'] += 1
+                raise HashingBusy()
+
+        with self._stats_lock:
+            self._stats['hashed' if fn is _hash else 'checked'] += 1
+            self._stats['seconds'] += time.perf_counter() - start
+        return result
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(_check, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if password_hash was made with a different cost factor."""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        operations = stats['hashed'] + stats['checked']
+        stats['ops_per_second'] = operations / (time.monotonic() - self._started)
+        stats['avg_ms'] = stats['seconds'] / operations * 1000 if operations else 0.0
+        stats['rounds'] = self.rounds
+        return stats
+
+
+password_hasher = PasswordHasher()
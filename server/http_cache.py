@@ -0,0 +1,105 @@
+"""Conditional GETs and gzip compression for API responses.
+
+Runs after every request, in this order:
+
+1. Conditional GET. A JSON GET response without an ETag gets a weak one
+   from a hash of its body, and a Last-Modified if the view recorded one with
+   last_modified(). Matching If-None-Match (or If-Modified-Since, when no
+   If-None-Match is sent) turns the response into an empty 304. These
+   responses are marked Cache-Control: no-cache, so clients keep them but
+   revalidate on every use.
+
+2. Compression. Bodies of at least GZIP_MIN_BYTES in a text-like format
+   are gzipped at GZIP_LEVEL when the client accepts it. GZIP_LEVEL=0
+   turns compression off. A strong ETag becomes weak once the body is
+   compressed, as the bytes on the wire differ between encodings.
+
+Streamed responses (exports) are left alone; they compress themselves.
+"""
+import gzip
+import hashlib
+
+from flask import g, request
+
+COMPRESSIBLE = {
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/html',
+    'text/plain',
+}
+
+
+def last_modified(rows, *fields):
+    """Record the newest of the given timestamp fields over rows as the
+    response's Last-Modified.
+
+    Only use this where every change to the listed rows moves one of the
+    fields, e.g. an updated_at with onupdate; otherwise clients revalidating
+    by date alone would be told nothing changed.
+    """
+    newest = None
+    for row in rows:
+        for field in fields:
+            value = getattr(row, field)
+            if value is not None and (newest is None or value > newest):
+                newest = value
+    g.last_modified = newest
+
+
+def _conditional(response):
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+        return response
+    if response.is_streamed or response.direct_passthrough or response.mimetype != 'application/json':
+        return response
+
+    if not response.headers.get('ETag'):
+        # Weak, so the same tag validates the plain and the gzipped body
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest(), weak=True)
+    newest = g.pop('last_modified', None)
+    if newest is not None:
+        response.last_modified = newest
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def _compress(response, level, min_bytes):
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206):
+        return response
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    compressed = gzip.compress(data, compresslevel=level, mtime=0)
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    level = app.config['GZIP_LEVEL']
+    min_bytes = app.config['GZIP_MIN_BYTES']
+
+    @app.after_request
+    def conditional_and_compress(response):
+        response = _conditional(response)
+        if level:
+            response = _compress(response, level, min_bytes)
+        return response
@@ -0,0 +1,78 @@
+"""Idempotency-Key support for write endpoints.
+
+A request carrying an Idempotency-Key header stores its response in the
+idempotency_keys table in the same transaction as the work it did. A retry
+with the same key (from the same user, on the same endpoint) gets the
+stored response back instead of repeating the work. Keys expire after
+IDEMPOTENCY_TTL_HOURS.
+"""
+import json
+from datetime import timedelta
+
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+
+from db_helpers import utc_naive_now
+from models import db, IdempotencyKey
+
+idempotency_keys = IdempotencyKey.__table__
+
+
+def request_key(scope, user_id):
+    """Storage key for this request, or None if it has no Idempotency-Key header."""
+    header = request.headers.get('Idempotency-Key')
+    if not header:
+        return None
+    return f"{scope}:{user_id}:{header}"[:255]
+
+
+def stored_response(key):
+    """(body, status) previously stored for key, or None."""
+    row = db.session.execute(
+        idempotency_keys.select().where(idempotency_keys.c.key == key)
+    ).first()
+    if row is None:
+        return None
+    if row.expires_at <= utc_naive_now():
+        db.session.execute(idempotency_keys.delete().where(idempotency_keys.c.id == row.id))
+        return None
+    return json.loads(row.response_body), row.status_code
+
+
+def remember(key, body, status):
+    """Queue the response for key as part of the current transaction."""
+    ttl = timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS'])
+    now = utc_naive_now()
+    db.session.execute(idempotency_keys.insert().values(
+        key=key, status_code=status, response_body=json.dumps(body),
+        created_at=now, expires_at=now + ttl
+    ))
+
+
+def commit(key):
+    """Commit the transaction. If a concurrent request with the same key won
+    the race, roll back and return its stored (body, status) instead."""
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if key is None:
+            raise
+        replay = stored_response(key)
+        if replay is None:
+            raise
+        return replay
+    return None
+
+
+def prune():
+    result = db.session.execute(idempotency_keys.delete().where(idempotency_keys.c.expires_at <= utc_naive_now()))
+    db.session.commit()
+    return result.rowcount
+
+
+def init_app(app):
+    @app.cli.command('prune-idempotency-keys')
+    def prune_idempotency_keys_command():
+        """Delete expired idempotency keys."""
+        print(f"Deleted {prune()} expired idempotency keys")
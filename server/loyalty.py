@@ -0,0 +1,210 @@
+"""Loyalty points ledger.
+
+Every earn and redeem is an insert into the append-only loyalty_events
+table. loyalty_points holds one snapshot row per user: totals covering all
+events up to last_event_id. A balance is the snapshot plus the (small)
+delta of events after it, and the compaction job periodically folds those
+events into the snapshot.
+
+Earning never touches the snapshot row, so concurrent purchases don't
+contend. Redeeming takes a row lock on the snapshot first so that two
+redemptions can't both spend the same balance.
+"""
+import threading
+from datetime import timedelta
+
+import click
+from sqlalchemy import select, func, case, and_
+
+from db_helpers import insert_ignore
+from models import db, User, LoyaltyPoint, LoyaltyEvent, utc_now
+
+loyalty_points = LoyaltyPoint.__table__
+loyalty_events = LoyaltyEvent.__table__
+
+
+def ensure_account(user_id):
+    """Create the user's snapshot row if missing, without touching an existing one."""
+    insert_ignore(loyalty_points, dict(user_id=user_id, points_earned=0, points_redeemed=0, balance=0,
+                                       last_event_id=0, last_updated=utc_now()), ['user_id'])
+
+
+def _record(user_id, kind, delta, reference):
+    db.session.execute(loyalty_events.insert().values(
+        user_id=user_id, kind=kind, delta=delta, reference=reference, created_at=utc_now()
+    ))
+
+
+def award_points(user_id, points, reference=None):
+    """Append an earn event. Contention-free: no existing row is updated."""
+    ensure_account(user_id)
+    _record(user_id, 'earn', points, reference)
+
+
+def spend_points(user_id, points, reference=None):
+    """Append a redeem event if the balance covers it.
+
+    The snapshot row is locked with a no-op UPDATE before the balance is
+    read, which serializes redemptions per user on both Postgres (row lock)
+    and SQLite (write lock). Returns the new balance, or None if the balance
+    was insufficient.
+    """
+    ensure_account(user_id)
+    db.session.execute(
+        loyalty_points.update().where(loyalty_points.c.user_id == user_id)
+        .values(last_updated=utc_now())
+    )
+    balance = current_balance(user_id)
+    if balance < points:
+        return None
+    _record(user_id, 'redeem', -points, reference)
+    return balance - points
+
+
+def summary_query():
+    """Per-user (points_earned, points_redeemed, balance): snapshot + delta."""
+    e = loyalty_events
+    earned = func.coalesce(func.sum(case((e.c.delta > 0, e.c.delta), else_=0)), 0)
+    redeemed = func.coalesce(func.sum(case((e.c.delta < 0, -e.c.delta), else_=0)), 0)
+    return select(
+        loyalty_points.c.id,
+        loyalty_points.c.user_id,
+        (loyalty_points.c.points_earned + earned).label('points_earned'),
+        (loyalty_points.c.points_redeemed + redeemed).label('points_redeemed'),
+        (loyalty_points.c.balance + func.coalesce(func.sum(e.c.delta), 0)).label('balance'),
+    ).select_from(loyalty_points.outerjoin(e, and_(
+        e.c.user_id == loyalty_points.c.user_id,
+        e.c.id > loyalty_points.c.last_event_id
+    ))).group_by(
+        loyalty_points.c.id, loyalty_points.c.user_id, loyalty_points.c.points_earned,
+        loyalty_points.c.points_redeemed, loyalty_points.c.balance
+    )
+
+
+def ranked_query(page):
+    """summary_query() for the user ids selected by `page`, with the
+    account holder's details and the snapshot balance as `ranked_balance`.
+
+    Sorting and filtering happen in `page` on the snapshot columns, where
+    the (balance, user_id) index can serve them; only the selected page is
+    then aggregated with its pending ledger events.
+    """
+    users = User.__table__
+    return summary_query().add_columns(
+        users.c.name.label('user_name'), users.c.email.label('user_email'),
+        users.c.phone_number, loyalty_points.c.balance.label('ranked_balance')
+    ).join(users, users.c.id == loyalty_points.c.user_id) \
+     .where(loyalty_points.c.user_id.in_(page)) \
+     .group_by(users.c.name, users.c.email, users.c.phone_number)
+
+
+def get_summary(user_id):
+    return db.session.execute(
+        summary_query().where(loyalty_points.c.user_id == user_id)
+    ).first()
+
+
+def current_balance(user_id):
+    row = get_summary(user_id)
+    return row.balance if row else 0
+
+
+def compact(lag_seconds, batch_size=1000):
+    """Fold ledger events into the snapshots.
+
+    Only events older than lag_seconds are folded. Postgres hands out ids
+    before commit, so a younger id may still be invisible while a larger
+    one is already committed; the lag keeps the snapshot's high-water mark
+    behind any transaction still in flight.
+
+    Returns the number of snapshot rows updated.
+    """
+    cutoff = utc_now() - timedelta(seconds=lag_seconds)
+    high_water = db.session.execute(
+        select(func.max(loyalty_events.c.id)).where(loyalty_events.c.created_at < cutoff)
+    ).scalar()
+    if high_water is None:
+        return 0
+
+    e = loyalty_events
+    pending = select(
+        loyalty_points.c.user_id,
+        loyalty_points.c.last_event_id,
+        func.sum(case((e.c.delta > 0, e.c.delta), else_=0)).label('earned'),
+        func.sum(case((e.c.delta < 0, -e.c.delta), else_=0)).label('redeemed'),
+        func.sum(e.c.delta).label('delta'),
+        func.max(e.c.id).label('max_id'),
+    ).select_from(loyalty_points.join(e, and_(
+        e.c.user_id == loyalty_points.c.user_id,
+        e.c.id > loyalty_points.c.last_event_id,
+        e.c.id <= high_water
+    ))).group_by(loyalty_points.c.user_id, loyalty_points.c.last_event_id) \
+       .order_by(loyalty_points.c.user_id)
+
+    folded = 0
+    after_user = 0
+    while True:
+        rows = db.session.execute(
+            pending.where(loyalty_points.c.user_id > after_user).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            # Guarded on last_event_id so overlapping compactions can't double-fold
+            result = db.session.execute(
+                loyalty_points.update().where(
+                    loyalty_points.c.user_id == row.user_id,
+                    loyalty_points.c.last_event_id == row.last_event_id
+                ).values(
+                    points_earned=loyalty_points.c.points_earned + row.earned,
+                    points_redeemed=loyalty_points.c.points_redeemed + row.redeemed,
+                    balance=loyalty_points.c.balance + row.delta,
+                    last_event_id=row.max_id,
+                    last_updated=utc_now()
+                )
+            )
+            folded += result.rowcount
+        db.session.commit()
+        after_user = rows[-1].user_id
+    return folded
+
+
+class LedgerCompactor:
+    """Runs compact() every LOYALTY_COMPACTION_SECONDS in a background thread."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+
+        @app.cli.command('compact-loyalty')
+        @click.option('--lag', type=int, default=None, help='Only fold events older than this many seconds.')
+        def compact_loyalty_command(lag):
+            """Fold loyalty ledger events into per-user snapshots."""
+            lag = app.config['LOYALTY_COMPACTION_LAG_SECONDS'] if lag is None else lag
+            print(f"Compacted {compact(lag)} loyalty snapshots")
+
+        if app.config['LOYALTY_COMPACTION_SECONDS']:
+            self._thread = threading.Thread(target=self._run, name='loyalty-compactor', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = self.app.config['LOYALTY_COMPACTION_SECONDS']
+        lag = self.app.config['LOYALTY_COMPACTION_LAG_SECONDS']
+        while not self._stop.wait(interval):
+            try:
+                with self.app.app_context():
+                    compact(lag)
+            except Exception:
+                self.app.logger.exception('Loyalty ledger compaction failed')
+
+    def stop(self):
+        self._stop.set()
+
+
+ledger_compactor = LedgerCompactor()
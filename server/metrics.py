@@ -0,0 +1,129 @@
+"""Request and SQL metrics in Prometheus format.
+
+Every request is timed from before_request to teardown (so streamed
+responses count until the last chunk), and the engine's cursor events add
+up the SQL statements it ran, the time spent in them and the rows they
+returned or changed. Statements run outside a request (background
+workers, CLI commands) aren't counted. Requests running more than
+N_PLUS_ONE_THRESHOLD statements are counted as likely N+1 and logged with
+their most repeated statement.
+
+Row counts come from the driver's cursor.rowcount: psycopg2 reports it for
+SELECTs, sqlite3 only for INSERT/UPDATE/DELETE.
+
+Under gunicorn each worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set up in gunicorn.conf.py) and /metrics merges all workers' files, so a
+scrape sees the whole instance whichever worker answers it. Without that
+directory (flask run, scripts) metrics are kept in-process.
+"""
+import os
+import time
+
+from flask import g, request, has_request_context
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from sqlalchemy import event
+
+from db_pool import MeteredQueuePool
+from models import db
+
+LABELS = ('method', 'endpoint')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route', LABELS + ('status',),
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+REQUEST_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements run per request', LABELS,
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+)
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_seconds', 'Time spent in SQL per request', LABELS,
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+REQUEST_ROWS = Histogram(
+    'http_request_db_rows', 'Rows returned or changed by SQL per request', LABELS,
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+)
+N_PLUS_ONE = Counter(
+    'http_request_n_plus_one', 'Requests over N_PLUS_ONE_THRESHOLD SQL statements', LABELS
+)
+POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections', 'Connections checked out of the pool', multiprocess_mode='livesum'
+)
+POOL_CAPACITY = Gauge(
+    'db_pool_capacity_connections', 'Pool size plus overflow', multiprocess_mode='livesum'
+)
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'sql_stats' in g:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None or 'sql_stats' not in g:
+        return
+    stats = g.sql_stats
+    stats['statements'] += 1
+    stats['seconds'] += time.perf_counter() - started
+    if cursor.rowcount > 0:
+        stats['rows'] += cursor.rowcount
+    stats['repeats'][statement] = stats['repeats'].get(statement, 0) + 1
+
+
+def render():
+    """(body, content type) for the /metrics endpoint."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+    with app.app_context():
+        engine = db.engine
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'checkout', lambda *args: POOL_CHECKED_OUT.inc())
+    event.listen(engine, 'checkin', lambda *args: POOL_CHECKED_OUT.dec())
+    if isinstance(engine.pool, MeteredQueuePool):
+        POOL_CAPACITY.set(engine.pool.capacity())
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_stats = {'statements': 0, 'seconds': 0.0, 'rows': 0, 'repeats': {}}
+
+    @app.after_request
+    def remember_status(response):
+        g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(exc):
+        started = g.pop('request_started', None)
+        stats = g.pop('sql_stats', None)
+        if started is None or request.endpoint == 'get_metrics':
+            return
+        method, endpoint = request.method, _endpoint()
+        status = g.pop('response_status', 500)
+        REQUEST_LATENCY.labels(method, endpoint, str(status)).observe(time.perf_counter() - started)
+        REQUEST_STATEMENTS.labels(method, endpoint).observe(stats['statements'])
+        REQUEST_DB_TIME.labels(method, endpoint).observe(stats['seconds'])
+        REQUEST_ROWS.labels(method, endpoint).observe(stats['rows'])
+        if threshold and stats['statements'] > threshold:
+            N_PLUS_ONE.labels(method, endpoint).inc()
+            statement, repeats = max(stats['repeats'].items(), key=lambda item: item[1])
+            app.logger.warning('Likely N+1: %s %s ran %d statements; %d x %s', method, endpoint,
+                               stats['statements'], repeats, ' '.join(statement.split())[:200])
@@ -0,0 +1,62 @@
+"""add indexes for hot query paths
+
+Revision ID: 4c1e7a2b9d31
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1e7a2b9d31'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_users_phone_number', 'users', ['phone_number']),
+    ('ix_subscriptions_user_id_status', 'subscriptions', ['user_id', 'status']),
+    ('ix_subscriptions_tier_id_status', 'subscriptions', ['tier_id', 'status']),
+    ('ix_subscriptions_status_end_date', 'subscriptions', ['status', 'end_date']),
+    ('ix_notifications_user_id_created_at', 'notifications', ['user_id', 'created_at']),
+    ('ix_notifications_user_id_status', 'notifications', ['user_id', 'status']),
+    ('ix_feedbacks_user_id', 'feedbacks', ['user_id']),
+    ('ix_feedbacks_subscription_type', 'feedbacks', ['subscription_type']),
+]
+
+
+def merge_duplicate_loyalty_rows():
+    """Fold duplicate loyalty_points rows into the oldest row per user so the
+    unique index can be created."""
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        "SELECT user_id, MIN(id) AS keep_id, SUM(points_earned) AS earned, "
+        "SUM(points_redeemed) AS redeemed, SUM(balance) AS balance "
+        "FROM loyalty_points GROUP BY user_id HAVING COUNT(*) > 1"
+    )).all()
+    for row in duplicates:
+        conn.execute(sa.text(
+            "UPDATE loyalty_points SET points_earned = :earned, "
+            "points_redeemed = :redeemed, balance = :balance WHERE id = :keep_id"
+        ), dict(earned=row.earned, redeemed=row.redeemed, balance=row.balance, keep_id=row.keep_id))
+        conn.execute(sa.text(
+            "DELETE FROM loyalty_points WHERE user_id = :user_id AND id != :keep_id"
+        ), dict(user_id=row.user_id, keep_id=row.keep_id))
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+    merge_duplicate_loyalty_rows()
+    op.create_index('uq_loyalty_points_user_id', 'loyalty_points', ['user_id'],
+                    unique=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('uq_loyalty_points_user_id', table_name='loyalty_points', if_exists=True)
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,33 @@
+"""add tier_subscription_counts rollup table
+
+Revision ID: 8a3f5d0c6e12
+Revises: 4c1e7a2b9d31
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3f5d0c6e12'
+down_revision = '4c1e7a2b9d31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table via db.create_all()
+    if sa.inspect(op.get_bind()).has_table('tier_subscription_counts'):
+        return
+    op.create_table(
+        'tier_subscription_counts',
+        sa.Column('tier_id', sa.Integer(), sa.ForeignKey('subscription_tiers.id'), primary_key=True),
+        sa.Column('active_count', sa.Integer(), nullable=False),
+        sa.Column('total_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('tier_subscription_counts')
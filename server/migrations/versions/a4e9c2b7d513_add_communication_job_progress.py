@@ -0,0 +1,40 @@
+"""add resume columns to communication_jobs
+
+Revision ID: a4e9c2b7d513
+Revises: f7a2d5c8e319
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e9c2b7d513'
+down_revision = 'f7a2d5c8e319'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['specific_users', 'last_user_id', 'attempts', 'heartbeat_at']
+
+
+def upgrade():
+    # init_db() may already have created the table with them via db.create_all()
+    columns = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('communication_jobs')]
+    with op.batch_alter_table('communication_jobs') as batch_op:
+        if 'specific_users' not in columns:
+            batch_op.add_column(sa.Column('specific_users', sa.Text(), nullable=True))
+        if 'last_user_id' not in columns:
+            batch_op.add_column(sa.Column('last_user_id', sa.Integer(), nullable=False, server_default='0'))
+        if 'attempts' not in columns:
+            batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+        if 'heartbeat_at' not in columns:
+            batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    columns = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('communication_jobs')]
+    with op.batch_alter_table('communication_jobs') as batch_op:
+        for column in reversed(COLUMNS):
+            if column in columns:
+                batch_op.drop_column(column)
@@ -0,0 +1,25 @@
+"""add (balance, user_id) index for the loyalty leaderboard
+
+Revision ID: a6c2f8e0d357
+Revises: f3b8d1e6a924
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c2f8e0d357'
+down_revision = 'f3b8d1e6a924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_loyalty_points_balance_user_id', 'loyalty_points',
+                    ['balance', 'user_id'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_loyalty_points_balance_user_id', table_name='loyalty_points', if_exists=True)
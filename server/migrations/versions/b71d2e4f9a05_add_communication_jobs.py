@@ -0,0 +1,40 @@
+"""add communication_jobs table
+
+Revision ID: b71d2e4f9a05
+Revises: 8a3f5d0c6e12
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d2e4f9a05'
+down_revision = '8a3f5d0c6e12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table via db.create_all()
+    if sa.inspect(op.get_bind()).has_table('communication_jobs'):
+        return
+    op.create_table(
+        'communication_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('admin_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('channel', sa.String(length=50), nullable=True),
+        sa.Column('recipients', sa.String(length=20), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('total_recipients', sa.Integer(), nullable=True),
+        sa.Column('sent_count', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('communication_jobs')
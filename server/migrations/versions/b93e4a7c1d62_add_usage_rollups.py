@@ -0,0 +1,62 @@
+"""add usage rollup tables and usage_patterns (user_id, timestamp) index
+
+Revision ID: b93e4a7c1d62
+Revises: a6c2f8e0d357
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b93e4a7c1d62'
+down_revision = 'a6c2f8e0d357'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_usage_patterns_user_id_timestamp', 'usage_patterns',
+                    ['user_id', 'timestamp'], unique=False, if_not_exists=True)
+
+    # init_db() may already have created the tables via db.create_all()
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('usage_rollups'):
+        op.create_table(
+            'usage_rollups',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('granularity', sa.String(length=4), nullable=False),
+            sa.Column('bucket_start', sa.DateTime(), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('location', sa.String(length=100), nullable=False),
+            sa.Column('tier_id', sa.Integer(), nullable=False),
+            sa.Column('sessions', sa.Integer(), nullable=False),
+            sa.Column('data_used_mb', sa.Numeric(14, 2), nullable=False),
+            sa.Column('session_seconds', sa.BigInteger(), nullable=False),
+            sa.Column('p50_session', sa.Float(), nullable=True),
+            sa.Column('p95_session', sa.Float(), nullable=True),
+            sa.Column('histogram', sa.Text(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        op.create_index('uq_usage_rollups_bucket', 'usage_rollups',
+                        ['granularity', 'bucket_start', 'user_id', 'location', 'tier_id'], unique=True)
+        op.create_index('ix_usage_rollups_granularity_bucket_start', 'usage_rollups',
+                        ['granularity', 'bucket_start'])
+
+    if not inspector.has_table('usage_rollup_queue'):
+        op.create_table(
+            'usage_rollup_queue',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('bucket_start', sa.DateTime(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+        )
+
+
+def downgrade():
+    op.drop_table('usage_rollup_queue')
+    op.drop_index('ix_usage_rollups_granularity_bucket_start', table_name='usage_rollups')
+    op.drop_index('uq_usage_rollups_bucket', table_name='usage_rollups')
+    op.drop_table('usage_rollups')
+    op.drop_index('ix_usage_patterns_user_id_timestamp', table_name='usage_patterns', if_exists=True)
@@ -0,0 +1,35 @@
+"""add revoked_tokens table
+
+Revision ID: c4e9a1f3b2d7
+Revises: b71d2e4f9a05
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9a1f3b2d7'
+down_revision = 'b71d2e4f9a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table via db.create_all()
+    if sa.inspect(op.get_bind()).has_table('revoked_tokens'):
+        return
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('jti', sa.String(length=36), nullable=False, unique=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
@@ -0,0 +1,94 @@
+"""add payment_callbacks inbox and unique payments.transaction_reference
+
+Revision ID: c7d1f5a2e849
+Revises: b93e4a7c1d62
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d1f5a2e849'
+down_revision = 'b93e4a7c1d62'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    columns = [c['name'] for c in inspector.get_columns('payments')]
+    with op.batch_alter_table('payments') as batch:
+        if 'tier_id' not in columns:
+            batch.add_column(sa.Column('tier_id', sa.Integer(), nullable=True))
+            batch.create_foreign_key('fk_payments_tier_id', 'subscription_tiers', ['tier_id'], ['id'])
+        if 'subscription_id' not in columns:
+            batch.add_column(sa.Column('subscription_id', sa.Integer(), nullable=True))
+            batch.create_foreign_key('fk_payments_subscription_id', 'subscriptions', ['subscription_id'], ['id'])
+
+    # The earliest payment keeps each reference. Later ones get "<reference>#dup<id>"
+    # so the unique index can be built and the original stays visible for audit.
+    payments = sa.table('payments', sa.column('id', sa.Integer), sa.column('transaction_reference', sa.String))
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT id, transaction_reference FROM payments WHERE transaction_reference IS NOT NULL "
+        "AND id NOT IN (SELECT MIN(id) FROM payments WHERE transaction_reference IS NOT NULL "
+        "GROUP BY transaction_reference) ORDER BY id"
+    )).all()
+    if duplicates:
+        logger.warning("Renaming %d duplicate payments.transaction_reference values (payment ids %s)",
+                       len(duplicates), ', '.join(str(row.id) for row in duplicates))
+        op.get_bind().execute(
+            payments.update().where(payments.c.id == sa.bindparam('payment_id'))
+            .values(transaction_reference=sa.bindparam('renamed')),
+            [{'payment_id': row.id,
+              'renamed': row.transaction_reference[:100 - len(f'#dup{row.id}')] + f'#dup{row.id}'}
+             for row in duplicates]
+        )
+    op.create_index('uq_payments_transaction_reference', 'payments', ['transaction_reference'],
+                    unique=True, if_not_exists=True)
+    op.create_index('ix_payments_user_id', 'payments', ['user_id'], if_not_exists=True)
+
+    # init_db() may already have created the table via db.create_all()
+    if inspector.has_table('payment_callbacks'):
+        return
+    op.create_table(
+        'payment_callbacks',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('provider', sa.String(length=20), nullable=False),
+        sa.Column('transaction_reference', sa.String(length=100), nullable=False, unique=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('received_at', sa.DateTime(), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_payment_callbacks_status_id', 'payment_callbacks', ['status', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_payment_callbacks_status_id', table_name='payment_callbacks')
+    op.drop_table('payment_callbacks')
+    op.drop_index('ix_payments_user_id', table_name='payments', if_exists=True)
+    op.drop_index('uq_payments_transaction_reference', table_name='payments', if_exists=True)
+    # Columns created by db.create_all() have unnamed foreign keys, so only
+    # drop the named constraints upgrade() added
+    inspector = sa.inspect(op.get_bind())
+    foreign_keys = {fk['name'] for fk in inspector.get_foreign_keys('payments')}
+    columns = [c['name'] for c in inspector.get_columns('payments')]
+    with op.batch_alter_table('payments') as batch:
+        if 'fk_payments_subscription_id' in foreign_keys:
+            batch.drop_constraint('fk_payments_subscription_id', type_='foreignkey')
+        if 'subscription_id' in columns:
+            batch.drop_column('subscription_id')
+        if 'fk_payments_tier_id' in foreign_keys:
+            batch.drop_constraint('fk_payments_tier_id', type_='foreignkey')
+        if 'tier_id' in columns:
+            batch.drop_column('tier_id')
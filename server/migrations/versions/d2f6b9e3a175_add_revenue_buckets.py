@@ -0,0 +1,40 @@
+"""add revenue_buckets
+
+Revision ID: d2f6b9e3a175
+Revises: c7d1f5a2e849
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6b9e3a175'
+down_revision = 'c7d1f5a2e849'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table via db.create_all()
+    if sa.inspect(op.get_bind()).has_table('revenue_buckets'):
+        return
+    op.create_table(
+        'revenue_buckets',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('granularity', sa.String(length=5), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('tier_type', sa.String(length=20), nullable=False),
+        sa.Column('payment_method', sa.String(length=50), nullable=False),
+        sa.Column('amount', sa.Numeric(14, 2), nullable=False),
+        sa.Column('payments', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('uq_revenue_buckets_bucket', 'revenue_buckets',
+                    ['granularity', 'bucket_start', 'tier_type', 'payment_method'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_revenue_buckets_bucket', table_name='revenue_buckets')
+    op.drop_table('revenue_buckets')
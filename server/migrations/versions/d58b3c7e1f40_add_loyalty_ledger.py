@@ -0,0 +1,50 @@
+"""add loyalty_events ledger and snapshot high-water mark
+
+Revision ID: d58b3c7e1f40
+Revises: c4e9a1f3b2d7
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58b3c7e1f40'
+down_revision = 'c4e9a1f3b2d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # Existing loyalty_points rows become snapshots covering no events yet
+    columns = [c['name'] for c in inspector.get_columns('loyalty_points')]
+    if 'last_event_id' not in columns:
+        op.add_column('loyalty_points', sa.Column(
+            'last_event_id', sa.Integer(), nullable=False, server_default='0'
+        ))
+
+    # init_db() may already have created the table via db.create_all()
+    if inspector.has_table('loyalty_events'):
+        return
+    op.create_table(
+        'loyalty_events',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('reference', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_loyalty_events_user_id_id', 'loyalty_events', ['user_id', 'id'])
+    op.create_index('ix_loyalty_events_created_at', 'loyalty_events', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_loyalty_events_created_at', table_name='loyalty_events')
+    op.drop_index('ix_loyalty_events_user_id_id', table_name='loyalty_events')
+    op.drop_table('loyalty_events')
+    with op.batch_alter_table('loyalty_points') as batch_op:
+        batch_op.drop_column('last_event_id')
@@ -0,0 +1,37 @@
+"""add idempotency_keys table
+
+Revision ID: e2a7c9d4b618
+Revises: d58b3c7e1f40
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c9d4b618'
+down_revision = 'd58b3c7e1f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table via db.create_all()
+    if sa.inspect(op.get_bind()).has_table('idempotency_keys'):
+        return
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('key', sa.String(length=255), nullable=False, unique=True),
+        sa.Column('status_code', sa.Integer(), nullable=False),
+        sa.Column('response_body', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_idempotency_keys_expires_at', 'idempotency_keys', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_keys_expires_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
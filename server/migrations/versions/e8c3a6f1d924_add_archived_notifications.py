@@ -0,0 +1,39 @@
+"""add archived_notifications table
+
+Revision ID: e8c3a6f1d924
+Revises: d2f6b9e3a175
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c3a6f1d924'
+down_revision = 'd2f6b9e3a175'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # init_db() may already have created the table via db.create_all()
+    if sa.inspect(op.get_bind()).has_table('archived_notifications'):
+        return
+    op.create_table(
+        'archived_notifications',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('channel', sa.String(length=50), nullable=True),
+        sa.Column('type', sa.String(length=50), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_archived_notifications_user_id', 'archived_notifications', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_archived_notifications_user_id', table_name='archived_notifications')
+    op.drop_table('archived_notifications')
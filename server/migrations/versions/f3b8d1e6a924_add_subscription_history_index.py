@@ -0,0 +1,25 @@
+"""add (user_id, start_date) index for subscription history pages
+
+Revision ID: f3b8d1e6a924
+Revises: e2a7c9d4b618
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d1e6a924'
+down_revision = 'e2a7c9d4b618'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_subscriptions_user_id_start_date', 'subscriptions',
+                    ['user_id', 'start_date'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_subscriptions_user_id_start_date', table_name='subscriptions', if_exists=True)
@@ -0,0 +1,114 @@
+"""add usage_group_rollups table and usage_rollups (user_id, granularity, bucket_start) index
+
+Revision ID: f7a2d5c8e319
+Revises: e8c3a6f1d924
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import groupby
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a2d5c8e319'
+down_revision = 'e8c3a6f1d924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_usage_rollups_user_id_granularity_bucket_start', 'usage_rollups',
+                    ['user_id', 'granularity', 'bucket_start'], unique=False, if_not_exists=True)
+
+    # init_db() may already have created the table via db.create_all()
+    if not sa.inspect(op.get_bind()).has_table('usage_group_rollups'):
+        op.create_table(
+            'usage_group_rollups',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('granularity', sa.String(length=4), nullable=False),
+            sa.Column('bucket_start', sa.DateTime(), nullable=False),
+            sa.Column('location', sa.String(length=100), nullable=False),
+            sa.Column('tier_id', sa.Integer(), nullable=False),
+            sa.Column('sessions', sa.Integer(), nullable=False),
+            sa.Column('data_used_mb', sa.Numeric(14, 2), nullable=False),
+            sa.Column('session_seconds', sa.BigInteger(), nullable=False),
+            sa.Column('p50_session', sa.Float(), nullable=True),
+            sa.Column('p95_session', sa.Float(), nullable=True),
+            sa.Column('histogram', sa.Text(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        op.create_index('uq_usage_group_rollups_bucket', 'usage_group_rollups',
+                        ['granularity', 'bucket_start', 'location', 'tier_id'], unique=True)
+
+    _backfill()
+
+
+def _rollup_columns():
+    """Columns shared by usage_rollups and usage_group_rollups, key first."""
+    return [sa.column('granularity', sa.String), sa.column('bucket_start', sa.DateTime),
+            sa.column('location', sa.String), sa.column('tier_id', sa.Integer),
+            sa.column('sessions', sa.Integer), sa.column('data_used_mb', sa.Numeric(14, 2)),
+            sa.column('session_seconds', sa.BigInteger), sa.column('histogram', sa.Text)]
+
+
+def _backfill():
+    """Merge the existing per-user rollups into usage_group_rollups."""
+    bind = op.get_bind()
+    rollups = sa.table('usage_rollups', *_rollup_columns())
+    group_rollups = sa.table('usage_group_rollups', *_rollup_columns(),
+                             sa.column('p50_session', sa.Float), sa.column('p95_session', sa.Float),
+                             sa.column('updated_at', sa.DateTime))
+    bind.execute(group_rollups.delete())
+    rows = bind.execute(sa.select(rollups).order_by(*rollups.c[:4]))
+    now = datetime.now(timezone.utc)
+    batch = []
+    for key, group in groupby(rows, key=lambda row: tuple(row[:4])):
+        sessions, data_used_mb, session_seconds, counts = 0, Decimal('0'), 0, None
+        for row in group:
+            sessions += row.sessions
+            data_used_mb += row.data_used_mb or 0
+            session_seconds += row.session_seconds
+            bins = json.loads(row.histogram)
+            counts = bins if counts is None else [a + b for a, b in zip(counts, bins)]
+        batch.append({
+            'granularity': key[0], 'bucket_start': key[1], 'location': key[2], 'tier_id': key[3],
+            'sessions': sessions, 'data_used_mb': data_used_mb, 'session_seconds': session_seconds,
+            'p50_session': _histogram_percentile(counts, 0.5), 'p95_session': _histogram_percentile(counts, 0.95),
+            'histogram': json.dumps(counts), 'updated_at': now,
+        })
+        if len(batch) >= 5000:
+            bind.execute(group_rollups.insert(), batch)
+            batch = []
+    if batch:
+        bind.execute(group_rollups.insert(), batch)
+
+
+# Copy of usage_rollups.BIN_EDGES and histogram_percentile as of this revision
+BIN_EDGES = [30, 60, 120, 300, 600, 900, 1800, 2700, 3600, 5400, 7200,
+             10800, 14400, 21600, 28800, 43200, 86400]
+
+
+def _histogram_percentile(counts, q):
+    total = sum(counts)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= target:
+            low = BIN_EDGES[i - 1] if i else 0
+            high = BIN_EDGES[i] if i < len(BIN_EDGES) else low
+            return low + (high - low) * (target - seen) / count
+        seen += count
+    return float(BIN_EDGES[-1])
+
+
+def downgrade():
+    op.drop_index('uq_usage_group_rollups_bucket', table_name='usage_group_rollups')
+    op.drop_table('usage_group_rollups')
+    op.drop_index('ix_usage_rollups_user_id_granularity_bucket_start', table_name='usage_rollups', if_exists=True)
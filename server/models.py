@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
 from flask_bcrypt import Bcrypt
+from hashing import password_hasher
 
 db = SQLAlchemy()
 bcrypt=Bcrypt()
@@ -15,7 +16,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     email = db.Column(db.String(120), unique=True, nullable=False)
-    phone_number = db.Column(db.String(30))
+    phone_number = db.Column(db.String(30), index=True)
     password_hash = db.Column(db.String(128))
     role = db.Column(db.String(20), default='user')
     status = db.Column(db.String(20), default='active')
@@ -32,10 +33,10 @@ class User(db.Model):
     usage_patterns = db.relationship('UsagePattern', backref='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
 
     
 
@@ -66,6 +67,13 @@ class Subscription(db.Model):
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=utc_now)
 
+    __table_args__ = (
+        db.Index('ix_subscriptions_user_id_status', 'user_id', 'status'),
+        db.Index('ix_subscriptions_tier_id_status', 'tier_id', 'status'),
+        db.Index('ix_subscriptions_status_end_date', 'status', 'end_date'),
+        db.Index('ix_subscriptions_user_id_start_date', 'user_id', 'start_date'),
+    )
+
 class Payment(db.Model):
     __tablename__ = 'payments'
 
@@ -75,8 +83,15 @@ class Payment(db.Model):
     payment_method = db.Column(db.String(50)) #eg mpesa
     transaction_reference = db.Column(db.String(100))
     status = db.Column(db.String(20), default='success') #eg success or failed
+    tier_id = db.Column(db.Integer, db.ForeignKey('subscription_tiers.id'))
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscriptions.id'))
     created_at = db.Column(db.DateTime, default=utc_now)
 
+    __table_args__ = (
+        db.Index('uq_payments_transaction_reference', 'transaction_reference', unique=True),
+        db.Index('ix_payments_user_id', 'user_id'),
+    )
+
 
 class Feedback(db.Model):
     __tablename__ = 'feedbacks'
@@ -93,6 +108,11 @@ class Feedback(db.Model):
     created_at = db.Column(db.DateTime, default=utc_now)
     updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
 
+    __table_args__ = (
+        db.Index('ix_feedbacks_user_id', 'user_id'),
+        db.Index('ix_feedbacks_subscription_type', 'subscription_type'),
+    )
+
 class Complaint(db.Model):
 
     __tablename__ = 'complaints'
@@ -116,6 +136,29 @@ class LoyaltyPoint(db.Model):
     points_redeemed = db.Column(db.Integer, default=0)
     balance = db.Column(db.Integer, default=0)
     last_updated = db.Column(db.DateTime, default=utc_now)
+    # Snapshot of the loyalty ledger: totals include every event up to this id
+    last_event_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('uq_loyalty_points_user_id', 'user_id', unique=True),
+        db.Index('ix_loyalty_points_balance_user_id', 'balance', 'user_id'),
+    )
+
+# Append-only loyalty ledger; delta is +points on earn, -points on redeem
+class LoyaltyEvent(db.Model):
+    __tablename__ = 'loyalty_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'earn' or 'redeem'
+    delta = db.Column(db.Integer, nullable=False)
+    reference = db.Column(db.String(100))  # e.g. 'subscription:42'
+    created_at = db.Column(db.DateTime, default=utc_now)
+
+    __table_args__ = (
+        db.Index('ix_loyalty_events_user_id_id', 'user_id', 'id'),
+        db.Index('ix_loyalty_events_created_at', 'created_at'),
+    )
 
 class Redemption(db.Model):
     __tablename__ = 'redemptions'
@@ -138,6 +181,24 @@ class Notification(db.Model):
     status = db.Column(db.String(20), default='unread')
     created_at = db.Column(db.DateTime, default=utc_now)
 
+    __table_args__ = (
+        db.Index('ix_notifications_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_notifications_user_id_status', 'user_id', 'status'),
+    )
+
+# Old read notifications moved out of notifications (see retention.py); id is the original id
+class ArchivedNotification(db.Model):
+    __tablename__ = 'archived_notifications'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    message = db.Column(db.Text)
+    channel = db.Column(db.String(50))
+    type = db.Column(db.String(50))
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=utc_now)
+
 class UsagePattern(db.Model):
     __tablename__ = 'usage_patterns'
 
@@ -149,6 +210,10 @@ class UsagePattern(db.Model):
     location = db.Column(db.String(100))
     timestamp = db.Column(db.DateTime, default=utc_now)
 
+    __table_args__ = (
+        db.Index('ix_usage_patterns_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
 class AdminActionLog(db.Model):
     __tablename__ = 'admin_action_logs'
 
@@ -158,5 +223,154 @@ class AdminActionLog(db.Model):
     target_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     details = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=utc_now)
-    
-    
+
+
+# Per-tier subscription counters, kept current incrementally (see rollups.py)
+class TierSubscriptionCount(db.Model):
+    __tablename__ = 'tier_subscription_counts'
+
+    tier_id = db.Column(db.Integer, db.ForeignKey('subscription_tiers.id'), primary_key=True)
+    active_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+
+# Background mass-communication job (see fanout.py)
+class CommunicationJob(db.Model):
+    __tablename__ = 'communication_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    message = db.Column(db.Text)
+    channel = db.Column(db.String(50))
+    recipients = db.Column(db.String(20))  # all, active, or specific
+    specific_users = db.Column(db.Text)  # JSON list of user ids when recipients is specific
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    total_recipients = db.Column(db.Integer)
+    sent_count = db.Column(db.Integer, default=0)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # resume point
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # also the claim token
+    heartbeat_at = db.Column(db.DateTime)  # last claim or chunk; stale jobs are resumed
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=utc_now)
+    finished_at = db.Column(db.DateTime)
+
+
+# Revoked JWTs (see auth.py); rows can be pruned once expires_at has passed
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=utc_now)
+
+
+# Stored responses for retried requests carrying an Idempotency-Key header
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), unique=True, nullable=False)  # endpoint:user_id:header value
+    status_code = db.Column(db.Integer, nullable=False)
+    response_body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=utc_now)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+# Usage aggregated per hour or day bucket, user, location and tier (see usage_rollups.py)
+class UsageRollup(db.Model):
+    __tablename__ = 'usage_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(4), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    location = db.Column(db.String(100), nullable=False, default='')  # '' when unknown
+    tier_id = db.Column(db.Integer, nullable=False, default=0)  # 0 when no subscription was active
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    data_used_mb = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    session_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    p50_session = db.Column(db.Float)
+    p95_session = db.Column(db.Float)
+    histogram = db.Column(db.Text, nullable=False)  # JSON session-length bin counts
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        db.Index('uq_usage_rollups_bucket', 'granularity', 'bucket_start', 'user_id', 'location', 'tier_id',
+                 unique=True),
+        db.Index('ix_usage_rollups_granularity_bucket_start', 'granularity', 'bucket_start'),
+        db.Index('ix_usage_rollups_user_id_granularity_bucket_start', 'user_id', 'granularity', 'bucket_start'),
+    )
+
+
+# usage_rollups merged across users, so location/tier analytics don't scale with user count
+class UsageGroupRollup(db.Model):
+    __tablename__ = 'usage_group_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(4), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    location = db.Column(db.String(100), nullable=False, default='')
+    tier_id = db.Column(db.Integer, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    data_used_mb = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    session_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    p50_session = db.Column(db.Float)  # estimated from the merged histogram
+    p95_session = db.Column(db.Float)
+    histogram = db.Column(db.Text, nullable=False)  # JSON session-length bin counts
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        db.Index('uq_usage_group_rollups_bucket', 'granularity', 'bucket_start', 'location', 'tier_id',
+                 unique=True),
+    )
+
+
+# (user, hour) buckets with new usage rows, waiting for the rollup worker
+class UsageRollupQueue(db.Model):
+    __tablename__ = 'usage_rollup_queue'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=utc_now)
+
+
+# Raw payment callbacks, acknowledged on receipt and processed by payments.py
+class PaymentCallback(db.Model):
+    __tablename__ = 'payment_callbacks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False, default='mpesa')
+    transaction_reference = db.Column(db.String(100), unique=True, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, processed, duplicate, unmatched, underpaid, failed
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    received_at = db.Column(db.DateTime, default=utc_now)
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_payment_callbacks_status_id', 'status', 'id'),
+    )
+
+
+# Successful payment totals per day or month, tier type and method (see revenue.py)
+class RevenueBucket(db.Model):
+    __tablename__ = 'revenue_buckets'
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(5), nullable=False)  # 'day' or 'month'
+    bucket_start = db.Column(db.DateTime, nullable=False)  # local midnight, see REVENUE_UTC_OFFSET_HOURS
+    tier_type = db.Column(db.String(20), nullable=False, default='')  # '' when the tier is unknown
+    payment_method = db.Column(db.String(50), nullable=False, default='')
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    payments = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        db.Index('uq_revenue_buckets_bucket', 'granularity', 'bucket_start', 'tier_type', 'payment_method',
+                 unique=True),
+    )
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Fake M-Pesa C2B confirmation callbacks for POST /payments/mpesa/callback.
+
+Simulates a month-end burst: --payments distinct transactions from random
+customers for random tiers, each delivered --resend times (M-Pesa retries
+callbacks it thinks failed), fired concurrently. A share of payments can
+be underpaid (--underpaid) or come from unknown numbers (--unknown).
+
+In-process mode (the default) uses a throwaway SQLite database, waits for
+the payment worker to drain, and checks the outcome:
+
+    every distinct TransID -> exactly one payment_callbacks row
+    matched, fully paid    -> exactly one Payment and one new subscription
+    no TransID             -> more than one Payment
+    revenue buckets        -> add up to the payments table
+
+    python mpesa_fake.py --payments 500 --resend 3 --threads 32
+
+Or fire at a running server (checks are then up to you):
+
+    python mpesa_fake.py --url http://localhost:5000 --token $MPESA_CALLBACK_TOKEN \
+        --phones 0712345678,0722000000 --tiers 1,2
+"""
+import argparse
+import json
+import random
+import string
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from script_support import script_env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=300)
+    parser.add_argument('--resend', type=int, default=2, help='Deliveries per transaction')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--underpaid', type=float, default=0.05)
+    parser.add_argument('--unknown', type=float, default=0.05)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--url', help='Post to this server instead of an in-process app')
+    parser.add_argument('--token', help='MPESA_CALLBACK_TOKEN of the server')
+    parser.add_argument('--phones', help='With --url: comma-separated customer phone numbers')
+    parser.add_argument('--tiers', help='With --url: comma-separated tier ids (price read as 10 KSH)')
+    return parser.parse_args()
+
+
+def trans_id():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+
+def confirmation(phone, tier_id, amount):
+    """A C2B confirmation body as Safaricom's Daraja API sends it."""
+    msisdn = '254' + phone[1:] if phone.startswith('0') else phone
+    return {
+        'TransactionType': 'Pay Bill',
+        'TransID': trans_id(),
+        'TransTime': datetime.now().strftime('%Y%m%d%H%M%S'),
+        'TransAmount': f"{amount:.2f}",
+        'BusinessShortCode': '600000',
+        'BillRefNumber': str(tier_id),
+        'InvoiceNumber': '',
+        'OrgAccountBalance': '',
+        'ThirdPartyTransID': '',
+        'MSISDN': msisdn,
+        'FirstName': 'Test',
+    }
+
+
+def build_callbacks(args, phones, tiers):
+    """Returns (deliveries, expectations) where expectations maps TransID -> outcome."""
+    expected = {}
+    deliveries = []
+    for _ in range(args.payments):
+        tier_id, price = random.choice(tiers)
+        phone = random.choice(phones)
+        outcome = 'processed'
+        if random.random() < args.unknown:
+            phone, outcome = '07' + ''.join(random.choices(string.digits, k=8)), 'unmatched'
+        amount = price
+        if outcome == 'processed' and random.random() < args.underpaid:
+            amount, outcome = price / 2, 'underpaid'
+        body = confirmation(phone, tier_id, amount)
+        expected[body['TransID']] = outcome
+        deliveries += [json.dumps(body)] * args.resend
+    random.shuffle(deliveries)
+    return deliveries, expected
+
+
+def in_process(args):
+    token = 'fake-callback-token'
+    script_env('mpesa_fake.db', PAYMENT_WORKER_ENABLED='true', PAYMENT_WORKER_POLL_SECONDS=0.5,
+               MPESA_CALLBACK_TOKEN=token)
+
+    from app import app
+    from models import db, User, SubscriptionTier
+
+    with app.app_context():
+        tiers = [SubscriptionTier(name=f'Fake {p} KSH', price=p, duration_days=1, tier_type=t)
+                 for p, t in [(10, 'hotspot'), (50, 'hotspot'), (1500, 'home_internet')]]
+        db.session.add_all(tiers)
+        phones = [f"07{i:08d}" for i in range(args.users)]
+        db.session.execute(User.__table__.insert(), [
+            dict(name=f'payer {i}', email=f'payer-{i}@example.com', phone_number=phone, role='user', status='active')
+            for i, phone in enumerate(phones)
+        ])
+        db.session.commit()
+        tiers = [(t.id, float(t.price)) for t in tiers]
+
+    client = app.test_client()
+
+    def post(body):
+        return client.post(f'/payments/mpesa/callback?token={token}', data=body,
+                           content_type='application/json').status_code
+
+    return app, phones, tiers, post
+
+
+def remote(args):
+    phones = args.phones.split(',') if args.phones else ['0700000000']
+    tiers = [(int(t), 10.0) for t in (args.tiers or '1').split(',')]
+    url = f"{args.url.rstrip('/')}/payments/mpesa/callback" + (f"?token={args.token}" if args.token else '')
+
+    def post(body):
+        req = urllib.request.Request(url, data=body.encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req) as r:
+            return r.status
+
+    return None, phones, tiers, post
+
+
+def verify(app, expected):
+    from sqlalchemy import func
+    from models import db, Payment, PaymentCallback, Subscription, RevenueBucket
+
+    with app.app_context():
+        deadline = time.monotonic() + 60
+        while PaymentCallback.query.filter(PaymentCallback.status.in_(['pending', 'processing'])).count():
+            if time.monotonic() > deadline:
+                return ['payment worker did not drain the queue within 60s']
+            time.sleep(0.2)
+
+        failures = []
+        statuses = dict(db.session.query(PaymentCallback.transaction_reference, PaymentCallback.status))
+        if set(statuses) != set(expected):
+            failures.append(f"{len(statuses)} callbacks stored for {len(expected)} transactions")
+        wrong = {ref: (statuses.get(ref), want) for ref, want in expected.items() if statuses.get(ref) != want}
+        for ref, (got, want) in list(wrong.items())[:10]:
+            failures.append(f"{ref}: status {got}, expected {want}")
+
+        duplicates = db.session.query(Payment.transaction_reference).group_by(Payment.transaction_reference) \
+            .having(func.count() > 1).count()
+        if duplicates:
+            failures.append(f"{duplicates} transactions recorded as more than one payment")
+        payable = sum(1 for o in expected.values() if o in ('processed', 'underpaid'))
+        if Payment.query.count() != payable:
+            failures.append(f"{Payment.query.count()} payments, expected {payable}")
+        activated = Subscription.query.count()
+        if activated != sum(1 for o in expected.values() if o == 'processed'):
+            failures.append(f"{activated} subscriptions created, expected one per fully paid transaction")
+        paid = db.session.query(func.coalesce(func.sum(Payment.amount), 0)).scalar()
+        for granularity in ('day', 'month'):
+            bucketed = db.session.query(func.coalesce(func.sum(RevenueBucket.amount), 0)) \
+                .filter(RevenueBucket.granularity == granularity).scalar()
+            if bucketed != paid:
+                failures.append(f"{granularity} revenue buckets hold {bucketed}, payments total {paid}")
+        print(f"callback statuses: {dict(sorted(((s, list(statuses.values()).count(s)) for s in set(statuses.values()))))}")
+        return failures
+
+
+def main():
+    args = parse_args()
+    app, phones, tiers, post = remote(args) if args.url else in_process(args)
+    deliveries, expected = build_callbacks(args, phones, tiers)
+
+    latencies = []
+
+    def deliver(body):
+        start = time.perf_counter()
+        status = post(body)
+        latencies.append(time.perf_counter() - start)
+        return status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        statuses = list(pool.map(deliver, deliveries))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    rejected = sum(1 for s in statuses if s != 200)
+    print(f"{len(deliveries)} callbacks for {len(expected)} transactions in {elapsed:.2f}s "
+          f"({len(deliveries) / elapsed:,.0f}/s), {rejected} not acknowledged")
+    print(f"ack latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+    if app is None:
+        return
+    failures = verify(app, expected)
+    if rejected:
+        failures.append(f"{rejected} callbacks were not acknowledged with 200")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: every transaction recorded exactly once")
+
+
+if __name__ == '__main__':
+    main()
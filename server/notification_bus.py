@@ -0,0 +1,72 @@
+import threading
+from collections import defaultdict
+
+
+class NotificationBus:
+    """In-process pub/sub that wakes notification streams when new rows land.
+
+    Publishers bump a per-user counter (or a broadcast counter for mass
+    sends) after committing; stream handlers block on the condition until
+    their token changes, so an idle client costs no database work. Streams
+    still re-check the database every NOTIFICATION_STREAM_POLL_SECONDS to
+    pick up notifications committed by other gunicorn workers.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = defaultdict(int)
+        self._broadcast = 0
+
+    def token(self, user_id):
+        return (self._versions.get(user_id, 0), self._broadcast)
+
+    def publish(self, *user_ids):
+        with self._condition:
+            for user_id in user_ids:
+                self._versions[user_id] += 1
+            self._condition.notify_all()
+
+    def publish_all(self):
+        with self._condition:
+            self._broadcast += 1
+            self._condition.notify_all()
+
+    def wait(self, user_id, token, timeout):
+        """Block until something is published for user_id or timeout passes.
+
+        Returns True if woken by a publish.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.token(user_id) != token, timeout)
+
+
+class StreamSlots:
+    """Counts open notification streams in this worker.
+
+    Each stream holds a gunicorn thread for as long as it is open, so
+    streams are capped below the thread count; requests over the cap are
+    told to poll instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def acquire(self, limit):
+        """Take a slot if fewer than limit are open. Returns False if not."""
+        with self._lock:
+            if self._open >= limit:
+                return False
+            self._open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open -= 1
+
+    def open(self):
+        return self._open
+
+
+notification_bus = NotificationBus()
+stream_slots = StreamSlots()
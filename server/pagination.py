@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from flask import request, current_app, jsonify
+
+
+def parse_limit():
+    """Read ?limit= from the query string, clamped to MAX_PAGE_SIZE.
+
+    Returns None when no limit was requested so list endpoints keep
+    returning the full result for existing clients.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        return None
+    return max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+
+
+def page_response(rows, limit, serialize, cursor_for):
+    """Build a JSON list response for a keyset page.
+
+    `rows` must have been fetched with `limit + 1` so we can tell whether
+    another page exists without a COUNT query. The cursor for the next page
+    is returned in the X-Next-Cursor header so the body stays a plain list.
+    """
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+
+    response = jsonify([serialize(r) for r in rows])
+    if has_more:
+        response.headers['X-Next-Cursor'] = str(cursor_for(rows[-1]))
+    return response
+
+
+def encode_cursor(timestamp, row_id):
+    """Cursor for keyset pagination on a (timestamp, id) ordering."""
+    return f"{timestamp.isoformat()}|{row_id}"
+
+
+def decode_cursor(value):
+    """Inverse of encode_cursor. Raises ValueError on a malformed cursor."""
+    timestamp, _, row_id = value.rpartition('|')
+    return datetime.fromisoformat(timestamp), int(row_id)
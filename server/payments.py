@@ -0,0 +1,282 @@
+"""M-Pesa payment callbacks.
+
+The callback endpoint only stores the raw C2B confirmation in
+payment_callbacks (one INSERT, ignored if the TransID was seen before)
+and acknowledges straight away, so a month-end burst never holds a
+request worker for longer than that insert. A background worker claims
+pending callbacks and, per callback and in one transaction, records the
+Payment and activates the subscription it pays for.
+
+Duplicates are stopped twice: at the door by the unique TransID on
+payment_callbacks, and for good by the unique transaction_reference on
+payments.
+
+The payer is matched on phone number (MSISDN) and the tier on the
+account number (BillRefNumber), which customers enter as the tier id.
+"""
+import json
+import re
+import threading
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app
+from sqlalchemy import select, or_
+from sqlalchemy.exc import IntegrityError
+
+from db_helpers import insert_ignore, utc_naive_now
+from models import db, User, SubscriptionTier, Subscription, Payment, PaymentCallback, Notification, utc_now
+from expiry import expiry_scheduler, expire_active_of_type
+from notification_bus import notification_bus
+import loyalty
+import revenue
+import rollups
+
+callbacks = PaymentCallback.__table__
+users = User.__table__
+notifications = Notification.__table__
+
+MAX_ATTEMPTS = 3
+
+
+def enqueue(reference, payload, provider='mpesa'):
+    """Store a raw callback for the worker. Returns False if it was a duplicate."""
+    values = dict(provider=provider, transaction_reference=reference, payload=payload,
+                  status='pending', attempts=0, received_at=utc_naive_now())
+    inserted = insert_ignore(callbacks, values, ['transaction_reference'])
+    db.session.commit()
+    return inserted
+
+
+def phone_variants(msisdn):
+    """Forms a Kenyan number may be stored in: 2547..., +2547..., 07..."""
+    digits = re.sub(r'\D', '', str(msisdn or ''))
+    if not digits:
+        return []
+    variants = {digits, '+' + digits}
+    if digits.startswith('254'):
+        variants.add('0' + digits[3:])
+    elif digits.startswith('0'):
+        variants.update({'254' + digits[1:], '+254' + digits[1:]})
+    return sorted(variants)
+
+
+def start_subscription(user_id, tier, start_date):
+    """Replace the user's active subscription of this tier type with a new
+    one and award purchase points. Runs in the caller's transaction.
+    Returns the new Subscription."""
+    expire_active_of_type(user_id, tier.tier_type, start_date)
+    subscription = Subscription(
+        user_id=user_id,
+        tier_id=tier.id,
+        start_date=start_date,
+        end_date=start_date + timedelta(hours=tier.duration_days),  # duration_days is actually hours
+        status='active'
+    )
+    db.session.add(subscription)
+    db.session.flush()
+    rollups.record_subscription_started(tier.id)
+    loyalty.award_points(user_id, int(tier.price * 10), reference=f"subscription:{subscription.id}")
+    return subscription
+
+
+def apply_callback(callback):
+    """Turn one claimed callback into a Payment (and subscription).
+
+    Returns (status, error, subscription). Raises IntegrityError if the
+    transaction was already recorded as a payment.
+    """
+    data = json.loads(callback.payload)
+    try:
+        amount = Decimal(str(data.get('TransAmount')))
+    except InvalidOperation:
+        return 'failed', 'invalid TransAmount', None
+
+    account = str(data.get('BillRefNumber') or '').strip()
+    tier = SubscriptionTier.query.get(int(account)) if account.isdigit() else None
+    variants = phone_variants(data.get('MSISDN'))
+    user_id = db.session.execute(
+        select(users.c.id).where(users.c.phone_number.in_(variants)).order_by(users.c.id).limit(1)
+    ).scalar() if variants else None
+    if user_id is None or tier is None:
+        return 'unmatched', 'no user for MSISDN' if user_id is None else 'no tier for BillRefNumber', None
+
+    paid_at = utc_naive_now()
+    payment = Payment(
+        user_id=user_id,
+        amount=amount,
+        payment_method='mpesa',
+        transaction_reference=callback.transaction_reference,
+        status='success',
+        tier_id=tier.id,
+        created_at=paid_at
+    )
+    db.session.add(payment)
+    db.session.flush()  # IntegrityError here means the payment already exists
+    revenue.record_payment(amount, tier.tier_type, 'mpesa', paid_at)
+
+    if amount < tier.price:
+        return 'underpaid', f"paid {amount}, {tier.name} costs {tier.price}", None
+
+    subscription = start_subscription(user_id, tier, utc_now())
+    payment.subscription_id = subscription.id
+    db.session.execute(notifications.insert().values(
+        user_id=user_id,
+        message=f'Payment of KSH {amount} received. Your {tier.name} subscription is active.',
+        channel='notification',
+        type='payment',
+        status='unread',
+        created_at=utc_naive_now()
+    ))
+    return 'processed', None, subscription
+
+
+def _finish(callback_id, status, error=None):
+    db.session.execute(callbacks.update().where(callbacks.c.id == callback_id).values(
+        status=status, error=error, processed_at=utc_naive_now()
+    ))
+
+
+def _already_recorded(reference):
+    """True if a payment with this transaction reference is committed."""
+    return db.session.execute(
+        select(Payment.id).where(Payment.transaction_reference == reference).limit(1)
+    ).first() is not None
+
+
+def _retry_later(callback, error):
+    """Leave the callback for a later pass, up to MAX_ATTEMPTS claims."""
+    status = 'failed' if callback.attempts >= MAX_ATTEMPTS else 'pending'
+    db.session.execute(callbacks.update().where(callbacks.c.id == callback.id).values(
+        status=status, error=str(error)
+    ))
+    db.session.commit()
+
+
+def process_callback(callback_id):
+    """Process one claimed callback in its own transaction; returns its final status."""
+    callback = db.session.execute(callbacks.select().where(callbacks.c.id == callback_id)).one()
+    scheduled = None
+    try:
+        status, error, subscription = apply_callback(callback)
+        if subscription is not None:
+            scheduled = (subscription.id, subscription.user_id, subscription.end_date)
+        _finish(callback_id, status, error)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        # Only the unique payments.transaction_reference makes this a
+        # duplicate; any other constraint failure must not drop a payment
+        if not _already_recorded(callback.transaction_reference):
+            _retry_later(callback, e)
+            raise
+        status = 'duplicate'
+        _finish(callback_id, status, 'transaction_reference already recorded')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _retry_later(callback, e)
+        raise
+
+    if scheduled is not None:
+        expiry_scheduler.schedule(*scheduled)
+        notification_bus.publish(scheduled[1])
+    return status
+
+
+def process_pending(batch_size=100, claim_timeout=300):
+    """Claim and process pending callbacks until none are left.
+
+    A callback is claimed with a conditional UPDATE, so several workers can
+    drain the table side by side; claims older than claim_timeout (a worker
+    died mid-callback) are taken over. Returns {status: count}.
+    """
+    counts = {}
+    while True:
+        stale = utc_naive_now() - timedelta(seconds=claim_timeout)
+        claimable = or_(
+            callbacks.c.status == 'pending',
+            (callbacks.c.status == 'processing') & (callbacks.c.claimed_at < stale)
+        )
+        ids = db.session.execute(
+            select(callbacks.c.id).where(claimable).order_by(callbacks.c.id).limit(batch_size)
+        ).scalars().all()
+        db.session.commit()
+        if not ids:
+            return counts
+
+        claimed_any = False
+        for callback_id in ids:
+            claimed = db.session.execute(
+                callbacks.update().where(callbacks.c.id == callback_id, claimable).values(
+                    status='processing', claimed_at=utc_naive_now(), attempts=callbacks.c.attempts + 1
+                )
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                continue
+            claimed_any = True
+            try:
+                status = process_callback(callback_id)
+            except Exception:
+                current_app.logger.exception('Payment callback %s failed', callback_id)
+                status = 'error'
+            counts[status] = counts.get(status, 0) + 1
+        if not claimed_any:
+            return counts
+
+
+class PaymentWorker:
+    """Processes payment callbacks in a background thread.
+
+    The callback endpoint wakes it immediately; it also polls every
+    PAYMENT_WORKER_POLL_SECONDS to pick up callbacks received by other
+    gunicorn workers or left over from a restart.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['payment_worker'] = self
+
+        @app.cli.command('process-payments')
+        def process_payments_command():
+            """Process pending payment callbacks."""
+            counts = self.drain()
+            print(f"Processed payment callbacks: {counts or 'none pending'}")
+
+        if app.config['PAYMENT_WORKER_ENABLED']:
+            self._thread = threading.Thread(target=self._run, name='payment-worker', daemon=True)
+            self._thread.start()
+
+    def drain(self):
+        return process_pending(self.app.config['PAYMENT_BATCH_SIZE'],
+                               self.app.config['PAYMENT_CLAIM_TIMEOUT_SECONDS'])
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        poll = self.app.config['PAYMENT_WORKER_POLL_SECONDS']
+        while not self._stop.is_set():
+            self._wake.wait(poll)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.drain()
+            except Exception:
+                self.app.logger.exception('Payment callback processing failed')
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+payment_worker = PaymentWorker()
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import click
+from sqlalchemy import literal, select
+
+from db_helpers import utc_naive_now
+from models import db, Notification, ArchivedNotification
+
+notifications = Notification.__table__
+archived_notifications = ArchivedNotification.__table__
+
+COLUMNS = ['id', 'user_id', 'message', 'channel', 'type', 'status', 'created_at']
+
+
+def archive_notifications(app, days=None, batch_size=None):
+    """Move read notifications older than `days` into archived_notifications.
+
+    Rows are copied and deleted in id-ordered batches, each batch in its own
+    transaction, so the hot table is never locked for long. The copy and
+    the delete commit together, so a crash loses nothing and archives
+    nothing twice. The archive lives in the database because the app's
+    disk (Render) doesn't survive a deploy.
+
+    Returns the number of rows archived.
+    """
+    days = app.config['NOTIFICATION_RETENTION_DAYS'] if days is None else days
+    batch_size = batch_size or app.config['NOTIFICATION_ARCHIVE_BATCH_SIZE']
+    now = utc_naive_now()
+    cutoff = now - timedelta(days=days)
+
+    archived = 0
+    last_id = 0
+    while True:
+        ids = db.session.execute(
+            select(notifications.c.id).where(
+                notifications.c.status == 'read',
+                notifications.c.created_at < cutoff,
+                notifications.c.id > last_id
+            ).order_by(notifications.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        archived_at = literal(now, archived_notifications.c.archived_at.type)
+        db.session.execute(archived_notifications.insert().from_select(
+            COLUMNS + ['archived_at'],
+            select(*[notifications.c[name] for name in COLUMNS], archived_at).where(notifications.c.id.in_(ids))
+        ))
+        db.session.execute(notifications.delete().where(notifications.c.id.in_(ids)))
+        db.session.commit()
+
+        archived += len(ids)
+        last_id = ids[-1]
+
+    return archived
+
+
+def init_app(app):
+    @app.cli.command('archive-notifications')
+    @click.option('--days', type=int, default=None, help='Archive read notifications older than this.')
+    @click.option('--batch-size', type=int, default=None)
+    def archive_notifications_command(days, batch_size):
+        """Move old read notifications out of the notifications table."""
+        archived = archive_notifications(app, days, batch_size)
+        if archived:
+            print(f"Archived {archived} notifications to archived_notifications")
+        else:
+            print("No notifications to archive")
@@ -0,0 +1,173 @@
+"""Revenue buckets.
+
+Every successful payment adds its amount to a day bucket and a month
+bucket for its tier type and payment method, in the same transaction as
+the payment itself, so the revenue endpoint only ever sums buckets and
+never scans payments. Days and months follow the business calendar in
+REVENUE_UTC_OFFSET_HOURS rather than UTC.
+
+`flask rebuild-revenue` recomputes buckets from historical payments in
+id-ordered batches.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import click
+from flask import current_app
+from sqlalchemy import select, func
+
+from db_helpers import upsert_add
+from models import db, Payment, SubscriptionTier, RevenueBucket, utc_now
+
+buckets = RevenueBucket.__table__
+payments = Payment.__table__
+tiers = SubscriptionTier.__table__
+
+GRANULARITIES = ('day', 'month')
+DIMENSIONS = ('tier_type', 'payment_method')
+
+
+def _offset():
+    return timedelta(hours=current_app.config['REVENUE_UTC_OFFSET_HOURS'])
+
+
+def local_day(ts):
+    """Local business day (as naive midnight) of a naive-UTC timestamp."""
+    local = ts + _offset()
+    return datetime(local.year, local.month, local.day)
+
+
+def month_of(day):
+    return datetime(day.year, day.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _add(granularity, bucket_start, tier_type, payment_method, amount, count):
+    """Add to one bucket, creating it on first use. Runs in the caller's transaction."""
+    upsert_add(
+        buckets,
+        dict(granularity=granularity, bucket_start=bucket_start,
+             tier_type=tier_type or '', payment_method=payment_method or ''),
+        dict(amount=amount, payments=count),
+        dict(updated_at=utc_now())
+    )
+
+
+def record_payment(amount, tier_type, payment_method, created_at):
+    """Count a successful payment in its day and month buckets."""
+    day = local_day(created_at)
+    _add('day', day, tier_type, payment_method, amount, 1)
+    _add('month', month_of(day), tier_type, payment_method, amount, 1)
+
+
+def series(granularity, start, end, group_by=(), tier_type=None, payment_method=None):
+    """Revenue per bucket in [start, end), summed over the dimensions not in group_by.
+
+    start and end are local dates; for monthly series they are widened to
+    whole months.
+    """
+    if granularity == 'month':
+        start = month_of(start)
+        end = end if end == month_of(end) else next_month(end)
+    columns = [buckets.c.bucket_start] + [buckets.c[d] for d in group_by]
+    stmt = select(
+        *columns,
+        func.sum(buckets.c.amount).label('amount'),
+        func.sum(buckets.c.payments).label('payments')
+    ).where(
+        buckets.c.granularity == granularity,
+        buckets.c.bucket_start >= start,
+        buckets.c.bucket_start < end
+    ).group_by(*columns).order_by(*columns)
+    if tier_type is not None:
+        stmt = stmt.where(buckets.c.tier_type == tier_type)
+    if payment_method is not None:
+        stmt = stmt.where(buckets.c.payment_method == payment_method)
+    return db.session.execute(stmt).all()
+
+
+def total(start, end, tier_type=None, payment_method=None):
+    """(amount, payments) for local dates [start, end), reading month buckets
+    for the whole months inside the range and day buckets for the ragged
+    edges."""
+    first_month = month_of(start) if start == month_of(start) else next_month(start)
+    last_month = month_of(end)
+    if first_month >= last_month:
+        spans = [('day', start, end)]
+    else:
+        spans = [('day', start, first_month), ('month', first_month, last_month), ('day', last_month, end)]
+
+    amount, count = Decimal('0'), 0
+    for granularity, span_start, span_end in spans:
+        if span_start >= span_end:
+            continue
+        for row in series(granularity, span_start, span_end, tier_type=tier_type, payment_method=payment_method):
+            amount += row.amount or 0
+            count += row.payments or 0
+    return amount, count
+
+
+def rebuild(start=None, end=None, batch_size=5000):
+    """Recompute buckets from successful payments, optionally for local dates
+    [start, end) widened to whole months. Returns the number of payments read.
+
+    Buckets are cleared first, then payments are read in id-ordered batches
+    and each batch's totals are added and committed. Payments recorded
+    while a rebuild runs can be counted twice or missed, so run it while
+    payment callbacks are paused, then compare against a second run.
+    """
+    offset = _offset()
+    clear = buckets.delete()
+    window = []
+    if start is not None:
+        start = month_of(start)
+        clear = clear.where(buckets.c.bucket_start >= start)
+        window.append(payments.c.created_at >= start - offset)
+    if end is not None:
+        end = end if end == month_of(end) else next_month(end)
+        clear = clear.where(buckets.c.bucket_start < end)
+        window.append(payments.c.created_at < end - offset)
+    db.session.execute(clear)
+    db.session.commit()
+
+    read = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(payments.c.id, payments.c.amount, payments.c.payment_method, payments.c.created_at,
+                   tiers.c.tier_type)
+            .outerjoin(tiers, tiers.c.id == payments.c.tier_id)
+            .where(payments.c.status == 'success', payments.c.id > last_id, *window)
+            .order_by(payments.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return read
+
+        totals = {}
+        for row in rows:
+            if row.created_at is None:
+                continue
+            day = local_day(row.created_at)
+            for key in (('day', day), ('month', month_of(day))):
+                key += (row.tier_type or '', row.payment_method or '')
+                amount, count = totals.get(key, (Decimal('0'), 0))
+                totals[key] = (amount + (row.amount or 0), count + 1)
+        for (granularity, bucket_start, tier_type, method), (amount, count) in totals.items():
+            _add(granularity, bucket_start, tier_type, method, amount, count)
+        db.session.commit()
+        read += len(rows)
+        last_id = rows[-1].id
+
+
+def init_app(app):
+    @app.cli.command('rebuild-revenue')
+    @click.option('--start', type=click.DateTime(['%Y-%m-%d']), default=None, help='First local date (widened to its month).')
+    @click.option('--end', type=click.DateTime(['%Y-%m-%d']), default=None, help='Local date to stop before (widened to a month end).')
+    @click.option('--batch-size', type=int, default=None)
+    def rebuild_revenue_command(start, end, batch_size):
+        """Rebuild revenue buckets from historical payments."""
+        batch_size = batch_size or app.config['REVENUE_BACKFILL_BATCH_SIZE']
+        print(f"Rebuilt revenue buckets from {rebuild(start, end, batch_size)} payments")
@@ -0,0 +1,120 @@
+from flask import current_app
+from sqlalchemy import func, case
+
+from db_helpers import upsert_add
+from models import db, Subscription, SubscriptionTier, TierSubscriptionCount, utc_now
+
+counts = TierSubscriptionCount.__table__
+
+
+def tier_counts_query(tier_type):
+    """Active/total subscription counts per tier in one GROUP BY query."""
+    return db.session.query(
+        SubscriptionTier.id,
+        SubscriptionTier.name,
+        SubscriptionTier.price,
+        SubscriptionTier.duration_days,
+        func.count(case((Subscription.status == 'active', Subscription.id))).label('active_count'),
+        func.count(Subscription.id).label('total_count')
+    ).outerjoin(Subscription, Subscription.tier_id == SubscriptionTier.id) \
+     .filter(SubscriptionTier.tier_type == tier_type) \
+     .group_by(SubscriptionTier.id) \
+     .order_by(SubscriptionTier.id)
+
+
+def rollup_counts_query(tier_type):
+    """Same shape as tier_counts_query, read from the rollup table."""
+    return db.session.query(
+        SubscriptionTier.id,
+        SubscriptionTier.name,
+        SubscriptionTier.price,
+        SubscriptionTier.duration_days,
+        func.coalesce(TierSubscriptionCount.active_count, 0).label('active_count'),
+        func.coalesce(TierSubscriptionCount.total_count, 0).label('total_count')
+    ).outerjoin(TierSubscriptionCount, TierSubscriptionCount.tier_id == SubscriptionTier.id) \
+     .filter(SubscriptionTier.tier_type == tier_type) \
+     .order_by(SubscriptionTier.id)
+
+
+def _bump(tier_id, active_delta, total_delta):
+    """Apply a delta to one tier's counters, creating the row on first use.
+
+    Runs inside the caller's transaction so the counters commit (or roll
+    back) together with the subscription change that caused them. A new
+    row starts from the delta itself, even a negative one, so an expiry
+    that arrives before the row exists isn't lost.
+    """
+    upsert_add(counts, dict(tier_id=tier_id),
+               dict(active_count=active_delta, total_count=total_delta),
+               dict(updated_at=utc_now()))
+
+
+def enabled():
+    return current_app.config['TIER_ROLLUP_ENABLED']
+
+
+def record_subscription_started(tier_id):
+    if enabled():
+        _bump(tier_id, 1, 1)
+
+
+def record_subscriptions_ended(tier_ids):
+    """Decrement active counters for each expired subscription's tier."""
+    if not enabled():
+        return
+    per_tier = {}
+    for tier_id in tier_ids:
+        per_tier[tier_id] = per_tier.get(tier_id, 0) + 1
+    for tier_id, n in per_tier.items():
+        _bump(tier_id, -n, 0)
+
+
+def forget_tier(tier_id):
+    db.session.execute(counts.delete().where(counts.c.tier_id == tier_id))
+
+
+def rebuild_tier_counts():
+    """Recompute every counter from the subscriptions table.
+
+    Returns the tiers whose stored counters had drifted, as
+    {tier_id: ((stored_active, stored_total), (actual_active, actual_total))}.
+    """
+    actual = {
+        row.tier_id: (row.active_count, row.total_count)
+        for row in db.session.query(
+            Subscription.tier_id,
+            func.count(case((Subscription.status == 'active', Subscription.id))).label('active_count'),
+            func.count(Subscription.id).label('total_count')
+        ).group_by(Subscription.tier_id)
+    }
+    stored = {
+        row.tier_id: (row.active_count, row.total_count)
+        for row in db.session.execute(counts.select())
+    }
+
+    drift = {
+        tier_id: (stored.get(tier_id, (0, 0)), actual.get(tier_id, (0, 0)))
+        for tier_id in set(actual) | set(stored)
+        if stored.get(tier_id, (0, 0)) != actual.get(tier_id, (0, 0))
+    }
+
+    db.session.execute(counts.delete())
+    if actual:
+        now = utc_now()
+        db.session.execute(counts.insert(), [
+            {'tier_id': tier_id, 'active_count': a, 'total_count': t, 'updated_at': now}
+            for tier_id, (a, t) in actual.items()
+        ])
+    db.session.commit()
+    return drift
+
+
+def init_app(app):
+    @app.cli.command('rebuild-tier-rollups')
+    def rebuild_tier_rollups_command():
+        """Rebuild tier subscription counters and report any drift."""
+        drift = rebuild_tier_counts()
+        if not drift:
+            print("Tier rollups were consistent")
+        for tier_id, (stored, actual) in sorted(drift.items()):
+            print(f"Tier {tier_id}: stored active/total {stored} -> actual {actual}")
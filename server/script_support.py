@@ -0,0 +1,33 @@
+"""Environment setup shared by the check, bench, load and seed scripts.
+
+Call script_env() before importing app: config.py reads the environment at
+import time and app.py starts the background workers then.
+"""
+import os
+import tempfile
+
+# Background workers the scripts don't exercise; the caller's environment
+# or script_env()'s keyword arguments can still turn them back on
+WORKERS_OFF = {
+    'EXPIRY_SCHEDULER_ENABLED': 'false',
+    'LOYALTY_COMPACTION_SECONDS': '0',
+    'USAGE_ROLLUP_SECONDS': '0',
+    'PAYMENT_WORKER_ENABLED': 'false',
+    'FANOUT_RECOVERY_SECONDS': '0',
+}
+
+
+def script_env(db_name=None, database_url=None, **settings):
+    """Point DATABASE_URL at `database_url`, or else at a fresh SQLite file
+    named `db_name` in a temporary directory (left alone if both are None),
+    default the background workers to off, then set `settings` as
+    environment variables. Returns the database URL in use."""
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+    elif db_name:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), db_name)}"
+    for key, value in WORKERS_OFF.items():
+        os.environ.setdefault(key, value)
+    for key, value in settings.items():
+        os.environ[key] = str(value)
+    return os.environ.get('DATABASE_URL')
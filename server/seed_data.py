@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Bulk synthetic data for load testing.
+
+Like create_admin.py, but for volume: core bulk INSERTs (no ORM objects)
+generate --users users with subscriptions, payments, notifications,
+feedback, complaints, loyalty balances and router usage, then rebuild the
+tier counters, revenue buckets and usage rollups so every endpoint sees
+consistent data. The same --seed gives the same data.
+
+All seeded users, plus a seeded admin, share --password. A manifest with
+the ids and credentials the benchmark needs is written to --manifest.
+
+Seeds the database the app is configured for (DATABASE_URL), like
+create_admin.py, unless --database-url is given:
+
+    python seed_data.py --users 5000 --manifest seed.json
+"""
+import argparse
+import json
+import random
+import time
+from datetime import timedelta
+
+from script_support import script_env
+
+CHUNK = 5000
+LOCATIONS = ['Nairobi CBD', 'Westlands', 'Kilimani', 'Karen', 'Rongai', 'Kitengela', 'Thika', 'Ruaka']
+TIERS = [
+    # name, price, duration (hours), tier type, speed
+    ('1 Hour', 10, 1, 'hotspot', 5),
+    ('Daily', 50, 24, 'hotspot', 5),
+    ('Weekly', 300, 168, 'hotspot', 10),
+    ('Monthly Hotspot', 1000, 720, 'hotspot', 10),
+    ('Home 10 Mbps', 1500, 720, 'home_internet', 10),
+    ('Home 30 Mbps', 3000, 720, 'home_internet', 30),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--subscriptions', type=int, default=3, help='Per user')
+    parser.add_argument('--notifications', type=int, default=10, help='Per user')
+    parser.add_argument('--feedback', type=float, default=0.5, help='Feedbacks and complaints per user')
+    parser.add_argument('--usage', type=int, default=20, help='Usage records per user')
+    parser.add_argument('--days', type=int, default=30, help='Spread timestamps over this many past days')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default='loadtest123')
+    parser.add_argument('--skip-rollups', action='store_true', help="Don't rebuild usage rollups")
+    parser.add_argument('--manifest', help='Write ids and credentials here as JSON')
+    parser.add_argument('--database-url', help='Seed this database instead of the configured one')
+    return parser.parse_args()
+
+
+def insert_chunks(table, rows):
+    from models import db
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[start:start + CHUNK])
+
+
+def seed(users=1000, subscriptions=3, notifications=10, feedback=0.5, usage=20, days=30, seed=1,
+         password='loadtest123', skip_rollups=False, log=print):
+    """Seed one batch of synthetic data; returns the manifest. Needs an app context."""
+    from sqlalchemy import select
+    from db_helpers import utc_naive_now
+    from models import (db, User, SubscriptionTier, Subscription, Payment, Notification, Feedback,
+                        Complaint, LoyaltyPoint)
+    from hashing import password_hasher
+    import revenue
+    import rollups
+    import usage_ingest
+    import usage_rollups
+
+    rng = random.Random(seed)
+    now = utc_naive_now()
+    earliest = now - timedelta(days=days)
+    span = int((now - earliest).total_seconds())
+    # Unique per run, so seeding twice adds a second batch instead of colliding
+    run = f"{seed}-{time.time_ns() % 10 ** 8}"
+    password_hash = password_hasher.hash(password)
+    timings = {}
+
+    def step(name, began):
+        timings[name] = round(time.perf_counter() - began, 2)
+        log(f"  {name}: {timings[name]:.2f}s")
+
+    def moment():
+        return earliest + timedelta(seconds=rng.randrange(span))
+
+    began = time.perf_counter()
+    insert_chunks(SubscriptionTier.__table__, [
+        dict(name=f'{name} ({run})', price=price, duration_days=hours, tier_type=tier_type, speed_limit=speed,
+             description=f'Synthetic {name.lower()} plan', created_at=now, updated_at=now)
+        for name, price, hours, tier_type, speed in TIERS
+    ])
+    tiers = db.session.execute(
+        select(SubscriptionTier.id, SubscriptionTier.price, SubscriptionTier.duration_days, SubscriptionTier.tier_type)
+        .where(SubscriptionTier.name.like(f'% ({run})')).order_by(SubscriptionTier.id)
+    ).all()
+
+    admin_email = f'load-admin-{run}@example.com'
+    user_rows = [dict(name=f'Load Admin {run}', email=admin_email, phone_number=None, password_hash=password_hash,
+                      role='admin', status='active', created_at=now, updated_at=now)]
+    for i in range(users):
+        joined = moment()
+        user_rows.append(dict(
+            name=f'Load User {i}', email=f'load-{run}-{i}@example.com', phone_number=f'07{rng.randrange(10 ** 8):08d}',
+            password_hash=password_hash, role='user', status='active' if rng.random() < 0.9 else 'inactive',
+            created_at=joined, updated_at=joined
+        ))
+    insert_chunks(User.__table__, user_rows)
+    ids = db.session.execute(
+        select(User.id, User.email).where(User.email.like(f'load-%{run}%')).order_by(User.id)
+    ).all()
+    admin_id = next(row.id for row in ids if row.email == admin_email)
+    user_ids = [row.id for row in ids if row.id != admin_id]
+    step('tiers and users', began)
+
+    began = time.perf_counter()
+    subscription_rows = []
+    for user_id in user_ids:
+        for n in range(subscriptions):
+            tier = rng.choice(tiers)
+            start = moment()
+            end = start + timedelta(hours=tier.duration_days)
+            latest = n == subscriptions - 1
+            if latest:  # the newest one is still running for most users
+                start = now - timedelta(hours=rng.uniform(0, tier.duration_days))
+                end = start + timedelta(hours=tier.duration_days)
+            subscription_rows.append(dict(
+                user_id=user_id, tier_id=tier.id, start_date=start, end_date=end,
+                status='active' if latest and end > now else 'expired', created_at=start
+            ))
+    insert_chunks(Subscription.__table__, subscription_rows)
+    step('subscriptions', began)
+
+    began = time.perf_counter()
+    price = {tier.id: tier.price for tier in tiers}
+    insert_chunks(Payment.__table__, [
+        dict(user_id=row['user_id'], amount=price[row['tier_id']], payment_method='mpesa',
+             transaction_reference=f'LOAD{run}{i}', status='success', tier_id=row['tier_id'],
+             created_at=row['start_date'])
+        for i, row in enumerate(subscription_rows)
+    ])
+    points = {}
+    for row in subscription_rows:
+        points[row['user_id']] = points.get(row['user_id'], 0) + int(price[row['tier_id']] * 10)
+    insert_chunks(LoyaltyPoint.__table__, [
+        dict(user_id=user_id, points_earned=earned, points_redeemed=0, balance=earned, last_event_id=0,
+             last_updated=now)
+        for user_id, earned in points.items()
+    ])
+    step('payments and loyalty', began)
+
+    began = time.perf_counter()
+    insert_chunks(Notification.__table__, [
+        dict(user_id=user_id, message=f'Your subscription expires in {rng.randint(1, 59)} minutes.',
+             channel='notification', type=rng.choice(['expiry', 'payment', 'promo']),
+             status='read' if rng.random() < 0.6 else 'unread', created_at=moment())
+        for user_id in user_ids for _ in range(notifications)
+    ])
+    feedback_count = int(users * feedback)
+    insert_chunks(Feedback.__table__, [
+        dict(user_id=rng.choice(user_ids), type=rng.choice(['feedback', 'complaint']),
+             subscription_type=rng.choice(['hotspot', 'home_internet']), subject=f'Synthetic feedback {i}',
+             rating=rng.randint(1, 5), comment='Speed drops in the evening.', status='pending',
+             created_at=created, updated_at=created)
+        for i, created in ((i, moment()) for i in range(feedback_count))
+    ])
+    insert_chunks(Complaint.__table__, [
+        dict(user_id=rng.choice(user_ids), subject=f'Synthetic complaint {i}',
+             description='Connection keeps dropping.', status='pending', created_at=created, updated_at=created)
+        for i, created in ((i, moment()) for i in range(feedback_count))
+    ])
+    step('notifications, feedback and complaints', began)
+
+    began = time.perf_counter()
+    usage_rows = []
+    for user_id in user_ids:
+        for _ in range(usage):
+            ts = moment()
+            usage_rows.append(dict(
+                user_id=user_id, data_used_mb=round(rng.lognormvariate(4, 1.2), 2),
+                session_duration=rng.randint(30, 4 * 3600),
+                most_used_hours=f"{ts.hour:02d}-{(ts.hour + 1) % 24:02d}", location=rng.choice(LOCATIONS),
+                timestamp=ts
+            ))
+    for start in range(0, len(usage_rows), CHUNK):
+        usage_ingest.insert(usage_rows[start:start + CHUNK])
+    db.session.commit()
+    step('usage', began)
+
+    began = time.perf_counter()
+    rollups.rebuild_tier_counts()
+    revenue.rebuild()
+    if not skip_rollups:
+        usage_rollups.process_queue()
+    step('tier counters, revenue buckets and usage rollups', began)
+
+    def ids_of(model):
+        return db.session.execute(
+            select(model.id).where(model.user_id.in_(select(User.id).where(User.email.like(f'load-%{run}%'))))
+            .order_by(model.id).limit(1000)
+        ).scalars().all()
+
+    return {
+        'run': run,
+        'seed': seed,
+        'password': password,
+        'admin': {'id': admin_id, 'email': admin_email},
+        'user_ids': user_ids,
+        'user_email': f'load-{run}-{{i}}@example.com',  # i = position in user_ids
+        'tier_ids': [tier.id for tier in tiers],
+        'feedback_ids': ids_of(Feedback),
+        'complaint_ids': ids_of(Complaint),
+        'notification_ids': ids_of(Notification),
+        'counts': {
+            'users': len(user_ids),
+            'subscriptions': len(subscription_rows),
+            'notifications': len(user_ids) * notifications,
+            'feedback': feedback_count,
+            'complaints': feedback_count,
+            'usage': len(usage_rows),
+        },
+        'timings': timings,
+    }
+
+
+def main():
+    args = parse_args()
+    script_env(database_url=args.database_url)
+
+    from app import app
+
+    began = time.perf_counter()
+    with app.app_context():
+        manifest = seed(args.users, args.subscriptions, args.notifications, args.feedback, args.usage, args.days,
+                        args.seed, args.password, args.skip_rollups)
+    counts = ', '.join(f"{n:,} {name}" for name, n in manifest['counts'].items())
+    print(f"✅ Seeded {counts} in {time.perf_counter() - began:.1f}s")
+    print(f"Admin: {manifest['admin']['email']} / {args.password}")
+    if args.manifest:
+        with open(args.manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Manifest: {args.manifest}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Concurrency stress test for loyalty point accounting.
+
+Fires hundreds of parallel purchases (POST /subscriptions) and redemptions
+(POST /loyalty/redeem) for the same users through the Flask test client,
+while the ledger compaction job folds events into snapshots, then checks
+that every balance reconciles with the requests that succeeded:
+
+    points_earned   == successful purchases * points per purchase
+    points_redeemed == successful redemptions * points per redemption
+                    == sum of Redemption.points_used
+    balance         == points_earned - points_redeemed >= 0
+
+Uses a throwaway SQLite database unless --database-url is given:
+
+    python stress_loyalty.py --purchases 400 --redemptions 400 --threads 32
+"""
+import argparse
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from script_support import script_env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--purchases', type=int, default=300)
+    parser.add_argument('--redemptions', type=int, default=300)
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--database-url', help='Run against this database instead of a temporary SQLite file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    script_env('stress_loyalty.db', args.database_url)
+
+    from app import app
+    from models import db, User, SubscriptionTier, Redemption
+    import loyalty
+
+    with app.app_context():
+        tier = SubscriptionTier(name='Stress 1 KSH', price=1, duration_days=1, tier_type='hotspot')
+        db.session.add(tier)
+        users = []
+        for i in range(args.users):
+            user = User(name=f'stress{i}', email=f'stress{i}-{random.random()}@example.com', role='user')
+            user.password_hash = 'x'  # never logs in
+            db.session.add(user)
+            users.append(user)
+        db.session.commit()
+        tier_id = tier.id
+        user_ids = [u.id for u in users]
+        earn_per_purchase = int(tier.price * 10)
+        cost_per_redemption = int(tier.price * 70)
+
+    client = app.test_client()
+    jobs = [('purchase', random.choice(user_ids)) for _ in range(args.purchases)]
+    jobs += [('redeem', random.choice(user_ids)) for _ in range(args.redemptions)]
+    random.shuffle(jobs)
+
+    def run(job):
+        kind, user_id = job
+        if kind == 'purchase':
+            r = client.post('/subscriptions', json={'user_id': user_id, 'tier_id': tier_id})
+            return kind, user_id, r.status_code == 201, r.status_code
+        r = client.post('/loyalty/redeem', json={'user_id': user_id, 'tier_id': tier_id})
+        return kind, user_id, r.status_code == 200, r.status_code
+
+    def compact_until_done(done):
+        while not done.is_set():
+            with app.app_context():
+                loyalty.compact(lag_seconds=0)
+
+    done = threading.Event()
+    compactor = threading.Thread(target=compact_until_done, args=(done,))
+    compactor.start()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(run, jobs))
+    done.set()
+    compactor.join()
+
+    errors = [r for r in results if r[3] >= 500]
+    failures = []
+    with app.app_context():
+        for user_id in user_ids:
+            purchases = sum(1 for k, u, ok, _ in results if k == 'purchase' and u == user_id and ok)
+            redemptions = sum(1 for k, u, ok, _ in results if k == 'redeem' and u == user_id and ok)
+            lp = loyalty.get_summary(user_id)
+            earned = lp.points_earned if lp else 0
+            redeemed = lp.points_redeemed if lp else 0
+            balance = lp.balance if lp else 0
+            ledger = db.session.query(db.func.coalesce(db.func.sum(Redemption.points_used), 0)) \
+                .filter(Redemption.user_id == user_id).scalar()
+
+            print(f"user {user_id}: {purchases} purchases, {redemptions} redemptions, "
+                  f"earned={earned} redeemed={redeemed} balance={balance}")
+            checks = [
+                (earned == purchases * earn_per_purchase, 'points_earned does not match purchases'),
+                (redeemed == redemptions * cost_per_redemption, 'points_redeemed does not match redemptions'),
+                (redeemed == ledger, 'points_redeemed does not match Redemption rows'),
+                (balance == earned - redeemed, 'balance != earned - redeemed'),
+                (balance >= 0, 'negative balance'),
+            ]
+            failures += [f"user {user_id}: {msg}" for ok, msg in checks if not ok]
+
+    print(f"{len(results)} requests, {len(errors)} server errors")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures or errors:
+        sys.exit(1)
+    print("OK: all balances reconcile")
+
+
+if __name__ == '__main__':
+    main()
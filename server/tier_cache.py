@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, SubscriptionTier
+
+
+class TierCache:
+    """In-process cache of the serialized tier list, one entry per tier_type.
+
+    Each entry is stamped with the catalog version it was built from. The
+    version is a cheap aggregate over subscription_tiers (row count, max id,
+    max updated_at), so a tier created, edited or deleted through another
+    gunicorn worker is noticed on the next check. Checks are throttled to
+    one every TIER_CACHE_CHECK_SECONDS; writes in this worker invalidate
+    immediately.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        interval = current_app.config['TIER_CACHE_CHECK_SECONDS']
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < interval:
+            return self._version
+
+        count, max_id, max_updated = db.session.query(
+            func.count(SubscriptionTier.id),
+            func.max(SubscriptionTier.id),
+            func.max(SubscriptionTier.updated_at)
+        ).one()
+        version = (count, max_id, max_updated)
+
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+        return version
+
+    def get(self, tier_type, build):
+        """Return (body, etag) for tier_type, calling build() on a miss.
+
+        build() must return the JSON-serializable tier list.
+        """
+        version = self._current_version()
+        entry = self._entries.get(tier_type)
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+
+        body = current_app.json.dumps(build()).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            if self._version == version:
+                self._entries[tier_type] = (version, body, etag)
+        return body, etag
+
+    def invalidate(self):
+        """Drop every cached entry and force a version check on the next read."""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            self._checked_at = 0.0
+
+
+tier_cache = TierCache()
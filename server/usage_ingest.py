@@ -0,0 +1,282 @@
+"""Batch ingest of router usage records into usage_patterns.
+
+The request body (NDJSON or CSV, one session record per line) is read as a
+stream and cut into batches of USAGE_INGEST_BATCH_SIZE rows. Each batch is
+validated column by column (one pass per field, one users lookup for the
+whole batch), then the valid rows go in with a single COPY on Postgres or
+a core executemany elsewhere, and the batch is committed on its own
+together with its usage rollup queue entries. Invalid rows are skipped
+and reported per batch.
+"""
+import csv
+import hmac
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+from itertools import islice
+
+from flask import current_app, jsonify, request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt
+from sqlalchemy import select
+
+from db_helpers import parse_naive_utc, utc_naive_now
+from models import db, User, UsagePattern
+import usage_rollups
+
+usage_patterns = UsagePattern.__table__
+users = User.__table__
+
+READ_SIZE = 64 * 1024
+
+FIELDS = ['user_id', 'data_used_mb', 'session_duration', 'most_used_hours', 'location', 'timestamp']
+
+
+class BatchError(ValueError):
+    """A line that could not be parsed at all."""
+
+
+def ingest_auth(fn):
+    """Routers send the shared USAGE_INGEST_TOKEN in X-Ingest-Token; admins
+    can use their JWT instead."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_app.config['USAGE_INGEST_TOKEN']
+        sent = request.headers.get('X-Ingest-Token')
+        if token and sent and hmac.compare_digest(sent, token):
+            return fn(*args, **kwargs)
+        verify_jwt_in_request()
+        if get_jwt().get('role') != 'admin':
+            return jsonify({"error": "Admins only"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _decode(data, bad, position):
+    """Lines of a block of complete lines. Lines that aren't valid UTF-8
+    are decoded with replacement characters and their position (counting
+    non-blank lines from 1) is added to bad."""
+    try:
+        lines = io.StringIO(data.decode('utf-8'), newline='')
+    except UnicodeDecodeError:
+        lines = None
+    if lines is not None:
+        for line in lines:
+            if line.strip():
+                position += 1
+                yield position, line
+        return
+    for raw in io.BytesIO(data):
+        try:
+            line = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            line = raw.decode('utf-8', 'replace')
+            if line.strip():
+                bad.add(position + 1)
+        if line.strip():
+            position += 1
+            yield position, line
+
+
+def _lines(bad):
+    """Non-blank lines of the request body, read in READ_SIZE blocks (under
+    gunicorn request.stream is the server's own body reader, which
+    io.TextIOWrapper can't wrap, and line-by-line reads are slow)."""
+    stream = request.stream
+    pending = b''
+    position = 0
+    while True:
+        chunk = stream.read(READ_SIZE)
+        data = pending + chunk
+        if chunk:
+            cut = data.rfind(b'\n') + 1
+            data, pending = data[:cut], data[cut:]
+        for position, line in _decode(data, bad, position):
+            yield line
+        if not chunk:
+            return
+
+
+def parse_records(fmt):
+    """Yield (line_number, dict or BatchError) from the request body."""
+    bad = set()
+    if fmt == 'csv':
+        reader = csv.DictReader(_lines(bad))
+        consumed = 1
+        for line_number, record in enumerate(reader, start=2):
+            # A quoted field can span lines, so check every line of the record
+            first, consumed = consumed + 1, reader.line_num
+            if bad and any(n in bad for n in range(first, consumed + 1)):
+                yield line_number, BatchError('invalid UTF-8')
+            elif None in record:
+                yield line_number, BatchError('too many columns')
+            else:
+                yield line_number, record
+        return
+
+    for line_number, line in enumerate(_lines(bad), start=1):
+        if line_number in bad:
+            yield line_number, BatchError('invalid UTF-8')
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, BatchError('invalid JSON')
+            continue
+        yield line_number, record if isinstance(record, dict) else BatchError('expected a JSON object')
+
+
+def _blank(value):
+    return value is None or value == ''
+
+
+def _int(value):
+    if _blank(value):
+        return None
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError
+    return int(value)
+
+
+def _decimal(value):
+    if _blank(value):
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError
+    if not number.is_finite() or number < 0 or number >= Decimal('1e8'):
+        raise ValueError
+    return number.quantize(Decimal('0.01'))
+
+
+def _timestamp(value):
+    if _blank(value):
+        return None
+    return parse_naive_utc(value)
+
+
+def _text(limit):
+    def convert(value):
+        if _blank(value):
+            return None
+        value = str(value)
+        if len(value) > limit:
+            raise ValueError
+        return value
+    return convert
+
+
+CONVERTERS = {
+    'user_id': _int,
+    'data_used_mb': _decimal,
+    'session_duration': _int,
+    'most_used_hours': _text(50),
+    'location': _text(100),
+    'timestamp': _timestamp,
+}
+
+
+def validate(batch):
+    """Validate a batch column by column.
+
+    Returns (rows, errors): rows are insertable dicts, errors are
+    (line_number, message) pairs for the rejected lines.
+    """
+    errors = {}
+    parsed = [(n, r) for n, r in batch if not isinstance(r, BatchError)]
+    for n, r in batch:
+        if isinstance(r, BatchError):
+            errors[n] = str(r)
+
+    columns = {}
+    for field, convert in CONVERTERS.items():
+        values = []
+        for n, record in parsed:
+            try:
+                values.append(convert(record.get(field)))
+            except (TypeError, ValueError):
+                errors.setdefault(n, f"invalid {field}")
+                values.append(None)
+        columns[field] = values
+
+    for i, duration in enumerate(columns['session_duration']):
+        if duration is not None and duration < 0:
+            errors.setdefault(parsed[i][0], 'invalid session_duration')
+
+    # One lookup for every user id in the batch
+    wanted = {u for u in columns['user_id'] if u is not None}
+    known = set(db.session.execute(select(users.c.id).where(users.c.id.in_(wanted))).scalars()) if wanted else set()
+    now = utc_naive_now()
+    rows = []
+    for i, (n, _) in enumerate(parsed):
+        user_id = columns['user_id'][i]
+        if user_id is None:
+            errors.setdefault(n, 'user_id is required')
+        elif user_id not in known:
+            errors.setdefault(n, 'unknown user_id')
+        if n in errors:
+            continue
+        row = {field: columns[field][i] for field in FIELDS}
+        row['timestamp'] = row['timestamp'] or now
+        rows.append(row)
+    return rows, sorted(errors.items())
+
+
+def _copy(rows):
+    """COPY rows into usage_patterns over the session's psycopg2 connection."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[f] is None else row[f] for f in FIELDS])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY usage_patterns ({', '.join(FIELDS)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insert(rows):
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2':
+        _copy(rows)
+    else:
+        db.session.execute(usage_patterns.insert(), rows)
+    usage_rollups.enqueue(rows)
+
+
+def ingest(fmt):
+    """Ingest the request body in batches; returns a report per batch."""
+    batch_size = current_app.config['USAGE_INGEST_BATCH_SIZE']
+    max_errors = current_app.config['USAGE_INGEST_MAX_ERRORS']
+    records = parse_records(fmt)
+    report = []
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        rows, errors = validate(batch)
+        try:
+            insert(rows)
+            db.session.commit()
+            inserted = len(rows)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Usage ingest batch %s failed', len(report) + 1)
+            inserted = 0
+            errors = [(batch[0][0], f"batch failed: {e.__class__.__name__}")] + errors
+        report.append({
+            "batch": len(report) + 1,
+            "first_line": batch[0][0],
+            "received": len(batch),
+            "inserted": inserted,
+            "rejected": len(batch) - inserted,
+            "errors": [{"line": n, "error": msg} for n, msg in errors[:max_errors]]
+        })
+    return report
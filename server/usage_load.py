@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Synthetic load generator for POST /usage/batch.
+
+Generates router session records for random users and posts them in
+requests of --per-request rows, then reports rows/sec. A small share of
+rows can be corrupted (--bad) to exercise per-batch error reporting.
+
+Runs in-process against a throwaway SQLite database by default:
+
+    python usage_load.py --rows 200000 --format csv
+
+or against a running server (needs USAGE_INGEST_TOKEN set there):
+
+    python usage_load.py --url https://api.example.com --token $USAGE_INGEST_TOKEN
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import sys
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+from script_support import script_env
+
+LOCATIONS = ['Nairobi CBD', 'Westlands', 'Kilimani', 'Karen', 'Rongai', 'Kitengela', 'Thika', 'Ruaka']
+FIELDS = ['user_id', 'data_used_mb', 'session_duration', 'most_used_hours', 'location', 'timestamp']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--per-request', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000, help='Users to create (in-process mode)')
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--bad', type=float, default=0.0, help='Fraction of rows to corrupt')
+    parser.add_argument('--url', help='Post to this server instead of an in-process app')
+    parser.add_argument('--token', help='X-Ingest-Token for --url')
+    parser.add_argument('--user-ids', help='Comma-separated user ids to use with --url (default 1..--users)')
+    return parser.parse_args()
+
+
+def records(count, user_ids, bad):
+    now = datetime.now(timezone.utc)
+    for _ in range(count):
+        start = now - timedelta(seconds=random.randint(0, 7 * 24 * 3600))
+        record = {
+            'user_id': random.choice(user_ids),
+            'data_used_mb': round(random.lognormvariate(4, 1.2), 2),
+            'session_duration': random.randint(30, 4 * 3600),
+            'most_used_hours': f"{start.hour:02d}-{(start.hour + 1) % 24:02d}",
+            'location': random.choice(LOCATIONS),
+            'timestamp': start.isoformat(),
+        }
+        if bad and random.random() < bad:
+            record[random.choice(['user_id', 'data_used_mb', 'session_duration', 'timestamp'])] = 'garbage'
+        yield record
+
+
+def encode(rows, fmt):
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(r) + '\n' for r in rows).encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def in_process_poster(args):
+    token = 'usage-load'
+    script_env('usage_load.db', USAGE_INGEST_TOKEN=token)
+
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            dict(name=f'router user {i}', email=f'usage-load-{i}@example.com', role='user', status='active')
+            for i in range(args.users)
+        ])
+        db.session.commit()
+        user_ids = [u for (u,) in db.session.query(User.id).filter(User.role == 'user')]
+
+    client = app.test_client()
+
+    def post(body):
+        r = client.post(f'/usage/batch?format={args.format}', data=body, headers={'X-Ingest-Token': token})
+        return r.status_code, r.get_json()
+
+    def count_rows():
+        from models import UsagePattern
+        with app.app_context():
+            return UsagePattern.query.count()
+
+    return user_ids, post, count_rows
+
+
+def remote_poster(args):
+    user_ids = [int(u) for u in args.user_ids.split(',')] if args.user_ids else list(range(1, args.users + 1))
+    content_type = 'text/csv' if args.format == 'csv' else 'application/x-ndjson'
+
+    def post(body):
+        req = urllib.request.Request(
+            f"{args.url.rstrip('/')}/usage/batch?format={args.format}", data=body, method='POST',
+            headers={'Content-Type': content_type, 'X-Ingest-Token': args.token or ''}
+        )
+        with urllib.request.urlopen(req) as r:
+            return r.status, json.loads(r.read())
+
+    return user_ids, post, None
+
+
+def main():
+    args = parse_args()
+    user_ids, post, count_rows = remote_poster(args) if args.url else in_process_poster(args)
+
+    generated = records(args.rows, user_ids, args.bad)
+    inserted = rejected = 0
+    encode_seconds = post_seconds = 0.0
+    sent = 0
+    while sent < args.rows:
+        chunk = [next(generated) for _ in range(min(args.per_request, args.rows - sent))]
+        sent += len(chunk)
+
+        start = time.perf_counter()
+        body = encode(chunk, args.format)
+        encode_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        status, result = post(body)
+        post_seconds += time.perf_counter() - start
+        if status != 200:
+            print(f"request failed with {status}: {result}")
+            sys.exit(1)
+        inserted += result['inserted']
+        rejected += result['rejected']
+        for batch in result['batches']:
+            for error in batch['errors'][:3]:
+                print(f"  line {error['line']} of request: {error['error']}")
+
+    print(f"{sent} rows sent ({args.format}), {inserted} inserted, {rejected} rejected")
+    print(f"server side: {post_seconds:.2f}s, {sent / post_seconds:,.0f} rows/sec "
+          f"(client encoding took {encode_seconds:.2f}s)")
+    if count_rows is not None and count_rows() != inserted:
+        print(f"FAIL usage_patterns holds {count_rows()} rows, expected {inserted}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
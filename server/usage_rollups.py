@@ -0,0 +1,454 @@
+"""Hourly and daily usage rollups.
+
+Every batch written to usage_patterns also queues its (user, hour) pairs
+in usage_rollup_queue, in the same transaction. The rollup worker takes
+queued pairs in batches and recomputes just those buckets from the raw
+rows: the hour buckets that were queued and the day buckets containing
+them, per location and tier. Late-arriving rows simply queue their
+(old) hour again, so only the buckets they touch are recomputed.
+
+Each rollup row stores sums and counts plus exact p50/p95 session length
+for its own bucket, and a fixed-bin session-length histogram. Histograms
+add up across rows, so the analytics endpoint can report approximate
+percentiles for any grouping without going back to the raw table.
+
+usage_group_rollups holds the same figures merged across users, one row
+per (bucket, location, tier). Each recompute adds the difference between
+the per-user rows it replaced and the ones it wrote, so keeping it current
+costs the same however many users share a bucket. Analytics that aren't
+about a user read only that table.
+"""
+import json
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+import click
+from sqlalchemy import select, and_, or_, bindparam, func, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Subscription, UsagePattern, UsageRollup, UsageGroupRollup, UsageRollupQueue, utc_now
+
+usage_patterns = UsagePattern.__table__
+rollups = UsageRollup.__table__
+group_rollups = UsageGroupRollup.__table__
+queue = UsageRollupQueue.__table__
+subscriptions = Subscription.__table__
+
+# Upper edges (seconds) of the session-length histogram bins; the last bin is open-ended
+BIN_EDGES = [30, 60, 120, 300, 600, 900, 1800, 2700, 3600, 5400, 7200,
+             10800, 14400, 21600, 28800, 43200, 86400]
+
+
+def hour_of(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def enqueue(rows):
+    """Queue the (user, hour) buckets touched by freshly inserted usage rows.
+    Runs in the caller's transaction."""
+    buckets = {(row['user_id'], hour_of(row['timestamp'])) for row in rows}
+    if buckets:
+        now = utc_now()
+        db.session.execute(queue.insert(), [
+            {'user_id': user_id, 'bucket_start': hour, 'created_at': now} for user_id, hour in buckets
+        ])
+
+
+def percentile(ordered, q):
+    """Linear-interpolated percentile of an already sorted sequence (the
+    same definition as numpy.percentile's default)."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def histogram(durations):
+    counts = [0] * (len(BIN_EDGES) + 1)
+    for duration in durations:
+        counts[bisect_right(BIN_EDGES, duration)] += 1
+    return counts
+
+
+def histogram_percentile(counts, q):
+    """Approximate percentile from merged histogram bins, interpolating
+    linearly inside the bin that holds it."""
+    total = sum(counts)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= target:
+            low = BIN_EDGES[i - 1] if i else 0
+            high = BIN_EDGES[i] if i < len(BIN_EDGES) else low
+            return low + (high - low) * (target - seen) / count
+        seen += count
+    return float(BIN_EDGES[-1])
+
+
+def _tier_lookup(user_ids, start, end):
+    """Function (user_id, ts) -> tier id of the subscription active at ts, or 0."""
+    periods = defaultdict(list)
+    for row in db.session.execute(
+        select(subscriptions.c.user_id, subscriptions.c.tier_id,
+               subscriptions.c.start_date, subscriptions.c.end_date)
+        .where(subscriptions.c.user_id.in_(user_ids),
+               subscriptions.c.start_date < end,
+               or_(subscriptions.c.end_date.is_(None), subscriptions.c.end_date >= start))
+        .order_by(subscriptions.c.start_date)
+    ):
+        periods[row.user_id].append(row)
+    starts = {u: [p.start_date for p in rows] for u, rows in periods.items()}
+
+    def tier_at(user_id, ts):
+        rows = periods.get(user_id)
+        if not rows:
+            return 0
+        i = bisect_right(starts[user_id], ts) - 1
+        # Walk back past subscriptions that had already ended at ts
+        while i >= 0:
+            if rows[i].end_date is None or rows[i].end_date > ts:
+                return rows[i].tier_id
+            i -= 1
+        return 0
+    return tier_at
+
+
+def _aggregate(samples):
+    """Rollup rows for each bucket key from its (duration, data_used_mb) samples."""
+    now = utc_now()
+    out = []
+    for key, rows in samples.items():
+        granularity, bucket_start, user_id, location, tier_id = key
+        durations = sorted(d for d, _ in rows)
+        out.append({
+            'granularity': granularity,
+            'bucket_start': bucket_start,
+            'user_id': user_id,
+            'location': location,
+            'tier_id': tier_id,
+            'sessions': len(rows),
+            'data_used_mb': sum((mb for _, mb in rows), Decimal('0')),
+            'session_seconds': sum(durations),
+            'p50_session': percentile(durations, 0.5),
+            'p95_session': percentile(durations, 0.95),
+            'histogram': json.dumps(histogram(durations)),
+            'updated_at': now,
+        })
+    return out
+
+
+def _merge_histograms(histograms):
+    merged = [0] * (len(BIN_EDGES) + 1)
+    for counts in histograms:
+        merged = [a + b for a, b in zip(merged, json.loads(counts))]
+    return merged
+
+
+def _apply_to_groups(removed, added):
+    """Fold changed per-user rollup rows into usage_group_rollups: subtract
+    the rows `removed` and add the rows `added`. Only the group rows for the
+    affected (bucket, location, tier) keys are read and written, so the cost
+    doesn't depend on how many users share a bucket. Runs in the caller's
+    transaction."""
+    deltas = {}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            key = (row['granularity'], row['bucket_start'], row['location'], row['tier_id'])
+            delta = deltas.get(key)
+            if delta is None:
+                deltas[key] = delta = {'sessions': 0, 'data_used_mb': Decimal('0'), 'session_seconds': 0,
+                                       'histogram': [0] * (len(BIN_EDGES) + 1)}
+            delta['sessions'] += sign * row['sessions']
+            delta['data_used_mb'] += sign * (row['data_used_mb'] or 0)
+            delta['session_seconds'] += sign * row['session_seconds']
+            histogram = delta['histogram']
+            for i, count in enumerate(json.loads(row['histogram'])):
+                if count:
+                    histogram[i] += sign * count
+    if not deltas:
+        return
+
+    current = {}
+    for row in db.session.execute(
+        select(group_rollups.c.id, group_rollups.c.granularity, group_rollups.c.bucket_start,
+               group_rollups.c.location, group_rollups.c.tier_id, group_rollups.c.sessions,
+               group_rollups.c.data_used_mb, group_rollups.c.session_seconds, group_rollups.c.histogram)
+        .where(tuple_(group_rollups.c.granularity, group_rollups.c.bucket_start,
+                      group_rollups.c.location, group_rollups.c.tier_id).in_(list(deltas)))
+        .with_for_update()
+    ):
+        current[(row.granularity, row.bucket_start, row.location, row.tier_id)] = row
+
+    now = utc_now()
+    inserts, updates, deletes = [], [], []
+    for key, delta in deltas.items():
+        row = current.get(key)
+        if row is not None:
+            totals = {
+                'sessions': row.sessions + delta['sessions'],
+                'data_used_mb': (row.data_used_mb or 0) + delta['data_used_mb'],
+                'session_seconds': row.session_seconds + delta['session_seconds'],
+                'histogram': [a + b for a, b in zip(json.loads(row.histogram), delta['histogram'])],
+            }
+        else:
+            totals = delta
+        if totals['sessions'] <= 0:
+            if row is not None:
+                deletes.append(row.id)
+            continue
+        values = dict(totals, histogram=json.dumps(totals['histogram']), updated_at=now,
+                      p50_session=histogram_percentile(totals['histogram'], 0.5),
+                      p95_session=histogram_percentile(totals['histogram'], 0.95))
+        if row is not None:
+            updates.append(dict(values, row_id=row.id))
+        else:
+            inserts.append(dict(values, granularity=key[0], bucket_start=key[1], location=key[2], tier_id=key[3]))
+
+    if deletes:
+        db.session.execute(group_rollups.delete().where(group_rollups.c.id.in_(deletes)))
+    if updates:
+        db.session.execute(group_rollups.update().where(group_rollups.c.id == bindparam('row_id')), updates)
+    if inserts:
+        db.session.execute(group_rollups.insert(), inserts)
+
+
+def rebuild_groups():
+    """Rebuild usage_group_rollups from scratch out of usage_rollups; returns
+    the number of group rows. Runs in the caller's transaction."""
+    db.session.execute(group_rollups.delete())
+    rows = db.session.execute(
+        select(rollups.c.granularity, rollups.c.bucket_start, rollups.c.location, rollups.c.tier_id,
+               rollups.c.sessions, rollups.c.data_used_mb, rollups.c.session_seconds, rollups.c.histogram)
+        .order_by(rollups.c.granularity, rollups.c.bucket_start, rollups.c.location, rollups.c.tier_id),
+        execution_options={'yield_per': 10000}
+    ).mappings()
+    # Whole groups per batch, so each group row is written once
+    batch = []
+    for _, group in groupby(rows, key=itemgetter('granularity', 'bucket_start', 'location', 'tier_id')):
+        batch.extend(group)
+        if len(batch) >= 10000:
+            _apply_to_groups([], batch)
+            batch = []
+    _apply_to_groups([], batch)
+    return db.session.execute(select(func.count()).select_from(group_rollups)).scalar()
+
+
+def recompute(hours):
+    """Rebuild the hour buckets in `hours` ({(user_id, hour_start)}) and the
+    day buckets that contain them, from the raw usage rows, then their
+    merged group rows. Runs in the caller's transaction."""
+    days = {(user_id, day_of(hour)) for user_id, hour in hours}
+    raw = db.session.execute(
+        select(usage_patterns.c.user_id, usage_patterns.c.timestamp, usage_patterns.c.location,
+               usage_patterns.c.session_duration, usage_patterns.c.data_used_mb)
+        .where(or_(*[
+            and_(usage_patterns.c.user_id == user_id,
+                 usage_patterns.c.timestamp >= day,
+                 usage_patterns.c.timestamp < day + timedelta(days=1))
+            for user_id, day in days
+        ]))
+    ).all()
+
+    tier_at = _tier_lookup(
+        {user_id for user_id, _ in days},
+        min(day for _, day in days), max(day for _, day in days) + timedelta(days=1)
+    )
+    samples = defaultdict(list)
+    for row in raw:
+        dims = (row.user_id, row.location or '', tier_at(row.user_id, row.timestamp))
+        sample = (row.session_duration or 0, row.data_used_mb or Decimal('0'))
+        samples[('day', day_of(row.timestamp)) + dims].append(sample)
+        hour = hour_of(row.timestamp)
+        if (row.user_id, hour) in hours:
+            samples[('hour', hour) + dims].append(sample)
+
+    # RETURNING gives exactly the rows this transaction replaced, for the group deltas
+    replaced = rollups.c.granularity, rollups.c.bucket_start, rollups.c.location, rollups.c.tier_id, \
+        rollups.c.sessions, rollups.c.data_used_mb, rollups.c.session_seconds, rollups.c.histogram
+    removed = db.session.execute(rollups.delete().where(
+        rollups.c.granularity == 'hour',
+        tuple_(rollups.c.user_id, rollups.c.bucket_start).in_(list(hours))
+    ).returning(*replaced)).mappings().all()
+    removed += db.session.execute(rollups.delete().where(
+        rollups.c.granularity == 'day',
+        tuple_(rollups.c.user_id, rollups.c.bucket_start).in_(list(days))
+    ).returning(*replaced)).mappings().all()
+    added = _aggregate(samples)
+    if added:
+        db.session.execute(rollups.insert(), added)
+    _apply_to_groups(removed, added)
+
+
+def process_queue(batch_size=500):
+    """Drain the rollup queue in batches; returns the number of buckets recomputed.
+
+    Queue rows are deleted by id, so a bucket queued again while its batch
+    is being recomputed stays queued for the next pass.
+    """
+    recomputed = 0
+    while True:
+        pending = db.session.execute(
+            select(queue.c.id, queue.c.user_id, queue.c.bucket_start)
+            # Grouped by user and time so a day's hours tend to land in one batch
+            .order_by(queue.c.user_id, queue.c.bucket_start).limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not pending:
+            break
+        hours = {(row.user_id, row.bucket_start) for row in pending}
+        try:
+            recompute(hours)
+            db.session.execute(queue.delete().where(queue.c.id.in_([row.id for row in pending])))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker rebuilt the same buckets concurrently; retry next pass
+            db.session.rollback()
+            break
+        recomputed += len(hours)
+    return recomputed
+
+
+def enqueue_all(start=None, end=None):
+    """Queue every (user, hour) with raw usage, optionally within [start, end)."""
+    stmt = select(usage_patterns.c.user_id, usage_patterns.c.timestamp)
+    if start:
+        stmt = stmt.where(usage_patterns.c.timestamp >= start)
+    if end:
+        stmt = stmt.where(usage_patterns.c.timestamp < end)
+    buckets = set()
+    for user_id, ts in db.session.execute(stmt, execution_options={'yield_per': 10000}):
+        if user_id is not None and ts is not None:
+            buckets.add((user_id, hour_of(ts)))
+    now = utc_now()
+    if buckets:
+        db.session.execute(queue.insert(), [
+            {'user_id': user_id, 'bucket_start': bucket, 'created_at': now} for user_id, bucket in buckets
+        ])
+    db.session.commit()
+    return len(buckets)
+
+
+class UsageRollupWorker:
+    """Runs process_queue() every USAGE_ROLLUP_SECONDS in a background thread."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+
+        @app.cli.command('rollup-usage')
+        @click.option('--rebuild', is_flag=True, help='Queue every bucket with raw usage first.')
+        @click.option('--start', type=click.DateTime(), default=None, help='With --rebuild: only from this UTC time.')
+        @click.option('--end', type=click.DateTime(), default=None, help='With --rebuild: only before this UTC time.')
+        @click.option('--rebuild-groups', 'groups', is_flag=True, help='Rebuild the location/tier rollups from the per-user ones.')
+        def rollup_usage_command(rebuild, start, end, groups):
+            """Recompute queued usage rollup buckets."""
+            if rebuild:
+                print(f"Queued {enqueue_all(start, end)} hourly buckets")
+            print(f"Recomputed {process_queue(app.config['USAGE_ROLLUP_BATCH_SIZE'])} hourly buckets")
+            if groups:
+                count = rebuild_groups()
+                db.session.commit()
+                print(f"Rebuilt {count} location/tier buckets")
+
+        if app.config['USAGE_ROLLUP_SECONDS']:
+            self._thread = threading.Thread(target=self._run, name='usage-rollups', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = self.app.config['USAGE_ROLLUP_SECONDS']
+        batch_size = self.app.config['USAGE_ROLLUP_BATCH_SIZE']
+        while not self._stop.wait(interval):
+            try:
+                with self.app.app_context():
+                    process_queue(batch_size)
+            except Exception:
+                self.app.logger.exception('Usage rollup pass failed')
+
+    def stop(self):
+        self._stop.set()
+
+
+usage_rollup_worker = UsageRollupWorker()
+
+
+def series(granularity, start, end, group_by=None, user_id=None, location=None, tier_id=None):
+    """Time series from the rollup tables only.
+
+    Returns one dict per (bucket, group) with sessions, data_used_mb,
+    session_seconds and p50/p95 session length. Sums and counts are done
+    in SQL. Queries about a user read usage_rollups; everything else reads
+    the per-location/tier usage_group_rollups, so its cost doesn't depend
+    on how many users there are. Percentiles come from the stored row
+    when a group is a single rollup row (exact for a user's own bucket),
+    otherwise they are estimated from the merged histograms of just the
+    groups that span several rows.
+    """
+    table = rollups if user_id is not None or group_by == 'user_id' else group_rollups
+    filters = [
+        table.c.granularity == granularity,
+        table.c.bucket_start >= start,
+        table.c.bucket_start < end
+    ]
+    if user_id is not None:
+        filters.append(table.c.user_id == user_id)
+    if location is not None:
+        filters.append(table.c.location == location)
+    if tier_id is not None:
+        filters.append(table.c.tier_id == tier_id)
+    keys = [table.c.bucket_start] + ([table.c[group_by]] if group_by else [])
+
+    totals = db.session.execute(
+        select(*keys, func.count().label('rows'), func.sum(table.c.sessions).label('sessions'),
+               func.sum(table.c.data_used_mb).label('data_used_mb'),
+               func.sum(table.c.session_seconds).label('session_seconds'),
+               func.min(table.c.p50_session).label('p50'), func.min(table.c.p95_session).label('p95'))
+        .where(*filters).group_by(*keys).order_by(*keys)
+    ).all()
+
+    merged = defaultdict(list)
+    spanning = [tuple(row)[:len(keys)] for row in totals if row.rows > 1]
+    if spanning:
+        for row in db.session.execute(
+            select(*keys, table.c.histogram).where(*filters, tuple_(*keys).in_(spanning))
+        ):
+            merged[tuple(row)[:-1]].append(row.histogram)
+
+    result = []
+    for row in totals:
+        key = tuple(row)[:len(keys)]
+        if row.rows == 1:
+            p50, p95 = row.p50, row.p95
+        else:
+            counts = _merge_histograms(merged[key])
+            p50, p95 = histogram_percentile(counts, 0.5), histogram_percentile(counts, 0.95)
+        item = {
+            'bucket_start': row.bucket_start.isoformat(),
+            'sessions': int(row.sessions),
+            'data_used_mb': float(row.data_used_mb or 0),
+            'session_seconds': int(row.session_seconds),
+            'p50_session': p50,
+            'p95_session': p95,
+        }
+        if group_by:
+            item[group_by] = key[1]
+        result.append(item)
+    return result